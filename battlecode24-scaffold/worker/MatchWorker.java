@@ -0,0 +1,310 @@
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.regex.Matcher;
+import java.util.regex.Pattern;
+
+/**
+ * Long-lived match worker used by the Python match-server pool (src/match_server.py).
+ *
+ * Instead of paying Gradle configuration and a cold JVM for every game, the pool starts this class once
+ * per worker slot with the engine's runtime classpath and then feeds it matches over stdin.
+ *
+ * Protocol (one request per line, tab separated):
+ *   <match id>\t<property>=<value>\t<property>=<value>...
+ * The properties are the same -Dbc.* settings the runWithoutBuild task passes to battlecode.server.Main,
+ * plus matchworker.robot-output, a file robot output is appended to (robot output is discarded without it).
+ * For every request the worker prints a single line
+ *   @@RESULT <match id> {"winner": "A", "winnerName": ..., "reason": ..., "rounds": ..., "error": ..., "teams": ...,
+ *                        "games": [{"winner": ..., "winnerName": ..., "reason": ..., "rounds": ...}, ...]}
+ * "teams" holds per-team robot output counts, and the bytecode profile the generated bots print (src/template.py):
+ * robots, turns, bytecodes, the most bytecodes of a single turn, turns over the budget and the exceptions caught by
+ * the bots' catch blocks.
+ * A request with several comma-separated bc.game.maps plays one game per map in the same server run; "games"
+ * lists them in order and the top-level fields describe the first one.
+ * Several requests may be written at once; they are answered in order.
+ * Server and robot output is parsed line by line while the match runs and never buffered as a whole.
+ */
+public class MatchWorker {
+
+    static final Pattern WIN_PATTERN = Pattern.compile("^\\[server\\]\\s*(.*) \\((A|B)\\) wins \\(round (\\d+)\\)");
+    static final Pattern ROBOT_PATTERN = Pattern.compile("^\\[(A|B):");
+    static final Pattern PROFILE_PATTERN =
+            Pattern.compile("^\\[(A|B):([^@\\]]*)[^\\]]*\\]\\s*@@PROFILE (\\d+) (\\d+) (\\d+) (\\d+)(?: (\\d+))?");
+
+    /** Thrown instead of terminating the JVM when the engine calls System.exit. */
+    static class ExitTrappedException extends SecurityException {
+        final int status;
+
+        ExitTrappedException(int status) {
+            super("System.exit(" + status + ") trapped by MatchWorker");
+            this.status = status;
+        }
+    }
+
+    /** Output stream that can be pointed at a new target for every match. */
+    static class SwitchableOutputStream extends OutputStream {
+        private OutputStream target;
+
+        SwitchableOutputStream(OutputStream target) {
+            this.target = target;
+        }
+
+        synchronized void setTarget(OutputStream target) {
+            this.target = target;
+        }
+
+        @Override
+        public synchronized void write(int b) throws IOException {
+            target.write(b);
+        }
+
+        @Override
+        public synchronized void write(byte[] b, int off, int len) throws IOException {
+            target.write(b, off, len);
+        }
+
+        @Override
+        public synchronized void flush() throws IOException {
+            target.flush();
+        }
+    }
+
+    /** Discards everything written to it. */
+    static class NullOutputStream extends OutputStream {
+        @Override
+        public void write(int b) {
+        }
+
+        @Override
+        public void write(byte[] b, int off, int len) {
+        }
+    }
+
+    /** Per-team counters collected from robot output. */
+    static class TeamStats {
+        long outputLines = 0;
+        /**
+         * Latest profile line of every robot: turns, bytecodes, max bytecodes of a turn, turns over budget and
+         * exceptions caught (0 for bots compiled before the template counted them).
+         */
+        final Map<String, long[]> profiles = new HashMap<>();
+
+        String toJson() {
+            long turns = 0, bytecodes = 0, maxBytecodes = 0, overBudget = 0, exceptions = 0;
+            for (long[] profile : profiles.values()) {
+                turns += profile[0];
+                bytecodes += profile[1];
+                maxBytecodes = Math.max(maxBytecodes, profile[2]);
+                overBudget += profile[3];
+                exceptions += profile[4];
+            }
+            return "{\"outputLines\": " + outputLines + ", \"exceptions\": " + exceptions
+                    + ", \"robots\": " + profiles.size() + ", \"turns\": " + turns + ", \"bytecodes\": " + bytecodes
+                    + ", \"maxBytecodes\": " + maxBytecodes + ", \"overBudget\": " + overBudget + "}";
+        }
+    }
+
+    /** Result of one game of a (possibly multi-map) match. */
+    static class GameResult {
+        String winner;
+        String winnerName;
+        String reason = null;
+        int rounds;
+
+        String toJson() {
+            return "{\"winner\": " + quote(winner)
+                    + ", \"winnerName\": " + quote(winnerName)
+                    + ", \"reason\": " + quote(reason)
+                    + ", \"rounds\": " + rounds + "}";
+        }
+    }
+
+    /**
+     * Splits the output of one match into lines and extracts the result from the server's lines.
+     * Robot output is counted per team and forwarded to the robot log, if any.
+     */
+    static class MatchOutputParser extends OutputStream {
+        private final ByteArrayOutputStream line = new ByteArrayOutputStream();
+        private final OutputStream robotLog;
+        final TeamStats teamA = new TeamStats();
+        final TeamStats teamB = new TeamStats();
+        final List<GameResult> games = new ArrayList<>();
+        String error = null;
+
+        MatchOutputParser(OutputStream robotLog) {
+            this.robotLog = robotLog;
+        }
+
+        @Override
+        public void write(int b) throws IOException {
+            if (b == '\n') {
+                processLine(new String(line.toByteArray(), StandardCharsets.UTF_8));
+                line.reset();
+            } else {
+                line.write(b);
+            }
+        }
+
+        @Override
+        public void write(byte[] b, int off, int len) throws IOException {
+            for (int i = off; i < off + len; i++) {
+                write(b[i]);
+            }
+        }
+
+        @Override
+        public void flush() throws IOException {
+            robotLog.flush();
+        }
+
+        void finish() throws IOException {
+            if (line.size() > 0) {
+                processLine(new String(line.toByteArray(), StandardCharsets.UTF_8));
+                line.reset();
+            }
+            robotLog.close();
+        }
+
+        private void processLine(String text) throws IOException {
+            Matcher profile = PROFILE_PATTERN.matcher(text);
+            if (profile.find()) {
+                // Profiles are cumulative, so only the latest one of every robot counts. Robot IDs are
+                // reused by the games of a multi-map run, hence the game number in the key.
+                TeamStats stats = profile.group(1).equals("A") ? teamA : teamB;
+                long[] totals = new long[5];
+                for (int i = 0; i < 5; i++) {
+                    String total = profile.group(i + 3);
+                    totals[i] = total == null ? 0 : Long.parseLong(total);
+                }
+                stats.profiles.put(games.size() + profile.group(2), totals);
+                return;
+            }
+            Matcher robot = ROBOT_PATTERN.matcher(text);
+            if (robot.find()) {
+                TeamStats stats = robot.group(1).equals("A") ? teamA : teamB;
+                stats.outputLines++;
+                robotLog.write((text + "\n").getBytes(StandardCharsets.UTF_8));
+                return;
+            }
+            Matcher win = WIN_PATTERN.matcher(text);
+            if (win.find()) {
+                GameResult game = new GameResult();
+                game.winnerName = win.group(1);
+                game.winner = win.group(2);
+                game.rounds = Integer.parseInt(win.group(3));
+                games.add(game);
+            } else if (text.startsWith("[server]") && text.contains("Reason:") && !games.isEmpty()) {
+                games.get(games.size() - 1).reason = text.substring(text.indexOf("Reason:") + "Reason:".length()).trim();
+            } else if (text.contains("Couldn't load player class")) {
+                error = text.trim();
+            }
+        }
+
+        String toJson() {
+            GameResult first = games.isEmpty() ? new GameResult() : games.get(0);
+            StringBuilder gameList = new StringBuilder();
+            for (GameResult game : games) {
+                gameList.append(gameList.length() == 0 ? "" : ", ").append(game.toJson());
+            }
+            return "{\"winner\": " + quote(first.winner)
+                    + ", \"winnerName\": " + quote(first.winnerName)
+                    + ", \"reason\": " + quote(first.reason)
+                    + ", \"rounds\": " + first.rounds
+                    + ", \"error\": " + quote(error)
+                    + ", \"teams\": {\"A\": " + teamA.toJson() + ", \"B\": " + teamB.toJson() + "}"
+                    + ", \"games\": [" + gameList + "]}";
+        }
+    }
+
+    static String quote(String value) {
+        if (value == null) {
+            return "null";
+        }
+        StringBuilder result = new StringBuilder("\"");
+        for (char c : value.toCharArray()) {
+            if (c == '"' || c == '\\') {
+                result.append('\\').append(c);
+            } else if (c < 0x20) {
+                result.append(String.format("\\u%04x", (int) c));
+            } else {
+                result.append(c);
+            }
+        }
+        return result.append('"').toString();
+    }
+
+    public static void main(String[] args) throws IOException {
+        PrintStream protocol = new PrintStream(System.out, true, "UTF-8");
+        SwitchableOutputStream capture = new SwitchableOutputStream(new NullOutputStream());
+        PrintStream captured = new PrintStream(capture, true, "UTF-8");
+        System.setOut(captured);
+        System.setErr(captured);
+
+        // The engine may call System.exit at the end of a game; keep the JVM alive for the next request.
+        System.setSecurityManager(new SecurityManager() {
+            @Override
+            public void checkPermission(Permission perm) {
+            }
+
+            @Override
+            public void checkPermission(Permission perm, Object context) {
+            }
+
+            @Override
+            public void checkExit(int status) {
+                throw new ExitTrappedException(status);
+            }
+        });
+
+        BufferedReader requests = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        String line;
+        while ((line = requests.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+            String[] fields = line.split("\t");
+            String matchId = fields[0];
+            System.clearProperty("matchworker.robot-output");
+            for (int i = 1; i < fields.length; i++) {
+                int separator = fields[i].indexOf('=');
+                if (separator > 0) {
+                    System.setProperty(fields[i].substring(0, separator), fields[i].substring(separator + 1));
+                }
+            }
+
+            String robotOutput = System.getProperty("matchworker.robot-output");
+            OutputStream robotLog = robotOutput == null
+                    ? new NullOutputStream()
+                    : new FileOutputStream(robotOutput, true);
+            MatchOutputParser parser = new MatchOutputParser(robotLog);
+            capture.setTarget(parser);
+            try {
+                battlecode.server.Main.main(new String[]{"-c=-"});
+            } catch (ExitTrappedException e) {
+                // Normal end of a headless run, unless the engine exited with an error code.
+                if (e.status != 0 && parser.error == null) {
+                    parser.error = "Engine exited with status " + e.status;
+                }
+            } catch (Throwable t) {
+                parser.error = t.toString();
+            } finally {
+                captured.flush();
+                capture.setTarget(new NullOutputStream());
+                parser.finish();
+            }
+
+            protocol.println("@@RESULT " + matchId + " " + parser.toJson());
+        }
+    }
+}
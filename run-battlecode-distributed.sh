@@ -0,0 +1,39 @@
+#!/bin/bash
+
+#SBATCH --time=99:59:00           # (HH:MM:SS)
+#SBATCH --job-name=battlecode
+#SBATCH --nodes=4
+#SBATCH --ntasks-per-node=1
+#SBATCH --cpus-per-task=50
+#SBATCH --mem=128G
+
+# Display job details
+echo "Job ID: $SLURM_JOB_ID"
+echo "Job Name: $SLURM_JOB_NAME"
+echo "Nodes: $SLURM_JOB_NODELIST"
+echo "CPUs per task: $SLURM_CPUS_PER_TASK"
+echo "Memory: $SLURM_MEM_PER_NODE MB"
+echo "Partition: $SLURM_JOB_PARTITION"
+# Show detailed job information
+scontrol show job $SLURM_JOB_ID
+
+export PYTHONPATH=$(pwd)
+cd battlecode24-scaffold
+chmod +777 gradlew
+cd ..
+cd src
+
+# The queue must be on a filesystem all nodes share, like the repository itself
+QUEUE_DIR=$(pwd)/queue/$SLURM_JOB_ID
+mkdir -p $QUEUE_DIR
+
+# One worker per node, each playing as many matches at a time as its CPUs and memory allow
+srun --overlap --ntasks=$SLURM_JOB_NUM_NODES --ntasks-per-node=1 python3.11 -m src.job_queue $QUEUE_DIR &
+WORKERS=$!
+
+# Every batch of matches in flight occupies one worker slot
+POOL_SIZE=$((SLURM_JOB_NUM_NODES * SLURM_CPUS_PER_TASK))
+python3.11 __main__.py --queue-dir $QUEUE_DIR --pool-size $POOL_SIZE "$@"
+
+# __main__.py stops the workers when it exits
+wait $WORKERS
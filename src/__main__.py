@@ -1,5 +1,15 @@
+from src.adjudication import configure_truncation
 from src.genetic_algorithm import genetic_programming
+from src.islands import TOPOLOGIES, run_islands
+from src.match_server import configure_pool, shutdown_pool
+from src.ratings import configure_ratings
+from src.result_store import configure_result_store
+from src.surrogate import configure_surrogate
+from src.scheduler import DEFAULT_JVM_HEAP_MB, configure_scheduler, default_concurrency, shutdown_scheduler
+from src.tournament import configure_evaluation, configure_swiss
+from src.tracing import configure_tracing
 import os
+import random
 import shutil
 import argparse
 
@@ -11,11 +21,100 @@ if __name__ == "__main__":
     parser.add_argument('--no-resume', action='store_true', 
                        help='Start from scratch instead of resuming from checkpoint')
     parser.add_argument('--checkpoint-interval', type=int, default=5,
-                       help='Save checkpoint every N generations (default: 5)')
+                       help='Run a best-of-N check every N generations; every generation is logged (default: 5)')
     parser.add_argument('--clean', action='store_true',
                        help='Clean previous code and checkpoints before starting')
+    parser.add_argument('--pipelined', action='store_true',
+                       help='Breed and compile the next generation while the current one\'s matches finish')
+    parser.add_argument('--seed', type=int, default=None,
+                       help='Seed for the random module, for reproducible runs')
+    parser.add_argument('--maps', default=None,
+                       help='Comma-separated maps every pairing is played on (default: the maps gradle property)')
+    parser.add_argument('--seeds', type=int, default=1,
+                       help='Number of games per map and pairing (default: 1)')
+    parser.add_argument('--alpha', type=float, default=0.05,
+                       help='Significance level at which a multi-game pairing is stopped early (default: 0.05)')
+    parser.add_argument('--pool-size', type=int, default=None,
+                       help='Number of concurrent matches and persistent match-server JVMs '
+                            '(default: derived from SLURM_CPUS_PER_TASK, memory and --jvm-heap-mb)')
+    parser.add_argument('--jvm-heap-mb', type=int, default=DEFAULT_JVM_HEAP_MB,
+                       help=f'Heap budget per match JVM in MB (default: {DEFAULT_JVM_HEAP_MB})')
+    parser.add_argument('--fake-engine', action='store_true',
+                       help='Play matches with the local fake engine instead of Battlecode (for testing)')
+    parser.add_argument('--queue-dir', default=None,
+                       help='Play matches on worker processes (python3 -m src.job_queue) through a job queue in this '
+                            'shared directory; --pool-size is then the number of batches in flight')
+    parser.add_argument('--async-engine', action='store_true',
+                       help='Play every match in its own server JVM, reading the output on an asyncio event loop and '
+                            'killing matches that stall; --pool-size is then the number of JVMs running at once')
+    parser.add_argument('--stall-timeout', type=float, default=None,
+                       help='Seconds without a new round before --async-engine kills a match (default: 120)')
+    parser.add_argument('--round-cap', type=int, default=None,
+                       help='Adjudicate games at this round, or earlier once one side is decided, from the state '
+                            'the bots report (implies --async-engine; default: play games to the end)')
+    parser.add_argument('--truncation-audit', type=float, default=0.1,
+                       help='Fraction of adjudicated games played to the end to check the adjudication '
+                            '(default: 0.1)')
+    parser.add_argument('--robot-output-dir', default=None,
+                       help='Write robot output to one log file per match in this directory (default: discard it)')
+    parser.add_argument('--no-result-store', action='store_true',
+                       help='Play every match instead of reusing stored results of identical pairings')
+    parser.add_argument('--resample', type=float, default=0.0,
+                       help='Probability of replaying a stored pairing, for stochastic bots (default: 0)')
+    parser.add_argument('--no-surrogate', action='store_true',
+                       help='Evaluate every bred offspring instead of screening candidates with a surrogate model')
+    parser.add_argument('--surrogate-oversample', type=float, default=2.0,
+                       help='Candidates bred per offspring slot for the surrogate to choose from (default: 2)')
+    parser.add_argument('--surrogate-audit', type=float, default=0.1,
+                       help='Fraction of offspring slots given to random rejected candidates, to measure '
+                            'what screening costs (default: 0.1)')
+    parser.add_argument('--no-ratings', action='store_true',
+                       help='Rank every generation by a one-game tournament instead of persistent ratings')
+    parser.add_argument('--rating-games', type=int, default=None,
+                       help='Game budget of a generation\'s rating tournament (default: the population size)')
+    parser.add_argument('--swiss', type=int, nargs='?', const=0, default=None, metavar='ROUNDS',
+                       help='Rank every generation by a Swiss-system tournament with this many rounds '
+                            '(default: log2 of the population size)')
+    parser.add_argument('--trace-dir', default=None,
+                       help='Write a Chrome trace of every generation\'s stages and matches to this directory '
+                            '(default: no tracing)')
+    parser.add_argument('--islands', type=int, default=1,
+                       help='Evolve this many populations in separate processes that exchange their best genomes; '
+                            'each island gets an equal share of the concurrent matches (default: 1)')
+    parser.add_argument('--island-topology', choices=TOPOLOGIES, default='ring',
+                       help='Which islands receive each other\'s migrants (default: ring)')
+    parser.add_argument('--migration-interval', type=int, default=5,
+                       help='Exchange migrants every N generations (default: 5)')
+    parser.add_argument('--migrants', type=int, default=2,
+                       help='Number of top genomes an island sends per exchange (default: 2)')
     
     args = parser.parse_args()
+    if args.islands > 1 and args.pipelined:
+        parser.error("--islands can't be combined with --pipelined")
+    if args.swiss is not None and args.pipelined:
+        parser.error("--swiss can't be combined with --pipelined")
+    if args.pipelined and not (args.no_ratings and args.no_surrogate):
+        # The pipeline ranks generations by one-game tournaments and breeds offspring without screening them
+        parser.error("--pipelined requires --no-ratings and --no-surrogate")
+    if args.round_cap is not None and (args.queue_dir or args.fake_engine):
+        parser.error("--round-cap can't be combined with --queue-dir or --fake-engine")
+    if args.seed is not None:
+        random.seed(args.seed)
+    pool_size = args.pool_size
+    if args.islands > 1:
+        pool_size = max(1, (pool_size or default_concurrency(args.jvm_heap_mb)) // args.islands)
+    configure_scheduler(concurrency=pool_size, heap_mb=args.jvm_heap_mb)
+    configure_pool(size=pool_size, fake_engine=args.fake_engine, robot_output_dir=args.robot_output_dir,
+                   heap_mb=args.jvm_heap_mb, queue_dir=os.path.abspath(args.queue_dir) if args.queue_dir else None,
+                   async_engine=args.async_engine or args.round_cap is not None, stall_timeout=args.stall_timeout)
+    configure_truncation(round_cap=args.round_cap, audit=args.truncation_audit)
+    configure_evaluation(maps=args.maps.split(",") if args.maps else None, seeds=args.seeds, alpha=args.alpha)
+    configure_result_store(resample=args.resample, enabled=not args.no_result_store)
+    configure_swiss(args.swiss)
+    configure_ratings(games_per_generation=args.rating_games, enabled=not args.no_ratings)
+    configure_tracing(args.trace_dir)
+    configure_surrogate(oversample=args.surrogate_oversample, audit=args.surrogate_audit,
+                        enabled=not args.no_surrogate)
     
     # Clean previous code and checkpoints if requested
     if args.clean:
@@ -48,8 +147,17 @@ if __name__ == "__main__":
                         shutil.rmtree(item_path)  # Delete the folder and its contents
         print(f"{timestamp()} Deleted previous code.")
 
-    best_code = genetic_programming(
-        resume_from_checkpoint=not args.no_resume,
-        checkpoint_interval=args.checkpoint_interval
-    )
+    try:
+        if args.islands > 1:
+            run_islands(args.islands, args.island_topology, args.migration_interval, args.migrants, args.seed,
+                        resume=not args.no_resume, checkpoint_interval=args.checkpoint_interval)
+        else:
+            best_code = genetic_programming(
+                resume_from_checkpoint=not args.no_resume,
+                checkpoint_interval=args.checkpoint_interval,
+                pipelined=args.pipelined
+            )
+    finally:
+        shutdown_scheduler()
+        shutdown_pool()
     print(f"{timestamp()} done :)")
@@ -0,0 +1,126 @@
+"""
+Truncated games: early adjudication from the game state the bots report.
+
+Generated bots print their state every STATE_INTERVAL rounds (see template.py): the flags they captured, whether
+they hold a flag, whether they are spawned, their health and their team's crumbs. The asyncio engine
+(async_engine.py) adds up the reports of each team per round, and with a round cap configured it ends a game early:
+- once one side is decided: it captured all flags, or the other team has had no robot spawned for DECIDED_REPORTS
+  reports in a row after the setup phase
+- at the round cap, in favour of the side that is ahead on flags captured, then flags held, then robots spawned,
+  then total health, then crumbs. A game that is level on all of them is played to the end.
+Games against bots that don't report their state (e.g. the hand-written players) are never truncated.
+
+A fraction of the adjudicated games (`audit`) is played to the end anyway, and its adjudicated winner is compared
+with the real one, so truncation_report() tells how often truncation changed the outcome.
+"""
+import random
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+STATE_INTERVAL = 50  # Rounds between state reports, same as in template.py
+SETUP_ROUNDS = 200  # GameConstants.SETUP_ROUNDS
+NUMBER_FLAGS = 3  # GameConstants.NUMBER_FLAGS
+DECIDED_REPORTS = 2
+
+
+@dataclass
+class TeamState:
+    """Sum of the state reports of a team's robots in one round."""
+    robots: int = 0
+    captured: int = 0
+    held: int = 0
+    spawned: int = 0
+    health: int = 0
+    crumbs: int = 0
+
+    def add(self, captured: int, held: int, spawned: int, health: int, crumbs: int) -> None:
+        self.robots += 1
+        self.captured += captured
+        self.held += held
+        self.spawned += spawned
+        self.health += health
+        self.crumbs = max(self.crumbs, crumbs)  # Crumbs are shared by the team
+
+    def standing(self) -> Tuple[int, ...]:
+        """The state in the order it is compared in."""
+        return self.captured, self.held, self.spawned, self.health, self.crumbs
+
+
+STANDING_NAMES = ("flags captured", "flags held", "robots spawned", "health", "crumbs")
+
+_round_cap: Optional[int] = None
+_audit = 0.1
+_rng = random.Random(0)  # Doesn't touch the evolution's random state
+_lock = threading.Lock()
+_adjudicated = 0
+_audited = 0
+_changed = 0
+
+
+def configure_truncation(round_cap: Optional[int] = None, audit: float = 0.1) -> None:
+    """
+    Configure truncated games.
+
+    :param round_cap: Round at which games are adjudicated, or None to play them to the end
+    :param audit: Fraction of adjudicated games played to the end to check the adjudication
+    """
+    global _round_cap, _audit
+    _round_cap = round_cap
+    _audit = audit
+
+
+def round_cap() -> Optional[int]:
+    return _round_cap
+
+
+def should_audit() -> bool:
+    with _lock:
+        return _rng.random() < _audit
+
+
+def adjudicate(states: List[Tuple[int, TeamState, TeamState]],
+               cap: int) -> Optional[Tuple[str, int, str]]:
+    """
+    Decide a game from the state reports so far.
+
+    :param states: (round, team A, team B) of every complete report, oldest first
+    :param cap: Round cap
+    :return: Winning side ("A" or "B"), round and reason, or None if the game goes on
+    """
+    if not states:
+        return None
+    round, a, b = states[-1]
+    recent = states[-DECIDED_REPORTS:]
+    for side, own, opponent in (("A", a, 2), ("B", b, 1)):
+        if own.captured >= NUMBER_FLAGS:
+            return side, round, f"Adjudicated in round {round}: all flags captured"
+        if len(recent) == DECIDED_REPORTS and recent[0][0] > SETUP_ROUNDS and own.spawned > 0 and all(
+                report[opponent].spawned == 0 for report in recent):
+            return side, round, f"Adjudicated in round {round}: no opponent robot spawned"
+    if round >= cap:
+        for name, value_a, value_b in zip(STANDING_NAMES, a.standing(), b.standing()):
+            if value_a != value_b:
+                side = "A" if value_a > value_b else "B"
+                return side, round, f"Adjudicated at the round cap ({round}): more {name}"
+    return None
+
+
+def record_truncation(adjudicated: str, played: Optional[str] = None) -> None:
+    """Count an adjudicated game, and whether the winner of its full game (if it was played to the end) differs."""
+    global _adjudicated, _audited, _changed
+    with _lock:
+        _adjudicated += 1
+        if played is not None:
+            _audited += 1
+            _changed += played != adjudicated
+
+
+def truncation_report() -> str:
+    if _round_cap is None and not _adjudicated:
+        return "off"
+    with _lock:
+        changed = f"{100 * _changed / _audited:.1f}%" if _audited else "n/a"
+        cap = f"round cap {_round_cap}, " if _round_cap is not None else ""
+        return (f"{cap}{_adjudicated} games adjudicated, {_audited} played to the end to audit, "
+                f"outcome changed in {_changed} ({changed})")
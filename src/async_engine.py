@@ -0,0 +1,327 @@
+"""
+Asyncio match engine: every match is a server JVM of its own, like `gradlew runWithoutBuild`, and the output,
+watchdog and process handling of all of them run on one event loop.
+
+The server's output is read line by line while the match runs, and parsed the same way as MatchWorker.java does:
+the winner and reason of every game and the bytecode profiles, which include the exceptions the bots caught. Robot
+output tags every line with the round it was printed in (and generated bots print their profile every 50 turns),
+which serves as the match's progress. A match whose round counter doesn't advance for `stall_timeout` seconds is
+killed, and the JVM is terminated as soon as the result of its last game is printed instead of waiting for it to
+exit.
+
+With a round cap (see adjudication.py), a game is adjudicated from the state reports of the bots once it reaches
+the cap or one side is decided, and the JVM is stopped; the remaining maps of the match continue in a new JVM.
+
+The number of JVMs running at once is limited by the engine's concurrency. The engine plugs into the match-server
+pool as AsyncMatchWorker (see configure_pool(async_engine=True)), whose batches run their matches side by side.
+Tournaments submit their pairings as futures (see tournament.start_pairing), so the scheduler thread that starts a
+batch moves on without waiting for its results: matches in flight are bounded by the engine's slots and the
+scheduler's queue, not by its threads.
+"""
+import asyncio
+import re
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, TextIO, Tuple
+
+from src import tracing
+from src.adjudication import TeamState, adjudicate, record_truncation, round_cap, should_audit
+from src.match_result import GameResult, MatchResult
+from src.match_server import MATCH_TIMEOUT, gradle_path, java_executable, resolve_runtime_classpath
+from src.scheduler import DEFAULT_JVM_HEAP_MB
+from src.util import timestamp
+
+DEFAULT_STALL_TIMEOUT = 120.0  # Seconds without a new round before a match is killed
+LINE_LIMIT = 1024 * 1024  # Longest output line read, in bytes
+
+# Same patterns as MatchWorker.java, plus the round of a robot output line
+WIN_PATTERN = re.compile(r"^\[server\]\s*(.*) \((A|B)\) wins \(round (\d+)\)")
+ROBOT_PATTERN = re.compile(r"^\[(A|B):[^@\]]*@(\d+)\]")
+PROFILE_PATTERN = re.compile(r"^\[(A|B):([^@\]]*)[^\]]*\]\s*@@PROFILE (\d+) (\d+) (\d+) (\d+)(?: (\d+))?")
+STATE_PATTERN = re.compile(r"^\[(A|B):[^\]]*\]\s*@@STATE (\d+) (\d+) (\d+) (\d+) (\d+)")
+
+
+class StalledMatchError(RuntimeError):
+    """A match made no progress within the stall timeout, or exceeded the match timeout."""
+
+
+class MatchOutputParser:
+    """
+    Incremental parser of the output of a match, see MatchOutputParser in MatchWorker.java.
+    Robot output is counted per team and written to the robot log, if any.
+    With a round cap, the state reports of the bots are collected to adjudicate the current game; the parser
+    outlives the server run a game was adjudicated in, so the next run can continue with the remaining maps.
+    """
+
+    def __init__(self, maps: List[str], team_names: Dict[str, str], robot_log: Optional[TextIO] = None,
+                 round_cap: Optional[int] = None):
+        self.maps = maps
+        self.team_names = team_names
+        self.robot_log = robot_log
+        self.round_cap = round_cap
+        self.games: List[GameResult] = []
+        self.error: Optional[str] = None
+        self.round = 0  # Latest round robot output was printed in, within the current game
+        self.teams = {side: {"outputLines": 0} for side in "AB"}
+        self.profiles: Dict[str, Dict[str, Tuple[int, ...]]] = {"A": {}, "B": {}}  # Robot -> latest totals
+        self.truncated = False  # Whether the current server run's game was adjudicated, so the run can stop
+        self._new_game()
+
+    def _new_game(self) -> None:
+        self.round = 0
+        self.reporting: Dict[int, Tuple[TeamState, TeamState]] = {}  # Round -> states reported so far
+        self.states: List[Tuple[int, TeamState, TeamState]] = []  # Complete reports of the current game
+        self.unreported = False  # A team didn't report its state, so the game can't be adjudicated
+        self.audit: Optional[str] = None  # Adjudicated winner of a game that is played on to audit it
+
+    @property
+    def remaining_maps(self) -> List[str]:
+        return self.maps[len(self.games):]
+
+    @property
+    def finished(self) -> bool:
+        """Whether all games have their winner and reason, or a player failed to load."""
+        if self.error is not None:
+            return True
+        return len(self.games) >= len(self.maps) and self.games[-1].reason is not None
+
+    def feed(self, line: str) -> bool:
+        """Parse one line of output. Returns whether the match made progress (a new round or a server line)."""
+        robot = ROBOT_PATTERN.match(line)
+        if robot:
+            side, round = robot.group(1), int(robot.group(2))
+            if round > self.round and self.round_cap is not None and self._complete_reports(round):
+                return True  # The game was adjudicated and its JVM is stopped, so the line belongs to no game
+            profile = PROFILE_PATTERN.match(line)
+            state = STATE_PATTERN.match(line)
+            if state:
+                teams = self.reporting.setdefault(round, (TeamState(), TeamState()))
+                teams[0 if side == "A" else 1].add(*map(int, state.group(2, 3, 4, 5, 6)))
+            elif profile:
+                # Profiles are cumulative, and robot IDs are reused by the games of a multi-map run
+                self.profiles[side][f"{len(self.games)}{profile.group(2)}"] = tuple(
+                    int(total or 0) for total in profile.group(3, 4, 5, 6, 7))
+            else:
+                self.teams[side]["outputLines"] += 1
+                if self.robot_log is not None:
+                    self.robot_log.write(line + "\n")
+            progress = round > self.round
+            self.round = max(self.round, round)
+            return progress
+        win = WIN_PATTERN.match(line)
+        if win:
+            self.games.append(GameResult(win.group(2), win.group(1), None, int(win.group(3))))
+            if self.audit is not None:
+                record_truncation(self.audit, win.group(2))
+            self._new_game()
+        elif line.startswith("[server]") and "Reason:" in line and self.games:
+            self.games[-1].reason = line[line.index("Reason:") + len("Reason:"):].strip()
+        elif "Couldn't load player class" in line:
+            self.error = line.strip()
+        return line.startswith("[server]")
+
+    def _complete_reports(self, round: int) -> bool:
+        """
+        Robots print in round order, so the reports of earlier rounds are complete once a later round starts.
+        Returns whether the complete reports decided the game, which then ends.
+        """
+        for reported in sorted(r for r in self.reporting if r < round):
+            a, b = self.reporting.pop(reported)
+            self.unreported |= not a.robots or not b.robots
+            self.states.append((reported, a, b))
+        if self.unreported or self.audit is not None or not self.states:
+            return False
+        decision = adjudicate(self.states, self.round_cap)
+        if decision is None:
+            return False
+        side, round, reason = decision
+        if should_audit():
+            self.audit = side
+            return False
+        record_truncation(side)
+        self.games.append(GameResult(side, self.team_names[side], reason, round))
+        self.truncated = True
+        self._new_game()
+        return True
+
+    def result(self) -> MatchResult:
+        teams = {}
+        for side, stats in self.teams.items():
+            totals = list(self.profiles[side].values())
+            teams[side] = dict(stats, robots=len(totals), turns=sum(t[0] for t in totals),
+                               bytecodes=sum(t[1] for t in totals), maxBytecodes=max((t[2] for t in totals), default=0),
+                               overBudget=sum(t[3] for t in totals), exceptions=sum(t[4] for t in totals))
+        first = self.games[0] if self.games else GameResult(None)
+        return MatchResult(first.winner, first.winner_name, first.reason, first.rounds, self.error, teams, self.games)
+
+
+def server_command(classpath: str, properties: Dict[str, str], heap_mb: int = DEFAULT_JVM_HEAP_MB) -> List[str]:
+    """Command line of a server JVM playing one match, as the runWithoutBuild task in build.gradle starts it."""
+    return ([java_executable("java"), f"-Xmx{heap_mb}m"]
+            + [f"-D{key}={value}" for key, value in properties.items() if not key.startswith("matchworker.")]
+            + ["-cp", classpath, "battlecode.server.Main", "-c=-"])
+
+
+class AsyncEngine:
+    """
+    Runs server JVMs on an event loop in a background thread.
+    run_match is a coroutine for the loop; submit, submit_batch and run_matches can be called from any thread.
+    """
+
+    def __init__(self, classpath: str, concurrency: int, heap_mb: int = DEFAULT_JVM_HEAP_MB,
+                 stall_timeout: float = DEFAULT_STALL_TIMEOUT, match_timeout: float = MATCH_TIMEOUT):
+        self.classpath = classpath
+        self.concurrency = concurrency
+        self.heap_mb = heap_mb
+        self.stall_timeout = stall_timeout
+        self.match_timeout = match_timeout
+        self.slots: Optional[asyncio.Semaphore] = None  # Created on the loop
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="async-engine", daemon=True)
+        self.thread.start()
+
+    async def run_match(self, match_id: str, properties: Dict[str, str]) -> MatchResult:
+        """
+        Play one match in a new server JVM and return its result. If a game is adjudicated, the JVM is stopped and
+        the remaining maps are played in a new one.
+        Raises StalledMatchError if it stalls or times out, and RuntimeError if the server exits without a result.
+        """
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.concurrency)
+        robot_log_path = properties.get("matchworker.robot-output")
+        cap = properties.get("matchworker.round-cap")
+        robot_log = open(robot_log_path, "w") if robot_log_path else None
+        parser = MatchOutputParser(properties.get("bc.game.maps", "").split(","),
+                                   {"A": properties.get("bc.game.team-a"), "B": properties.get("bc.game.team-b")},
+                                   robot_log, int(cap) if cap else round_cap())
+        try:
+            while not parser.finished:
+                async with self.slots:
+                    start = tracing.now()
+                    returncode = await self._run_server(match_id, dict(
+                        properties, **{"bc.game.maps": ",".join(parser.remaining_maps)}), parser)
+                if not parser.finished and not parser.truncated:
+                    if not parser.games:
+                        raise RuntimeError(f"Server exited during match {match_id} with code {returncode}")
+                    break
+                tracing.complete("match", "engine", start, bot1=properties.get("bc.game.team-a"),
+                                 bot2=properties.get("bc.game.team-b"), maps=properties.get("bc.game.maps"),
+                                 rounds=parser.games[-1].rounds, first_in_jvm=True, truncated=parser.truncated)
+        finally:
+            if robot_log is not None:
+                robot_log.close()
+        return parser.result()
+
+    async def _run_server(self, match_id: str, properties: Dict[str, str], parser: MatchOutputParser) -> int:
+        """Start a server JVM and feed its output to the parser until the match ends or a game is adjudicated."""
+        process = await asyncio.create_subprocess_exec(
+            *server_command(self.classpath, properties, self.heap_mb), cwd=gradle_path,
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            limit=LINE_LIMIT)
+        parser.truncated = False
+        deadline = self.loop.time() + self.match_timeout
+        progress = self.loop.time()
+        try:
+            while not parser.finished and not parser.truncated:
+                timeout = min(progress + self.stall_timeout, deadline) - self.loop.time()
+                try:
+                    line = await asyncio.wait_for(process.stdout.readline(), max(0.0, timeout))
+                except asyncio.TimeoutError:
+                    if self.loop.time() >= deadline:
+                        raise StalledMatchError(f"Match {match_id} timed out after {self.match_timeout:.0f}s")
+                    raise StalledMatchError(f"Match {match_id} stalled at round {parser.round} of game "
+                                            f"{len(parser.games) + 1} for {self.stall_timeout:.0f}s")
+                if not line:
+                    break
+                if parser.feed(line.decode("utf-8", errors="replace").rstrip("\r\n")):
+                    progress = self.loop.time()
+        finally:
+            await self._stop(process)
+        return process.returncode
+
+    async def _stop(self, process: asyncio.subprocess.Process) -> None:
+        """Terminate a server JVM that is still running, e.g. after it printed its result."""
+        if process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), 10)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+
+    def submit(self, match_id: str, properties: Dict[str, str]) -> Future:
+        """Start a match on the loop and return a future for its result."""
+        return asyncio.run_coroutine_threadsafe(self.run_match(match_id, properties), self.loop)
+
+    def submit_batch(self, requests: List[Tuple[str, Dict[str, str]]]) -> Future:
+        """Start matches side by side and return a future for their results in order, None for every failed one."""
+        return asyncio.run_coroutine_threadsafe(self._run_batch(requests), self.loop)
+
+    async def _run_batch(self, requests: List[Tuple[str, Dict[str, str]]]) -> List[Optional[MatchResult]]:
+        outcomes = await asyncio.gather(*(self.run_match(match_id, properties) for match_id, properties in requests),
+                                        return_exceptions=True)
+        results = []
+        for (match_id, properties), outcome in zip(requests, outcomes):
+            if isinstance(outcome, Exception):
+                print(f"{timestamp()} Error during match {properties.get('bc.game.team-a')} vs "
+                      f"{properties.get('bc.game.team-b')}: {outcome}")
+                outcome = None
+            results.append(outcome)
+        return results
+
+    def run_matches(self, requests: List[Tuple[str, Dict[str, str]]]) -> List[Optional[MatchResult]]:
+        """Play matches side by side and return their results in order; None for every match that failed."""
+        return self.submit_batch(requests).result()
+
+    def close(self) -> None:
+        """Stop the loop. Matches still running are abandoned; their JVMs die with this process."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class AsyncMatchWorker:
+    """
+    Match-server pool worker that plays its batches on the shared AsyncEngine, all matches of a batch at once.
+    submit_batch only starts a batch, so the pool takes the worker back right away and no thread waits for the
+    matches; the engine's slots are what limits them.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.matches_played = 0
+
+    def alive(self) -> bool:
+        return True
+
+    def submit_batch(self, requests: List[Tuple[str, Dict[str, str]]]) -> Future:
+        self.matches_played += len(requests)
+        return self.engine.submit_batch(requests)
+
+    def run_batch(self, requests: List[Tuple[str, Dict[str, str]]]) -> List[Optional[MatchResult]]:
+        return self.submit_batch(requests).result()
+
+    def close(self) -> None:
+        pass  # The engine outlives its workers, see shutdown_engine
+
+
+_engine: Optional[AsyncEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(concurrency: int, heap_mb: int = DEFAULT_JVM_HEAP_MB,
+               stall_timeout: float = DEFAULT_STALL_TIMEOUT) -> AsyncEngine:
+    """Return the shared engine, starting it with these settings on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncEngine(resolve_runtime_classpath(), concurrency, heap_mb, stall_timeout)
+        return _engine
+
+
+def shutdown_engine() -> None:
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.close()
+            _engine = None
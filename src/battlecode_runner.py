@@ -1,11 +1,17 @@
 import os
 import subprocess
-from typing import List
+from typing import Dict, List, Optional, Tuple, Union
 import platform
+from concurrent.futures import Future
 
+from src import tracing
+from src.compiler import base_players, class_location, compile_bots, source_hash, source_path
+from src.genome_cache import get_genome_cache
+from src.match_result import MatchResult
+from src.match_server import get_async_engine, get_pool, match_properties
 from src.mutatable import Mutatable
-from src.template import template
-from src.util import code_to_string, timestamp, analyze_output
+from src.normalize import normalize
+from src.util import timestamp, analyze_output, analyze_result
 
 # Paths
 battlecode_path = os.path.abspath("../battlecode24-scaffold/src/")
@@ -13,29 +19,42 @@ gradle_path = os.path.abspath("../battlecode24-scaffold/")
 gradle_executable = os.path.join(gradle_path, "gradlew.bat" if platform.system() == "Windows" else "gradlew")
 
 
-def make_bot(bot_name: str, java_code: List[Mutatable]) -> None:
+# Package of every generated bot in the genome cache, by bot name
+bot_packages: Dict[str, str] = {}
+_compile = True
+
+
+def configure_compilation(enabled: bool = True) -> None:
+    """
+    Turn compiling bots off, e.g. to benchmark the fake engine without a JDK. Sources are still written to the
+    genome cache, but build_bots() does nothing, so nothing is marked as compiled.
     """
-    Writes the bot into a file.
+    global _compile
+    _compile = enabled
+
+
+def make_bot(bot_name: str, java_code: List[Mutatable]) -> int:
+    """
+    Registers the normalized code of the bot in the genome cache (see normalize.py).
+    Code that was cached before (e.g. an elite carried over from the last generation, or a genome that only
+    differs from a cached one in dead code) is neither rewritten nor recompiled.
 
-    :param gen: Generation of the bot
     :param bot_name: Name of the bot - arbitrary but unique within the generation
     :param java_code: Code for the bot
-    :return: string containing the ID of the bot for execution
+    :return: Number of lines normalization removed
     """
-    # Create folder
     if not os.path.exists(gradle_executable):
         raise NotADirectoryError(f"Battlecode source not found at '{battlecode_path}'")
-    gen, bot_name_without_gen = bot_name.split(".")
-    package_path = os.path.join(battlecode_path, gen)
-    package_path = os.path.join(package_path, bot_name_without_gen)
-    os.makedirs(package_path, exist_ok=True)
-    java_file_path = os.path.join(package_path, "RobotPlayer.java")
-    # Write the generated Java code
-    generated_code = template.replace("[$CODE]", code_to_string(java_code)).replace("[$PACKAGE]", bot_name)
-    with open(java_file_path, "w") as file:
-        file.write(generated_code)
-        file.flush()
-    print(f"{timestamp()} Generated code written to {java_file_path}")
+    with tracing.span("make_bot", "compile", bot=bot_name):
+        cache = get_genome_cache()
+        normalized = normalize(java_code)
+        package = cache.add(normalized)
+        bot_packages[bot_name] = package
+        if cache.is_compiled(package):
+            print(f"{timestamp()} Reusing cached genome {package} for {bot_name}")
+        else:
+            print(f"{timestamp()} Generated code for {bot_name} written to genome {package}")
+    return len(java_code) - len(normalized)
 
 
 def execute_gradle_task(name: str, args: List[str] = []) -> str:
@@ -75,14 +94,85 @@ def execute_gradle_task(name: str, args: List[str] = []) -> str:
         return 0  # Penalize any other issues
 
 
-def build_bots():
-    execute_gradle_task("build")
+def build_bots(bot_names: List[str]) -> None:
+    """
+    Compile the given bots and the hand-written opponents.
+    Generated bots are compiled into the genome cache, so only genomes that were never compiled before cost a
+    compile. Other bots go into per-generation class directories.
+    """
+    if not _compile:
+        return
+    with tracing.span("compile genomes", "compile", bots=len(bot_names)):
+        get_genome_cache().compile(bot_packages[name] for name in bot_names if name in bot_packages)
+    with tracing.span("compile players", "compile"):
+        compile_bots([name for name in bot_names if name not in bot_packages] + base_players)
+
+
+def bot_location(bot_name: str) -> Tuple[str, str]:
+    """Return the class location and Java package of a bot."""
+    if bot_name in bot_packages:
+        return get_genome_cache().path, bot_packages[bot_name]
+    return class_location(bot_name), bot_name
+
+
+def bot_genome(bot_name: str) -> str:
+    """Return an identifier of the bot's code that doesn't depend on its name, e.g. for the result store."""
+    if bot_name in bot_packages:
+        return bot_packages[bot_name]
+    return "src-" + source_hash(source_path(bot_name))
+
+
+def class_locations(bot1_name: str, bot2_name: str) -> Dict[str, str]:
+    """Gradle properties pointing the engine at the classes and packages of both bots."""
+    location_a, package_a = bot_location(bot1_name)
+    location_b, package_b = bot_location(bot2_name)
+    return {
+        "classLocationA": location_a,
+        "classLocationB": location_b,
+        "packageNameA": package_a,
+        "packageNameB": package_b,
+    }
 
 
-def run_battlecode(bot1_name: str, bot2_name: str) -> int:
+def run_battlecode(bot1_name: str, bot2_name: str, round_cap: Optional[int] = None) -> int:
     """
+    :param round_cap: Adjudicate the game at this round, or earlier once one side is decided (see adjudication.py).
+        Gradle can't stop a game early, so a truncated match is played on the asyncio engine instead, with the
+        settings of the match-server pool (see match_server.get_async_engine).
     :return:
     """
-    output = execute_gradle_task("runWithoutBuild", [f"-PteamA={bot1_name}", f"-PteamB={bot2_name}"])
+    if round_cap is not None:
+        overrides = class_locations(bot1_name, bot2_name)
+        overrides["roundCap"] = str(round_cap)
+        result = get_async_engine().run_matches(
+            [("0", match_properties(bot1_name, bot2_name, overrides))])[0]
+        return analyze_result(result)
+    args = [f"-PteamA={bot1_name}", f"-PteamB={bot2_name}"]
+    args += [f"-P{key}={value}" for key, value in class_locations(bot1_name, bot2_name).items()]
+    output = execute_gradle_task("runWithoutBuild", args)
     result = analyze_output(output)
     return result
+
+
+def start_battlecode_batch(pairs: List[Tuple[str, str]], maps: Union[List[str], List[List[str]]],
+                           seed: int = 0) -> Future:
+    """
+    Play a batch of pairs in a single pooled worker JVM, and return a future for the results (see
+    MatchServerPool.submit_batch).
+    Each pair is one server run over its comma-separated maps, and the runs go back to back on the same worker,
+    so JVM start-up and JIT warm-up are paid once per batch instead of once per game.
+
+    :param pairs: (team A, team B) of every match
+    :param maps: Maps every pair plays on, one game each, or a list of maps per pair
+    :param seed: Replicate index of the games
+    :return: Future for the result of every pair in order, with one entry per map in its games; None if the
+        worker failed
+    """
+    if maps and isinstance(maps[0], str):
+        maps = [maps] * len(pairs)
+    matches = []
+    for (bot1_name, bot2_name), pair_maps in zip(pairs, maps):
+        overrides = class_locations(bot1_name, bot2_name)
+        overrides.update({"maps": ",".join(pair_maps), "seed": str(seed)})
+        matches.append((bot1_name, bot2_name, overrides))
+    return get_pool().submit_batch(matches)
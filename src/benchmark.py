@@ -0,0 +1,248 @@
+import argparse
+import contextlib
+import gc
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from src import reproduction
+from src.genetic_algorithm import generate_random_code, genetic_programming, make_offspring, mutate
+from src.mutatable import Mutatable
+from src.util import code_to_string
+
+TOURNAMENTS = ["one-game", "ratings", "swiss"]
+
+
+def lines_per_second(render: Callable[[], None], lines: int, repeat: int) -> float:
+    """Best throughput of `repeat` runs of render, which renders `lines` lines."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render()
+        best = min(best, time.perf_counter() - start)
+    return lines / best
+
+
+def benchmark_render(lines: int = 10000, code_length: int = 50, repeat: int = 5, seed: int = 0) -> None:
+    """
+    Measure how fast a population with `lines` lines of code in total is rendered to Java code:
+    cold (nothing rendered yet), warm (every line cached, as for elites and unchanged lines) and after a
+    mutation pass over the population.
+    """
+    rng = random.Random(seed)
+    population: List[List[Mutatable]] = [generate_random_code(code_length, rng)
+                                         for _ in range(max(1, lines // code_length))]
+    total = sum(len(code) for code in population)
+
+    def render_all() -> None:
+        for code in population:
+            code_to_string(code)
+
+    def render_cold() -> None:
+        for code in population:
+            for mutatable in code:
+                mutatable._text = None
+        render_all()
+
+    print(f"Rendering {len(population)} bots with {total} lines")
+    print(f"  cold:           {lines_per_second(render_cold, total, repeat):12.0f} lines/s")
+    print(f"  warm:           {lines_per_second(render_all, total, repeat):12.0f} lines/s")
+    population = [mutate(code, rng) for code in population]
+    total = sum(len(code) for code in population)
+    print(f"  after mutation: {lines_per_second(render_all, total, 1):12.0f} lines/s")
+
+
+def benchmark_size(lines: int = 10000, code_length: int = 50, seed: int = 0) -> None:
+    """Measure the memory and checkpoint size of a population with `lines` lines of code in total."""
+    rng = random.Random(seed)
+    tracemalloc.start()
+    population = [generate_random_code(code_length, rng) for _ in range(max(1, lines // code_length))]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    total = sum(len(code) for code in population)
+    print(f"Population of {len(population)} bots with {total} lines")
+    print(f"  memory:         {memory / total:12.1f} bytes/line")
+    print(f"  pickled:        {len(pickle.dumps(population)) / total:12.1f} bytes/line")
+
+
+def benchmark_breeding(offspring: int = 10000, code_length: int = 50, seed: int = 0) -> None:
+    """Measure how long breeding `offspring` offspring of as many parents takes, batched and one at a time."""
+    random.seed(seed)
+    top_individuals = [(rank, generate_random_code(code_length), str(rank)) for rank in range(offspring)]
+    print(f"Breeding {offspring} offspring of {offspring} parents")
+    engines = [("batched", True), ("one at a time", False)] if reproduction.available() else [("one at a time", False)]
+    numpy = reproduction.np
+    for label, batched in engines:
+        reproduction.np = numpy if batched else None
+        gc.collect()  # Don't charge the collection of the parents to the first measurement
+        start = time.perf_counter()
+        make_offspring(top_individuals, offspring)
+        print(f"  {label + ':':15} {time.perf_counter() - start:12.3f} s")
+    reproduction.np = numpy
+
+
+def _run_orchestration(settings: Dict, results: "multiprocessing.Queue") -> None:
+    """Body of benchmark_orchestration, run in a forked process so every run starts from fresh singletons."""
+    from src.battlecode_runner import configure_compilation
+    from src.fake_engine import configure_fake_engine, games_played
+    from src.match_server import configure_pool, shutdown_pool
+    from src.ratings import configure_ratings
+    from src.result_store import configure_result_store
+    from src.scheduler import configure_scheduler, get_scheduler, shutdown_scheduler
+    from src.tournament import configure_swiss
+
+    directory = tempfile.mkdtemp(prefix="benchmark-")
+    os.environ["GENOME_CACHE_DIR"] = os.path.join(directory, "genome-cache")
+    configure_compilation(False)
+    configure_fake_engine(settings["latency"], settings["jitter"], settings["failure_rate"], settings["winners"],
+                          seed=settings["seed"])
+    configure_scheduler(concurrency=settings["concurrency"])
+    configure_pool(size=settings["concurrency"], fake_engine=True)
+    configure_result_store(enabled=False)  # Every match is played
+    configure_ratings(os.path.join(directory, "ratings.db"), enabled=settings["tournament"] == "ratings")
+    configure_swiss(0 if settings["tournament"] == "swiss" else None)
+    random.seed(settings["seed"])
+    checkpoint_dir = os.path.join(directory, "checkpoints")
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            genetic_programming(resume_from_checkpoint=False, checkpoint_interval=0, checkpoint_dir=checkpoint_dir,
+                                population_size=settings["population_size"], generations=settings["generations"])
+            seconds = time.perf_counter() - start
+            idle = get_scheduler().idle_fraction()
+        evaluated = settings["generations"] + 1  # The final generation is evaluated too
+        results.put(dict(settings, seconds=seconds, generations_per_hour=evaluated / seconds * 3600,
+                         matches_per_second=games_played() / seconds, matches=games_played(), scheduler_idle=idle,
+                         peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                         log_bytes=sum(os.path.getsize(os.path.join(checkpoint_dir, name))
+                                       for name in os.listdir(checkpoint_dir))))
+    finally:
+        shutdown_scheduler()
+        shutdown_pool()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def benchmark_orchestration(population_size: int = 40, generations: int = 2, tournament: str = "one-game",
+                            concurrency: int = 8, latency: float = 0.0, jitter: float = 0.0,
+                            failure_rate: float = 0.0, winners: str = "coin", seed: int = 0) -> Dict:
+    """
+    Run genetic_programming with the fake engine and without compiling, and measure the orchestration layer:
+    breeding, writing bots, tournaments, scheduling and the generation log. Every run gets a fresh process and
+    temporary directories, and plays every match (the result store is off).
+
+    :param tournament: How generations are ranked: "one-game", "ratings" or "swiss"; the final population always
+        plays a double-elimination tournament
+    :param latency, jitter, failure_rate, winners: Fake engine behaviour, see fake_engine.configure_fake_engine
+    :return: The settings and the measurements: seconds, generations per hour, matches per second, fraction of
+        time the scheduler threads were idle, peak memory and the size of the generation log
+    """
+    if tournament not in TOURNAMENTS:
+        raise ValueError(f"Unknown tournament {tournament}, expected one of {', '.join(TOURNAMENTS)}")
+    settings = dict(population_size=population_size, generations=generations, tournament=tournament,
+                    concurrency=concurrency, latency=latency, jitter=jitter, failure_rate=failure_rate,
+                    winners=winners, seed=seed)
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(target=_run_orchestration, args=(settings, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Benchmark run failed with exit code {process.exitcode}", settings)
+    return results.get()
+
+
+def compare_runs(runs: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """Print the change of every run against the baseline run with the same settings; return the regressions."""
+    def key(run: Dict) -> tuple:
+        return tuple(run[name] for name in ("population_size", "generations", "tournament", "concurrency",
+                                            "latency", "jitter", "failure_rate", "winners", "seed"))
+    previous = {key(run): run for run in baseline}
+    regressions = []
+    for run in runs:
+        old = previous.get(key(run))
+        if old is None:
+            continue
+        change = run["matches_per_second"] / old["matches_per_second"] - 1
+        label = f"{run['tournament']} with {run['population_size']} bots"
+        print(f"  {label + ':':32} {100 * change:+7.1f}% matches/s, "
+              f"{100 * (run['generations_per_hour'] / old['generations_per_hour'] - 1):+7.1f}% generations/h")
+        if change < -tolerance:
+            regressions.append(label)
+    return regressions
+
+
+def benchmark_suite(population_sizes: List[int], tournaments: List[str], output: str,
+                    baseline: Optional[str] = None, tolerance: float = 0.1, **settings) -> List[Dict]:
+    """Run benchmark_orchestration for every population size and tournament, and store the results as JSON."""
+    runs = []
+    print(f"{'tournament':>10} {'bots':>6} {'gen/h':>10} {'matches/s':>10} {'idle':>6} {'memory':>9} {'log':>9}")
+    for population_size in population_sizes:
+        for tournament in tournaments:
+            run = benchmark_orchestration(population_size, tournament=tournament, **settings)
+            runs.append(run)
+            print(f"{tournament:>10} {population_size:6d} {run['generations_per_hour']:10.0f} "
+                  f"{run['matches_per_second']:10.1f} {100 * run['scheduler_idle']:5.1f}% "
+                  f"{run['peak_rss_mb']:6.0f} MB {run['log_bytes'] / 1024 ** 2:6.1f} MB")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "runs": runs}, file, indent=1)
+    print(f"Wrote {output}")
+    if baseline is not None:
+        with open(baseline) as file:
+            print(f"Compared to {baseline}:")
+            regressions = compare_runs(runs, json.load(file)["runs"], tolerance)
+        if regressions:
+            print(f"Regressions of more than {100 * tolerance:.0f}%: {', '.join(regressions)}")
+    return runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the genetic programming loop')
+    parser.add_argument('--lines', type=int, default=10000,
+                        help='Total lines of code of the rendered population (default: 10000)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per measurement, the best one is reported (default: 5)')
+    parser.add_argument('--offspring', type=int, default=10000,
+                        help='Offspring bred by the breeding benchmark (default: 10000)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the generated population (default: 0)')
+    suite = parser.add_argument_group('orchestration suite', 'Throughput of whole runs against the fake engine')
+    suite.add_argument('--orchestration', action='store_true',
+                       help='Run the orchestration suite instead of the micro-benchmarks')
+    suite.add_argument('--population-sizes', default='40,400,2000,10000',
+                       help='Comma-separated population sizes (default: 40,400,2000,10000)')
+    suite.add_argument('--tournaments', default='one-game',
+                       help=f'Comma-separated tournaments out of {", ".join(TOURNAMENTS)} (default: one-game)')
+    suite.add_argument('--generations', type=int, default=2, help='Generations per run (default: 2)')
+    suite.add_argument('--concurrency', type=int, default=8, help='Concurrent matches (default: 8)')
+    suite.add_argument('--latency', type=float, default=0.0, help='Seconds per fake game (default: 0)')
+    suite.add_argument('--jitter', type=float, default=0.0, help='Maximum deviation from the latency (default: 0)')
+    suite.add_argument('--failure-rate', type=float, default=0.0,
+                       help='Probability that a fake worker batch fails and is retried (default: 0)')
+    suite.add_argument('--winners', choices=['coin', 'skill'], default='coin',
+                       help='Winner model of the fake engine (default: coin)')
+    suite.add_argument('--output', default=None,
+                       help='JSON file for the results (default: results/benchmarks/orchestration-<time>.json)')
+    suite.add_argument('--baseline', default=None, help='Earlier results to compare matches/s and generations/h with')
+    suite.add_argument('--tolerance', type=float, default=0.1,
+                       help='Slowdown against the baseline that counts as a regression (default: 0.1)')
+    args = parser.parse_args()
+    if args.orchestration:
+        output = args.output or os.path.join("results", "benchmarks",
+                                             f"orchestration-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        benchmark_suite([int(size) for size in args.population_sizes.split(",")], args.tournaments.split(","),
+                        output, args.baseline, args.tolerance, generations=args.generations,
+                        concurrency=args.concurrency, latency=args.latency, jitter=args.jitter,
+                        failure_rate=args.failure_rate, winners=args.winners, seed=args.seed)
+        raise SystemExit
+    benchmark_size(args.lines, seed=args.seed)
+    benchmark_render(args.lines, repeat=args.repeat, seed=args.seed)
+    benchmark_breeding(args.offspring, seed=args.seed)
@@ -22,8 +22,9 @@ all_combinations = [f"{adj}{noun}" for adj in adjectives for noun in nouns]
 
 def get_names(n: int) -> List[str]:
     # Select n unique combinations
-    if n > len(all_combinations):
-        raise ValueError("n cannot be greater than the total number of combinations")
-
-    unique_combinations = random.sample(all_combinations, n)
-    return unique_combinations
+    if n <= len(all_combinations):
+        unique_combinations = random.sample(all_combinations, n)
+        return unique_combinations
+    # Larger populations (e.g. in benchmarks) get numbered combinations: SwiftFalcon, SwiftFalcon1, ...
+    rounds = -(-n // len(all_combinations))
+    return random.sample([f"{name}{i}" if i else name for i in range(rounds) for name in all_combinations], n)
@@ -3,14 +3,23 @@
 """
 Checkpoint manager for the genetic programming system.
 Provides utilities to list, inspect, and manage checkpoint files.
+
+Generations in the generation log are listed and inspected from its metadata index alone; genomes are only
+read for diff and lineage, and only the ones that are shown.
 """
 
+import difflib
+import json
 import os
 import pickle
 import argparse
-from typing import List, Tuple
+from typing import Dict, List, Tuple
+from src.generation_log import GenerationLog, read_index
 from src.genetic_algorithm import find_latest_checkpoint
-from src.util import timestamp
+from src.profiling import bytecodes_per_turn
+from src.util import code_to_string, timestamp
+
+legacy_index_file_name = "checkpoint-index.json"
 
 
 def list_checkpoints(checkpoint_dir: str = "checkpoints") -> List[Tuple[int, str]]:
@@ -34,24 +43,49 @@ def list_checkpoints(checkpoint_dir: str = "checkpoints") -> List[Tuple[int, str
     return sorted(generations, key=lambda x: x[0])
 
 
+def checkpoint_metadata(checkpoint_file: str) -> Dict:
+    """
+    Generation and bot names of a pickle checkpoint.
+    They are cached in checkpoint-index.json next to the checkpoint, so every file is unpickled only once.
+    """
+    index_path = os.path.join(os.path.dirname(checkpoint_file), legacy_index_file_name)
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+    key = os.path.basename(checkpoint_file)
+    stat = os.stat(checkpoint_file)
+    entry = index.get(key)
+    if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+        with open(checkpoint_file, 'rb') as f:
+            checkpoint_data = pickle.load(f)
+        entry = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "generation": checkpoint_data.get('generation', 'Unknown'),
+            "names": [name for name, _ in checkpoint_data.get('population', [])],
+        }
+        index[key] = entry
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+    return entry
+
+
 def inspect_checkpoint(checkpoint_file: str):
     """
     Inspect the contents of a checkpoint file.
     """
     try:
-        with open(checkpoint_file, 'rb') as f:
-            checkpoint_data = pickle.load(f)
-        
-        generation = checkpoint_data.get('generation', 'Unknown')
-        population = checkpoint_data.get('population', [])
+        metadata = checkpoint_metadata(checkpoint_file)
+        names = metadata["names"]
         
         print(f"Checkpoint: {checkpoint_file}")
-        print(f"Generation: {generation}")
-        print(f"Population size: {len(population)}")
+        print(f"Generation: {metadata['generation']}")
+        print(f"Population size: {len(names)}")
         
-        if population:
+        if names:
             print(f"Bot names:")
-            for name, _ in population:
+            for name in names:
                 print(f"  - {name}")
         
         print()
@@ -60,6 +94,107 @@ def inspect_checkpoint(checkpoint_file: str):
         print(f"Error reading checkpoint {checkpoint_file}: {e}")
 
 
+def inspect_generation(entry: Dict):
+    """
+    Inspect a generation of the generation log from its index entry.
+    """
+    print(f"Generation: {entry['generation']}")
+    print(f"Population size: {len(entry['members'])}")
+    print(f"Best bot: {entry['best'] or 'not evaluated yet'}")
+    print(f"Bot names:")
+    profiles = entry.get('profiles', {})
+    for name, hash, _ in entry['members']:
+        profile = profiles.get(name)
+        summary = (f": {bytecodes_per_turn(profile):.0f} bytecodes per turn, max {profile['maxBytecodes']}, "
+                   f"{profile['overBudget']} turns over budget, {profile['exceptions']} exceptions") if profile else ""
+        print(f"  - {name} ({hash[:12]}){summary}")
+    print()
+
+
+def generation_of(bot_name: str) -> int:
+    """Generation a bot belongs to, from its 'genN.' name prefix."""
+    return int(bot_name.split(".", 1)[0].replace("gen", ""))
+
+
+def find_member(index: Dict[int, Dict], bot_name: str) -> Tuple[str, int]:
+    """Return the genome hash and genome offset of a logged bot."""
+    entry = index.get(generation_of(bot_name))
+    for name, hash, offset in entry['members'] if entry else []:
+        if name == bot_name:
+            return hash, offset
+    raise KeyError(f"Bot {bot_name} is not in the generation log")
+
+
+def diff_generations(checkpoint_dir: str, index: Dict[int, Dict], first: int, second: int):
+    """
+    Print which genomes the second generation kept, gained and lost compared to the first, and the parents
+    of the new ones.
+    """
+    members1 = {hash: name for name, hash, _ in index[first]['members']}
+    members2 = {hash: name for name, hash, _ in index[second]['members']}
+    parents = GenerationLog(checkpoint_dir).read_record(second)['parents'] if second == first + 1 else {}
+    kept = [hash for hash in members2 if hash in members1]
+    print(f"Generation {first} -> {second}: {len(kept)} genomes kept, "
+          f"{len(members2) - len(kept)} new, {len(members1) - len(kept)} dropped")
+    for hash, name in members2.items():
+        if hash not in members1:
+            origin = f" from {' x '.join(parents[name])}" if name in parents else ""
+            print(f"  + {name} ({hash[:12]}){origin}")
+    for hash, name in members1.items():
+        if hash not in members2:
+            print(f"  - {name} ({hash[:12]})")
+
+
+def diff_bots(checkpoint_dir: str, index: Dict[int, Dict], first: str, second: str):
+    """Print a unified diff of the code of two logged bots."""
+    log = GenerationLog(checkpoint_dir)
+    code1 = code_to_string(log.read_genome(find_member(index, first)[0]))
+    code2 = code_to_string(log.read_genome(find_member(index, second)[0]))
+    for line in difflib.unified_diff(code1.split("\n"), code2.split("\n"), first, second, lineterm=""):
+        print(line)
+
+
+def print_lineage(checkpoint_dir: str, index: Dict[int, Dict], bot_name: str, depth: int = 10,
+                  show_code: bool = False):
+    """
+    Print the ancestors of a logged bot, generation by generation, up to `depth` generations back.
+    Only the generation records on the way are read, and genomes only with show_code.
+    """
+    log = GenerationLog(checkpoint_dir)
+    records = {}
+    current = [bot_name]
+    generation = generation_of(bot_name)
+    for _ in range(depth + 1):
+        if not current or generation not in index:
+            break
+        if generation not in records:
+            records[generation] = log.read_record(generation)
+        parents = records[generation]['parents']
+        previous = []
+        indent = "  " * (generation_of(bot_name) - generation)
+        for name in current:
+            hash, _ = find_member(index, name)
+            origin = parents.get(name, ())
+            if not origin:
+                description = "initial"
+            elif ":" in origin[0]:  # Names of other islands' bots are prefixed with their island
+                description = "migrated from " + origin[0]
+                origin = ()
+            elif len(origin) == 2:
+                description = "crossover of " + " x ".join(origin)
+            elif generation - 1 in index and find_member(index, origin[0])[0] == hash:
+                description = "carried over from " + origin[0]
+            else:
+                description = "mutation of " + origin[0]
+            print(f"{indent}{name} ({hash[:12]}): {description}")
+            if show_code:
+                for line in code_to_string(log.read_genome(hash)).split("\n"):
+                    print(f"{indent}    {line}")
+            previous += [parent for parent in origin if parent not in previous]
+        current = previous
+        generation -= 1
+
+
 def delete_checkpoint(checkpoint_file: str):
     """
     Delete a specific checkpoint file.
@@ -101,9 +236,23 @@ def main():
     
     # Inspect command
     inspect_parser = subparsers.add_parser('inspect', help='Inspect a checkpoint')
-    inspect_parser.add_argument('checkpoint', nargs='?', help='Checkpoint file to inspect (or "latest")')
+    inspect_parser.add_argument('checkpoint', nargs='?',
+                                help='Logged generation or checkpoint file to inspect (or "latest")')
     inspect_parser.add_argument('--dir', default='checkpoints', help='Checkpoint directory')
     
+    # Diff command
+    diff_parser = subparsers.add_parser('diff', help='Compare two logged generations or the code of two bots')
+    diff_parser.add_argument('first', help='Generation number or bot name (e.g. gen3.Alice)')
+    diff_parser.add_argument('second', help='Generation number or bot name')
+    diff_parser.add_argument('--dir', default='checkpoints', help='Checkpoint directory')
+    
+    # Lineage command
+    lineage_parser = subparsers.add_parser('lineage', help='Show the ancestors of a logged bot')
+    lineage_parser.add_argument('bot', help='Bot name (e.g. gen3.Alice)')
+    lineage_parser.add_argument('--depth', type=int, default=10, help='Number of generations to go back')
+    lineage_parser.add_argument('--code', action='store_true', help='Also print the code of every ancestor')
+    lineage_parser.add_argument('--dir', default='checkpoints', help='Checkpoint directory')
+    
     # Delete command  
     delete_parser = subparsers.add_parser('delete', help='Delete a checkpoint')
     delete_parser.add_argument('checkpoint', help='Checkpoint file to delete')
@@ -116,10 +265,16 @@ def main():
     args = parser.parse_args()
     
     if args.command == 'list':
+        index = read_index(args.dir)
         checkpoints = list_checkpoints(args.dir)
-        if not checkpoints:
+        if index:
+            print(f"Found {len(index)} logged generations:")
+            for generation, entry in sorted(index.items()):
+                print(f"  Generation {generation:2d}: {len(entry['members'])} bots, "
+                      f"best: {entry['best'] or 'not evaluated yet'}")
+        if not index and not checkpoints:
             print(f"No checkpoints found in {args.dir}")
-        else:
+        elif checkpoints:
             print(f"Found {len(checkpoints)} checkpoints:")
             for gen, filename in checkpoints:
                 filepath = os.path.join(args.dir, filename)
@@ -131,6 +286,14 @@ def main():
                 print(f"\nLatest: {os.path.basename(latest)}")
     
     elif args.command == 'inspect':
+        index = read_index(args.dir)
+        if index and (args.checkpoint in ('latest', None) or args.checkpoint.isdigit()):
+            generation = max(index) if args.checkpoint in ('latest', None) else int(args.checkpoint)
+            if generation not in index:
+                print(f"Generation {generation} is not in the generation log in {args.dir}")
+                return
+            inspect_generation(index[generation])
+            return
         if args.checkpoint == 'latest' or args.checkpoint is None:
             checkpoint_file = find_latest_checkpoint(args.dir)
             if not checkpoint_file:
@@ -143,6 +306,21 @@ def main():
         
         inspect_checkpoint(checkpoint_file)
     
+    elif args.command == 'diff':
+        index = read_index(args.dir)
+        if args.first.isdigit() and args.second.isdigit():
+            first, second = int(args.first), int(args.second)
+            for generation in (first, second):
+                if generation not in index:
+                    print(f"Generation {generation} is not in the generation log in {args.dir}")
+                    return
+            diff_generations(args.dir, index, first, second)
+        else:
+            diff_bots(args.dir, index, args.first, args.second)
+    
+    elif args.command == 'lineage':
+        print_lineage(args.dir, read_index(args.dir), args.bot, args.depth, args.code)
+    
     elif args.command == 'delete':
         delete_checkpoint(args.checkpoint)
     
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+from typing import Dict, List
+
+from src.match_server import gradle_path, java_executable, resolve_runtime_classpath
+from src.util import timestamp
+
+# Paths
+battlecode_path = os.path.join(gradle_path, "src")
+classes_path = os.path.join(gradle_path, "build", "genclasses")
+manifest_path = os.path.join(classes_path, "manifest.json")
+
+# Hand-written players that generated bots are matched against
+base_players = ["examplefuncsplayer"]
+
+
+def generation_of(bot_name: str) -> str:
+    """Return the generation package of a bot (e.g. 'gen3'), or 'base' for hand-written players."""
+    return bot_name.split(".")[0] if "." in bot_name else "base"
+
+
+def class_location(bot_name: str) -> str:
+    """Return the class directory the bot is compiled into, for the classLocationA/B match properties."""
+    return os.path.join(classes_path, generation_of(bot_name))
+
+
+def source_path(bot_name: str) -> str:
+    return os.path.join(battlecode_path, *bot_name.split("."), "RobotPlayer.java")
+
+
+def class_file_path(bot_name: str) -> str:
+    return os.path.join(class_location(bot_name), *bot_name.split("."), "RobotPlayer.class")
+
+
+def source_hash(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def load_manifest() -> Dict[str, str]:
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as file:
+        return json.load(file)
+
+
+def save_manifest(manifest: Dict[str, str]) -> None:
+    os.makedirs(classes_path, exist_ok=True)
+    temporary_path = manifest_path + ".tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(manifest, file)
+    os.replace(temporary_path, manifest_path)
+
+
+def run_javac(sources: List[str], output_path: str, classpath: str) -> None:
+    """Compile all sources with one javac invocation. Raises RuntimeError on compile errors."""
+    os.makedirs(output_path, exist_ok=True)
+    # Pass the file list through an argument file so large generations don't hit command line limits
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as argfile:
+        argfile.write("\n".join(f'"{source}"' for source in sources).replace("\\", "\\\\"))
+    try:
+        result = subprocess.run(
+            [java_executable("javac"), "-encoding", "UTF-8", "-nowarn", "-cp", classpath, "-d", output_path,
+             f"@{argfile.name}"],
+            capture_output=True,
+            text=True,
+            timeout=3600,
+        )
+    finally:
+        os.remove(argfile.name)
+    if result.returncode != 0:
+        print(f"{timestamp()} javac failed. Return code: {result.returncode}")
+        print(f"{timestamp()} Error Output:\n{result.stderr}")
+        raise RuntimeError("Build failed", result.stderr)
+
+
+def compile_bots(bot_names: List[str]) -> int:
+    """
+    Compile the bots whose source changed since their last compile.
+    Every generation gets its own class directory, so earlier generations are never recompiled.
+
+    :param bot_names: Names of the bots, e.g. 'gen3.SwiftFalcon' or 'examplefuncsplayer'
+    :return: Number of bots that were compiled
+    """
+    manifest = load_manifest()
+    outdated: Dict[str, List[str]] = {}
+    hashes = {}
+    for bot_name in bot_names:
+        hashes[bot_name] = source_hash(source_path(bot_name))
+        if manifest.get(bot_name) != hashes[bot_name] or not os.path.exists(class_file_path(bot_name)):
+            outdated.setdefault(generation_of(bot_name), []).append(bot_name)
+
+    if not outdated:
+        print(f"{timestamp()} All {len(bot_names)} bots are up to date.")
+        return 0
+
+    classpath = resolve_runtime_classpath()
+    compiled = 0
+    for generation, names in outdated.items():
+        print(f"{timestamp()} Compiling {len(names)} bots into {generation}...")
+        run_javac([source_path(name) for name in names], os.path.join(classes_path, generation), classpath)
+        for name in names:
+            manifest[name] = hashes[name]
+        compiled += len(names)
+    save_manifest(manifest)
+    print(f"{timestamp()} Compiled {compiled} of {len(bot_names)} bots.")
+    return compiled
@@ -0,0 +1,123 @@
+import hashlib
+import math
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from src.match_result import GameResult, MatchResult
+
+WINNER_MODELS = ["coin", "skill"]
+
+# Behaviour of all fake workers, see configure_fake_engine
+_latency = 0.0
+_jitter = 0.0
+_failure_rate = 0.0
+_winners = "coin"
+_skill_spread = 1.0
+_failures = random.Random(0)
+_lock = threading.Lock()
+_games_played = 0
+
+
+def configure_fake_engine(latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0,
+                          winners: str = "coin", skill_spread: float = 1.0, seed: int = 0) -> None:
+    """
+    Configure the fake engine, e.g. for benchmarks of the orchestration layer.
+
+    :param latency: Seconds every game takes
+    :param jitter: Maximum deviation from the latency, drawn uniformly per game
+    :param failure_rate: Probability that a batch fails as if its worker crashed; the scheduler retries it
+    :param winners: "coin": every game is a seeded coin flip; "skill": every genome has a hidden skill and wins
+        with the logistic probability of the skill difference
+    :param skill_spread: Standard deviation of the hidden skills
+    :param seed: Seed of the failures
+    """
+    global _latency, _jitter, _failure_rate, _winners, _skill_spread, _failures, _games_played
+    if winners not in WINNER_MODELS:
+        raise ValueError(f"Unknown winner model {winners}, expected one of {', '.join(WINNER_MODELS)}")
+    _latency, _jitter, _failure_rate = latency, jitter, failure_rate
+    _winners, _skill_spread = winners, skill_spread
+    _failures = random.Random(seed)
+    _games_played = 0
+
+
+def games_played() -> int:
+    """Games played by all fake workers since the engine was configured."""
+    return _games_played
+
+
+def hidden_skill(package: str) -> float:
+    """Skill of a genome in the "skill" model, fixed by its package so elites keep it."""
+    return random.Random(package).gauss(0, _skill_spread)
+
+
+def fake_profile(team: str, rounds: int) -> Dict[str, int]:
+    """Team stats with a bytecode profile: every bot has a fixed cost per turn, drawn from a RNG seeded with its name."""
+    rng = random.Random(team)
+    per_turn = rng.randint(500, 30000)
+    robots = 50
+    turns = robots * rounds
+    over_budget = turns * max(0, per_turn - 25000) // 50000
+    return {"outputLines": 0, "exceptions": rng.randint(0, 3), "robots": robots, "turns": turns,
+            "bytecodes": turns * per_turn, "maxBytecodes": int(per_turn * 1.5), "overBudget": over_budget}
+
+
+class FakeMatchWorker:
+    """
+    Stand-in for JvmMatchWorker that needs no Java toolchain.
+    The winner is drawn from a RNG seeded with the team names, map and seed, so a game always has the same outcome,
+    and the result looks like the record the match worker reports. Latency, failures and the winner model are set
+    with configure_fake_engine.
+    """
+
+    def __init__(self):
+        self.matches_played = 0
+
+    def alive(self) -> bool:
+        return True
+
+    def run_match(self, match_id: str, properties: Dict[str, str]) -> MatchResult:
+        global _games_played
+        team_a = properties["bc.game.team-a"]
+        team_b = properties["bc.game.team-b"]
+        maps = properties.get("bc.game.maps", "DefaultSmall")
+        match_seed = properties.get("matchworker.seed", "0")
+        games = []
+        for map_name in maps.split(","):
+            seed = hashlib.sha256(f"{team_a}|{team_b}|{map_name}|{match_seed}".encode()).hexdigest()
+            rng = random.Random(seed)
+            if _winners == "skill":
+                difference = (hidden_skill(properties.get("bc.game.team-a.package", team_a))
+                              - hidden_skill(properties.get("bc.game.team-b.package", team_b)))
+                a_wins = rng.random() < 1 / (1 + math.exp(-difference))
+            else:
+                a_wins = rng.random() < 0.5
+            winner, side = (team_a, "A") if a_wins else (team_b, "B")
+            games.append(GameResult(side, winner, "The winning team won on tiebreakers (more flags captured).",
+                                    rng.randint(200, 2000)))
+            if _latency or _jitter:
+                time.sleep(max(0.0, _latency + rng.uniform(-_jitter, _jitter)))
+        with _lock:
+            _games_played += len(games)
+        self.matches_played += 1
+        first = games[0]
+        return MatchResult(
+            winner=first.winner,
+            winner_name=first.winner_name,
+            reason=first.reason,
+            rounds=first.rounds,
+            teams={"A": fake_profile(team_a, first.rounds), "B": fake_profile(team_b, first.rounds)},
+            games=games,
+        )
+
+    def run_batch(self, requests: List[Tuple[str, Dict[str, str]]]) -> List[MatchResult]:
+        if _failure_rate:
+            with _lock:
+                failed = _failures.random() < _failure_rate
+            if failed:
+                raise RuntimeError("Fake worker crashed")
+        return [self.run_match(match_id, properties) for match_id, properties in requests]
+
+    def close(self) -> None:
+        pass
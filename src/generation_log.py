@@ -0,0 +1,227 @@
+import json
+import os
+import pickle
+import random
+import struct
+import zlib
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from src.genome_cache import genome_hash
+from src.mutatable import Mutatable, TABLE_FINGERPRINT
+from src.util import timestamp
+
+# Paths
+default_log_dir = "checkpoints"
+log_file_name = "generations.log"
+index_file_name = "generations.idx"
+
+# Record header: magic, kind, key, payload length, CRC-32 of the payload.
+# The key is the genome's SHA-256 for genome records and the generation number for generation records,
+# so the records can be indexed by reading their headers only.
+HEADER = struct.Struct("<2sB32sII")
+MAGIC = b"GL"
+GENOME = 1
+GENERATION = 2
+
+
+@dataclass
+class LoggedGeneration:
+    """One generation as stored in the generation log."""
+    generation: int
+    population: List[Tuple[str, List[Mutatable]]]
+    scores: Optional[List[Tuple[int, str]]] = None  # (rank, name) once the generation was evaluated
+    random_state: Optional[tuple] = None  # State of the random module when the generation was logged
+    parents: Dict[str, Tuple[str, ...]] = field(default_factory=dict)  # Member name -> names of its parents
+    matches: Optional[List[Tuple[str, str]]] = None  # (winner, loser) of every tournament game, if recorded
+    profiles: Dict[str, Dict[str, int]] = field(default_factory=dict)  # Member name -> bytecode profile
+
+
+class GenerationLog:
+    """
+    Append-only log of all generations of a run.
+
+    Every unique genome is stored once, keyed by its hash. Every generation is stored as a list of
+    (name, genome hash) references with its rankings, the parents of its members and the random state.
+    Records are zlib-compressed pickles behind a fixed-size header. Opening the log reads only the headers,
+    so any generation can be loaded by seeking to its record and the records of its genomes.
+    A record cut off by a crash is detected by its length and checksum and dropped on the next append.
+
+    Next to the log, a metadata index (generations.idx, one JSON line per generation record) holds the names,
+    genome hashes, byte offsets and bytecode profiles of every generation's members and its best bot, so tools
+    can list and inspect a run without opening the log (see read_index).
+    """
+
+    def __init__(self, directory: str = default_log_dir):
+        self.path = os.path.join(directory, log_file_name)
+        self.index_path = os.path.join(directory, index_file_name)
+        self.genome_offsets: Dict[str, int] = {}  # Genome hash -> offset of its record
+        self.generation_offsets: Dict[int, int] = {}  # Generation -> offset of its latest record
+        self.end = 0  # Offset after the last complete record
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as file:
+                self._scan(file)
+
+    def _scan(self, file: BinaryIO) -> None:
+        size = os.fstat(file.fileno()).st_size
+        offset = 0
+        while offset + HEADER.size <= size:
+            file.seek(offset)
+            magic, kind, key, length, checksum = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or offset + HEADER.size + length > size:
+                break
+            # Records are only ever appended, so only the last one can be torn
+            if offset + HEADER.size + length == size and zlib.crc32(file.read(length)) != checksum:
+                break
+            if kind == GENOME:
+                self.genome_offsets[key.hex()] = offset
+            elif kind == GENERATION:
+                self.generation_offsets[int.from_bytes(key[:8], "little")] = offset
+            offset += HEADER.size + length
+        self.end = offset
+
+    def generations(self) -> List[int]:
+        """Numbers of all logged generations in ascending order."""
+        return sorted(self.generation_offsets)
+
+    def _read(self, file: BinaryIO, offset: int):
+        file.seek(offset)
+        _, _, _, length, _ = HEADER.unpack(file.read(HEADER.size))
+        return pickle.loads(zlib.decompress(file.read(length)))
+
+    def _write(self, file: BinaryIO, kind: int, key: bytes, value) -> int:
+        payload = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        offset = self.end
+        file.seek(offset)
+        file.write(HEADER.pack(MAGIC, kind, key.ljust(32, b"\0"), len(payload), zlib.crc32(payload)))
+        file.write(payload)
+        self.end = offset + HEADER.size + len(payload)
+        return offset
+
+    def append(self, generation: int, population: List[Tuple[str, List[Mutatable]]],
+               scores: Optional[List[Tuple[int, List[Mutatable], str]]] = None,
+               random_state: Optional[tuple] = None, parents: Optional[Dict[str, Tuple[str, ...]]] = None,
+               matches: Optional[List[Tuple[str, str]]] = None,
+               profiles: Optional[Dict[str, Dict[str, int]]] = None) -> None:
+        """
+        Log a generation. Only genomes that aren't in the log yet are written.
+        A generation can be logged more than once (e.g. before and after its evaluation); the last record counts.
+
+        :param scores: Ranked (rank, code, name) tuples, if the generation was evaluated
+        :param random_state: State of the random module (default: the current state)
+        :param parents: Names of the parents of every member
+        :param matches: (winner, loser) of every game of the generation's tournament
+        :param profiles: Bytecode profiles of the members, see profiling.py
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        members = []
+        new_genomes = 0
+        with open(self.path, "r+b" if os.path.exists(self.path) else "w+b") as file:
+            file.truncate(self.end)  # Drop a record cut off by a crash
+            for name, code in population:
+                hash = genome_hash(code)
+                if hash not in self.genome_offsets:
+                    self.genome_offsets[hash] = self._write(file, GENOME, bytes.fromhex(hash), code)
+                    new_genomes += 1
+                members.append((name, hash))
+            record = {
+                "members": members,
+                "scores": [(rank, name) for rank, _, name in scores] if scores is not None else None,
+                "random_state": random_state if random_state is not None else random.getstate(),
+                "parents": parents or {},
+                "matches": matches,
+                "profiles": profiles or {},
+                "templates": TABLE_FINGERPRINT,
+            }
+            key = generation.to_bytes(8, "little")
+            self.generation_offsets[generation] = self._write(file, GENERATION, key, record)
+            file.flush()
+            os.fsync(file.fileno())
+        with open(self.index_path, "a") as index:
+            index.write(json.dumps(self._index_entry(generation, record)) + "\n")
+        print(f"{timestamp()} Logged generation {generation} ({new_genomes} new genomes)")
+
+    def _index_entry(self, generation: int, record: Dict) -> Dict:
+        scores = record["scores"]
+        return {
+            "generation": generation,
+            "offset": self.generation_offsets[generation],
+            "end": self.end,
+            "members": [[name, hash, self.genome_offsets[hash]] for name, hash in record["members"]],
+            "best": min(scores)[1] if scores else None,
+            "profiles": record.get("profiles", {}),
+        }
+
+    def rebuild_index(self) -> None:
+        """Rewrite the metadata index from the generation records of the log."""
+        entries = []
+        with open(self.path, "rb") as file:
+            offset = 0
+            while offset < self.end:
+                file.seek(offset)
+                _, kind, key, length, _ = HEADER.unpack(file.read(HEADER.size))
+                if kind == GENERATION:
+                    generation = int.from_bytes(key[:8], "little")
+                    entry = self._index_entry(generation, self._read(file, offset))
+                    entry.update(offset=offset, end=offset + HEADER.size + length)
+                    entries.append(entry)
+                offset += HEADER.size + length
+        with open(self.index_path, "w") as index:
+            index.writelines(json.dumps(entry) + "\n" for entry in entries)
+
+    def read_record(self, generation: int) -> Dict:
+        """Load the record of a generation without its genomes: member references, scores, parents."""
+        with open(self.path, "rb") as file:
+            return self._read(file, self.generation_offsets[generation])
+
+    def read_genome(self, hash: str, file: Optional[BinaryIO] = None) -> List[Mutatable]:
+        """Load a single genome by its hash."""
+        if file is None:
+            with open(self.path, "rb") as file:
+                return self._read(file, self.genome_offsets[hash])
+        return self._read(file, self.genome_offsets[hash])
+
+    def load(self, generation: Optional[int] = None) -> LoggedGeneration:
+        """
+        Load a generation and its genomes, reading only their records.
+
+        :param generation: Generation to load (default: the latest one)
+        """
+        if generation is None:
+            generation = max(self.generation_offsets)
+        with open(self.path, "rb") as file:
+            record = self._read(file, self.generation_offsets[generation])
+            # Genomes refer to templates by their position in mutatable_strings
+            if record["templates"] != TABLE_FINGERPRINT:
+                raise RuntimeError("Generation was logged with different mutatable_strings", self.path)
+            genomes = {hash: self.read_genome(hash, file) for hash in dict.fromkeys(h for _, h in record["members"])}
+        population = [(name, genomes[hash]) for name, hash in record["members"]]
+        return LoggedGeneration(generation, population, record["scores"], record["random_state"], record["parents"],
+                                record.get("matches"), record.get("profiles", {}))
+
+
+def read_index(directory: str = default_log_dir) -> Dict[int, Dict]:
+    """
+    Read the metadata index of a generation log: generation -> latest entry with "members"
+    ([name, genome hash, genome offset]), "best" (name of the best bot, if evaluated), "profiles" (name ->
+    bytecode profile) and the record's byte offset.
+    Only the index is read, unless it is missing or doesn't match the log (e.g. after a crash), in which case it
+    is rebuilt first.
+    """
+    log_path = os.path.join(directory, log_file_name)
+    index_path = os.path.join(directory, index_file_name)
+    if not os.path.exists(log_path):
+        return {}
+    entries = []
+    if os.path.exists(index_path):
+        with open(index_path) as index:
+            entries = [json.loads(line) for line in index if line.strip()]
+    log_size = os.path.getsize(log_path)
+    if not entries or entries[-1]["end"] != log_size:
+        log = GenerationLog(directory)
+        if not entries or entries[-1]["end"] != log.end:
+            print(f"{timestamp()} Rebuilding the generation index of {log_path}")
+            log.rebuild_index()
+            with open(index_path) as index:
+                entries = [json.loads(line) for line in index if line.strip()]
+    return {entry["generation"]: entry for entry in entries}
@@ -1,45 +1,57 @@
+import copy
+import math
 import random
 import pickle
 import os
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
+from src import reproduction, tracing
+from src.adjudication import round_cap, truncation_report
 from src.bot_names import get_names
-from src.mutatable import Mutatable
+from src.generation_log import GenerationLog
+from src.mutatable import Mutatable, TABLE_FINGERPRINT
 from src.mutatable_strings import actions, ifs
-from src.battlecode_runner import make_bot, build_bots
-from src.tournament import run_one_game_tournament, run_double_elimination_tournament
+from src.battlecode_runner import bot_genome, make_bot, build_bots
+from src.result_store import get_result_store
+from src.scheduler import get_scheduler
+from src.surrogate import get_surrogate
+from src.profiling import profile_report, take_profiles
+from src.ratings import games_per_generation, get_rating_store
+from src.tournament import run_one_game_tournament, run_double_elimination_tournament, series_report, \
+    equivalent_pairings, one_game_matches, run_rating_tournament, run_swiss_tournament, swiss_rounds
 from src.util import timestamp
 
 
-def generate_random_line() -> Mutatable:
-    return Mutatable("action", random.choice(random.choice([actions, ifs])))
+def generate_random_line(rng=random) -> Mutatable:
+    return Mutatable("action", rng.choice(rng.choice([actions, ifs])), rng)
 
 
-def generate_random_code(length=50) -> List[Mutatable]:
+def generate_random_code(length=50, rng=random) -> List[Mutatable]:
     code = []
     for i in range(length):
-        code.append(generate_random_line())
+        code.append(generate_random_line(rng))
     return code
 
 
-def mutate(code: List[Mutatable]) -> List[Mutatable]:
+def mutate(code: List[Mutatable], rng=random) -> List[Mutatable]:
     new_code = []
     for mutatable in code:
-        rand = random.random()
+        rand = rng.random()
         if rand < 0.1:  # 10% chance to delete the line
             continue
         elif rand < 0.2:  # 10% chance to add a line
             new_code.append(mutatable)
-            new_code.append(generate_random_line())
+            new_code.append(generate_random_line(rng))
         elif rand < 0.4:  # 20% chance to mutate the line
-            mutatable.mutate()
+            mutatable = copy.deepcopy(mutatable)  # Lines are shared with the parent, which may be an elite
+            mutatable.mutate(rng)
             new_code.append(mutatable)
         else:
             new_code.append(mutatable)
     return new_code
 
 
-def crossover(code1: List[Mutatable], code2: List[Mutatable]) -> List[Mutatable]:
+def crossover(code1: List[Mutatable], code2: List[Mutatable], rng=random) -> List[Mutatable]:
     """
     Perform uniform crossover with handling for differing code lengths.
     Each line has a 50% chance of being taken from either parent, with optional truncation or extension.
@@ -49,26 +61,101 @@ def crossover(code1: List[Mutatable], code2: List[Mutatable]) -> List[Mutatable]
 
     # Mix lines probabilistically
     for i in range(max_len):
-        offspring.append(random.choice([code1[i], code2[i]]))
+        offspring.append(rng.choice([code1[i], code2[i]]))
 
     # Randomly add extra lines from the longer parent
     longer_parent = code1 if len(code1) > len(code2) else code2
     for i in range(max_len, len(longer_parent)):
-        if random.random() < 0.5:  # 50% chance to include remaining lines
+        if rng.random() < 0.5:  # 50% chance to include remaining lines
             offspring.append(longer_parent[i])
 
     return offspring
 
 
-def save_checkpoint(population: List[Tuple[str, List[Mutatable]]], generation: int, checkpoint_dir: str = "checkpoints") -> None:
+def plan_offspring(number: int, number_of_parents: int) -> List[Tuple[str, Tuple[int, ...], int]]:
+    """
+    Draw the breeding decisions for a number of offspring before the parents are known.
+    Parents are referred to by their index among the top individuals, and every offspring gets its own seed,
+    so it can be bred as soon as its parents are known, in any order, with a deterministic result.
+
+    :return: List of (operation, parent indices, seed)
+    """
+    plan = []
+    for _ in range(number):
+        if random.random() < 0.5:  # Mutation
+            parents = (random.randrange(number_of_parents),)
+            plan.append(("mutation", parents, random.getrandbits(64)))
+        else:  # Crossover
+            parents = (random.randrange(number_of_parents), random.randrange(number_of_parents))
+            plan.append(("crossover", parents, random.getrandbits(64)))
+    return plan
+
+
+def breed_offspring(operation: str, parents: List[List[Mutatable]], seed: int) -> List[Mutatable]:
+    """
+    Breed one planned offspring. mutate() copies the lines it changes, so parents stay unchanged even if they
+    are still being evaluated or compiled.
+    """
+    rng = random.Random(seed)
+    if operation == "mutation":
+        return mutate(parents[0], rng)
+    return crossover(parents[0], parents[1], rng)
+
+
+def make_offspring(top_individuals: List[Tuple[int, List[Mutatable], str]],
+                   number: int) -> Tuple[List[List[Mutatable]], List[Tuple[str, ...]]]:
+    """
+    Breed offspring from the top individuals by mutation and crossover.
+    With NumPy, the whole generation is bred in one batch (see reproduction.py), seeded from the random module
+    so it is reproducible from a checkpoint. Otherwise offspring are bred one at a time.
+
+    :return: The offspring and the names of the parents of every offspring
+    """
+    if reproduction.available():
+        offspring, parents = reproduction.breed([code for _, code, _ in top_individuals], number,
+                                                random.getrandbits(64))
+        return offspring, [tuple(top_individuals[i][2] for i in indices) for indices in parents]
+    offspring = []
+    parents = []
+    while len(offspring) < number:
+        if random.random() < 0.5:  # Mutation
+            _, code, name = random.choice(top_individuals)
+            offspring.append(mutate(code))
+            parents.append((name,))
+        else:  # Crossover
+            _, code1, name1 = random.choice(top_individuals)
+            _, code2, name2 = random.choice(top_individuals)
+            offspring.append(crossover(code1, code2))
+            parents.append((name1, name2))
+    return offspring, parents
+
+
+def make_screened_offspring(top_individuals: List[Tuple[int, List[Mutatable], str]],
+                            number: int) -> Tuple[List[List[Mutatable]], List[Tuple[str, ...]]]:
+    """
+    Breed more offspring than needed and let the surrogate model pick the ones that are evaluated
+    (see surrogate.py). Without a surrogate, this is make_offspring.
+    """
+    surrogate = get_surrogate()
+    if surrogate is None:
+        return make_offspring(top_individuals, number)
+    candidates, parents = make_offspring(top_individuals, math.ceil(number * surrogate.oversample))
+    picked = surrogate.screen(candidates, number)
+    return [candidates[i] for i in picked], [parents[i] for i in picked]
+
+
+def save_checkpoint(population: List[Tuple[str, List[Mutatable]]], generation: int, checkpoint_dir: str = "checkpoints",
+                    random_state: Optional[tuple] = None) -> None:
     """
     Save the current population and generation to a checkpoint file.
+    The random state defaults to the current state of the random module.
     """
     os.makedirs(checkpoint_dir, exist_ok=True)
     checkpoint_data = {
         'population': population,
         'generation': generation,
-        'random_state': random.getstate()
+        'random_state': random_state if random_state is not None else random.getstate(),
+        'templates': TABLE_FINGERPRINT,
     }
     checkpoint_file = os.path.join(checkpoint_dir, f"checkpoint_gen_{generation}.pkl")
     with open(checkpoint_file, 'wb') as f:
@@ -83,6 +170,9 @@ def load_checkpoint(checkpoint_file: str) -> Tuple[List[Tuple[str, List[Mutatabl
     """
     with open(checkpoint_file, 'rb') as f:
         checkpoint_data = pickle.load(f)
+    # Genomes refer to templates by their position in mutatable_strings
+    if checkpoint_data.get('templates', TABLE_FINGERPRINT) != TABLE_FINGERPRINT:
+        raise RuntimeError("Checkpoint was written with different mutatable_strings", checkpoint_file)
     
     # Restore random state to ensure reproducibility
     random.setstate(checkpoint_data['random_state'])
@@ -119,50 +209,126 @@ def find_latest_checkpoint(checkpoint_dir: str = "checkpoints") -> Optional[str]
     return os.path.join(checkpoint_dir, latest_file)
 
 
-def fitness(java_codes: List[Tuple[str, List[Mutatable]]], generation: int) -> List[Tuple[int, List[Mutatable], str]]:
+def fitness(java_codes: List[Tuple[str, List[Mutatable]]],
+            generation: int) -> Tuple[List[Tuple[int, List[Mutatable], str]], List[Tuple[str, str]], Dict[str, Dict]]:
     """
     Evaluate the fitness of Java bots using a tournament.
-    Bots are ranked based on their performance.
+    Bots are ranked based on their performance: by a Swiss-system tournament if one is configured, otherwise by
+    their ratings (see run_rating_tournament), or by a one-game tournament if ratings are disabled.
+
+    :return: The ranked (rank, code, name) tuples, (winner, loser) of every game and the bytecode profile of every
+        bot that played a match (see profiling.py)
     """
     # Create bots/files
     result = []
     names = [name for name, _ in java_codes]
-    for name, java_code in java_codes:
-        make_bot(name, java_code)
-        result.append((0, java_code, name))  # Initialize rank as 0
-    build_bots()
+    lines_removed = 0
+    with tracing.span("make bots", generation=generation, bots=len(java_codes)):
+        for name, java_code in java_codes:
+            lines_removed += make_bot(name, java_code)
+            result.append((0, java_code, name))  # Initialize rank as 0
+    with tracing.span("build bots", generation=generation):
+        build_bots(names)
 
     # Run the tournament
-    rankings = run_one_game_tournament(names)
+    store = get_result_store()
+    hits, skipped = store.hits if store is not None else 0, equivalent_pairings()
+    with tracing.span("tournament", generation=generation):
+        if swiss_rounds() is not None:
+            rankings, matches = run_swiss_tournament(names, swiss_rounds())
+        elif get_rating_store() is not None:
+            rankings, matches = run_rating_tournament(names, games_per_generation(len(names)))
+        else:
+            rankings = run_one_game_tournament(names)
+            matches = one_game_matches(rankings)
+    if store is not None:
+        hits = store.hits - hits
+        print(f"{timestamp()} Result store: {store.report()}")
+    print(f"{timestamp()} Series: {series_report()}")
+    if round_cap() is not None:
+        print(f"{timestamp()} Truncation: {truncation_report()}")
+    skipped = equivalent_pairings() - skipped
+    print(f"{timestamp()} Normalization: {len({bot_genome(name) for name in names})} distinct bots of {len(names)}, "
+          f"{lines_removed} dead or repeated lines removed; {hits + skipped} matches deduplicated "
+          f"({skipped} between equivalent bots, {hits} served from the result store)")
 
     # Update results with final ranks
     ranked_result = [
         (rank, java_codes[names.index(bot_name)][1], bot_name)
         for rank, bot_name in enumerate(rankings, start=1)
     ]
-
-    return ranked_result
-
-
-def genetic_programming(resume_from_checkpoint: bool = True, checkpoint_interval: int = 10):
+    surrogate = get_surrogate()
+    if surrogate is not None:
+        codes = dict(java_codes)
+        surrogate.observe([(codes[winner], codes[loser]) for winner, loser in matches])
+        print(f"{timestamp()} Surrogate: {surrogate.report()}")
+    profiles = take_profiles(names)
+    print(f"{timestamp()} Profiles: {profile_report(profiles)}")
+
+    return ranked_result, matches, profiles
+
+
+def add_immigrants(next_generation: List[Tuple[str, List[Mutatable]]], parents: dict,
+                   immigrants: List[Tuple[str, List[Mutatable]]], generation: int, number_of_offspring: int) -> None:
+    """Replace the last offspring of the next generation with migrants from other islands, in place."""
+    immigrants = immigrants[:number_of_offspring]
+    if not immigrants:
+        return
+    names = ["gen" + str(generation) + "." + name for name in get_names(len(immigrants))]
+    for name, _ in next_generation[-len(immigrants):]:
+        parents.pop(name, None)
+    next_generation[-len(immigrants):] = [(name, code) for name, (_, code) in zip(names, immigrants)]
+    parents.update((name, (origin,)) for name, (origin, _) in zip(names, immigrants))
+    print(f"{timestamp()} Generation {generation}: {len(immigrants)} migrants replace the last offspring")
+
+
+def genetic_programming(resume_from_checkpoint: bool = True, checkpoint_interval: int = 10, pipelined: bool = False,
+                        checkpoint_dir: str = "checkpoints", island=None, population_size: int = 40,
+                        generations: int = 500):
     """
     Main loop for genetic programming with checkpointing support.
     
     Args:
         resume_from_checkpoint: If True, attempts to resume from the latest checkpoint
-        checkpoint_interval: Save checkpoint every N generations
+        checkpoint_interval: Run a best-of-N check every N generations (every generation is logged)
+        pipelined: If True, breed and compile the next generation while the current one's matches finish.
+            Generations are then ranked by one-game tournaments, and offspring aren't screened by the surrogate
+        checkpoint_dir: Directory of the generation log and checkpoints
+        island: The islands.Island this population is, if it runs in island mode; not supported when pipelined
+        population_size: Number of bots per generation; the top half survives
+        generations: Number of generations to evolve
     """
-    initial_population_size = 40
-    population_size = 40
-    generations = 500
+    initial_population_size = population_size
 
-    # Try to resume from checkpoint
+    # Try to resume from the generation log, or a checkpoint of a run from before the log existed
     population = None
     start_generation = 0
+    scores = None
+    parents = {}  # Member name -> names of its parents, logged with the generation
+    log = GenerationLog(checkpoint_dir)
     
     if resume_from_checkpoint:
-        latest_checkpoint = find_latest_checkpoint()
-        if latest_checkpoint:
+        latest_checkpoint = find_latest_checkpoint(checkpoint_dir)
+        if log.generations():
+            logged = log.load()
+            population, start_generation = logged.population, logged.generation
+            random.setstate(logged.random_state)
+            if logged.scores is not None:
+                codes = dict(population)
+                scores = [(rank, codes[name], name) for rank, name in logged.scores]
+            print(f"{timestamp()} Resuming from logged generation {start_generation}")
+            # Train the surrogate model on the matches of all logged generations
+            surrogate = get_surrogate()
+            if surrogate is not None:
+                for generation in log.generations():
+                    earlier = log.load(generation)
+                    if earlier.scores is not None:
+                        # Generations logged before matches were recorded were ranked by one-game tournaments
+                        matches = earlier.matches or one_game_matches([name for _, name in sorted(earlier.scores)])
+                        earlier_codes = dict(earlier.population)
+                        surrogate.observe([(earlier_codes[winner], earlier_codes[loser])
+                                           for winner, loser in matches])
+        elif latest_checkpoint:
             population, start_generation = load_checkpoint(latest_checkpoint)
             print(f"{timestamp()} Resuming from generation {start_generation}")
         else:
@@ -177,9 +343,13 @@ def genetic_programming(resume_from_checkpoint: bool = True, checkpoint_interval
         start_generation = 0
 
     # If we're resuming, first evaluate the fitness of the loaded generation
-    if resume_from_checkpoint and population and start_generation > 0:
-        print(f"{timestamp()} Evaluating fitness of loaded generation {start_generation}")
-        scores = fitness(population, start_generation)
+    # (the pipeline treats the loaded generation like any other)
+    if resume_from_checkpoint and population and start_generation > 0 and not pipelined:
+        if scores is None:
+            print(f"{timestamp()} Evaluating fitness of loaded generation {start_generation}")
+            scores, _, _ = fitness(population, start_generation)
+        else:
+            print(f"{timestamp()} Using the logged rankings of generation {start_generation}")
         scores.sort(key=lambda x: x[0])  # Sort by rank (ascending)
         print(f"Generation {start_generation}: Best Score: {scores[0][0]}")
         
@@ -195,20 +365,18 @@ def genetic_programming(resume_from_checkpoint: bool = True, checkpoint_interval
         )  # Preserve top individuals
 
         # Generate offspring for the remaining slots
-        offspring = []
-        while len(next_generation) + len(offspring) < population_size:
-            if random.random() < 0.5:  # Mutation
-                _, code, _ = random.choice(top_individuals)
-                offspring.append(mutate(code))
-            else:  # Crossover
-                _, code1, _ = random.choice(top_individuals)
-                _, code2, _ = random.choice(top_individuals)
-                offspring.append(crossover(code1, code2))
+        offspring, offspring_parents = make_screened_offspring(top_individuals,
+                                                               population_size - len(next_generation))
         offspring_names = get_names(len(offspring))
         for i in range(len(offspring_names)):
             offspring_names[i] = "gen" + str(start_generation+1) + "." + offspring_names[i]
         for i in range(len(offspring)):
             next_generation.append((offspring_names[i], offspring[i]))
+        parents = {name: (old_name,) for (name, _), (_, _, old_name) in zip(next_generation, top_individuals)}
+        parents.update(zip(offspring_names, offspring_parents))
+        if island is not None:
+            add_immigrants(next_generation, parents, island.exchange(start_generation, scores), start_generation + 1,
+                           len(offspring))
 
         population = next_generation
         start_generation += 1
@@ -218,11 +386,11 @@ def genetic_programming(resume_from_checkpoint: bool = True, checkpoint_interval
     best_of_n_games = 10  # Number of games per match
 
     def best_of_n_fight(bot1: str, bot2: str, n: int = 10, label: str = "") -> None:
-        from src.tournament import run_battle
+        from src.tournament import start_battle
         wins1, wins2 = 0, 0
         print(f"\n{timestamp()} Best of {n} match: {bot1} vs {bot2} {label}")
-        for i in range(n):
-            winner, loser = run_battle(bot1, bot2)
+        results = get_scheduler().map(lambda i: start_battle(bot1, bot2, seed=i), range(n))
+        for i, (winner, loser) in enumerate(results):
             if winner == bot1:
                 wins1 += 1
             else:
@@ -230,18 +398,40 @@ def genetic_programming(resume_from_checkpoint: bool = True, checkpoint_interval
             print(f"Game {i+1}: Winner = {winner}")
         print(f"\n{timestamp()} Best of {n} result: {bot1} {wins1} - {wins2} {bot2} {label}")
 
+    def finish_generation(scores: List[Tuple[int, List[Mutatable], str]], population: List[Tuple[str, List[Mutatable]]],
+                          generation: int, random_state: Optional[tuple] = None,
+                          parents: Optional[dict] = None) -> None:
+        """Report, log and spot-check a pipelined generation once all its results are in."""
+        print(f"Generation {generation}: Best Score: {scores[0][0]}")
+        # The pipeline plays one-game tournaments
+        matches = one_game_matches([name for _, _, name in scores])
+        profiles = take_profiles(name for name, _ in population)
+        print(f"{timestamp()} Profiles: {profile_report(profiles)}")
+        log.append(generation, population, scores, random_state, parents, matches, profiles)
+        tracing.flush(f"gen-{generation}")  # Generations overlap in the pipeline, so the trace also has the next one's start
+        if best_of_n_interval > 0 and generation % best_of_n_interval == 0 and generation < generations:
+            best_of_n_fight(scores[0][2], 'examplefuncsplayer', n=best_of_n_games, label=f"(gen {generation})")
+
+    if pipelined:
+        from src.pipeline import run_pipelined_generations
+        scores = run_pipelined_generations(population, start_generation, generations, population_size,
+                                           finish_generation)
+        population = [(name, code) for _, code, name in scores]
+        start_generation = generations
+
     for generation in range(start_generation, generations):
+        generation_start = tracing.now()
         # Evaluate fitness of the population
-        scores = fitness(population, generation)
+        scores, matches, profiles = fitness(population, generation)
         # Sort the scores explicitly by the fitness value (first element of the tuple)
         scores.sort(key=lambda x: x[0])  # Sort by rank (ascending)
 
         # Print the best score of the generation
         print(f"Generation {generation}: Best Score: {scores[0][0]}")
 
-        # Save checkpoint at regular intervals
-        if generation % checkpoint_interval == 0:
-            save_checkpoint(population, generation)
+        # Log every generation with its rankings; only new genomes are written
+        with tracing.span("log", generation=generation):
+            log.append(generation, population, scores, parents=parents, matches=matches, profiles=profiles)
 
         # Run best-of-N fight at the configured interval
         if best_of_n_interval > 0 and generation % best_of_n_interval == 0:
@@ -250,7 +440,8 @@ def genetic_programming(resume_from_checkpoint: bool = True, checkpoint_interval
             all_bots = [name for _, _, name in scores if name != current_best]
             if all_bots:
                 random_bot = 'examplefuncsplayer'
-                best_of_n_fight(current_best, random_bot, n=best_of_n_games, label=f"(gen {generation})")
+                with tracing.span("best of N", generation=generation):
+                    best_of_n_fight(current_best, random_bot, n=best_of_n_games, label=f"(gen {generation})")
             else:
                 print(f"{timestamp()} No random bot available for best-of-N match at generation {generation}.")
 
@@ -266,30 +457,34 @@ def genetic_programming(resume_from_checkpoint: bool = True, checkpoint_interval
         )  # Preserve top individuals
 
         # Generate offspring for the remaining slots
-        offspring = []
-        while len(next_generation) + len(offspring) < population_size:
-            if random.random() < 0.5:  # Mutation
-                _, code, _ = random.choice(top_individuals)
-                offspring.append(mutate(code))
-            else:  # Crossover
-                _, code1, _ = random.choice(top_individuals)
-                _, code2, _ = random.choice(top_individuals)
-                offspring.append(crossover(code1, code2))
+        with tracing.span("breed", generation=generation):
+            offspring, offspring_parents = make_screened_offspring(top_individuals,
+                                                                   population_size - len(next_generation))
         offspring_names = get_names(len(offspring))
         for i in range(len(offspring_names)):
             offspring_names[i] = "gen" + str(generation+1) + "." + offspring_names[i]
         for i in range(len(offspring)):
             next_generation.append((offspring_names[i], offspring[i]))
+        parents = {name: (old_name,) for (name, _), (_, _, old_name) in zip(next_generation, top_individuals)}
+        parents.update(zip(offspring_names, offspring_parents))
+        if island is not None:
+            add_immigrants(next_generation, parents, island.exchange(generation, scores), generation + 1,
+                           len(offspring))
 
         population = next_generation
+        tracing.complete("generation", "stage", generation_start, generation=generation)
+        tracing.flush(f"gen-{generation}")
 
-    # Save final checkpoint
-    save_checkpoint(population, generations)
+    if not pipelined:
+        # Log the final generation, and again once it is evaluated
+        log.append(generations, population, parents=parents)
 
-    # Evaluate fitness of the final population
-    scores = fitness(population, generations)
-    # Sort the scores explicitly by the fitness value (first element of the tuple)
-    scores.sort(key=lambda x: x[0])  # Sort by rank (ascending)
+        # Evaluate fitness of the final population
+        scores, matches, profiles = fitness(population, generations)
+        # Sort the scores explicitly by the fitness value (first element of the tuple)
+        scores.sort(key=lambda x: x[0])  # Sort by rank (ascending)
+        log.append(generations, population, scores, parents=parents, matches=matches, profiles=profiles)
+        tracing.flush(f"gen-{generations}")
 
     # Extract the names of the top bots for the double-elimination tournament
     final_bot_names = [name for _, _, name in scores[:int(population_size/2)]]
@@ -297,7 +492,8 @@ def genetic_programming(resume_from_checkpoint: bool = True, checkpoint_interval
 
     # Run the double-elimination tournament and print the top 3 winners
     print(f"{timestamp()} let's do a final double elimination tournament!")
-    final_rankings = run_double_elimination_tournament(final_bot_names)
+    with tracing.span("final tournament"):
+        final_rankings = run_double_elimination_tournament(final_bot_names)
 
     print(f"\n{timestamp()} Final Top 3 Winners:")
     for rank, bot in enumerate(final_rankings[:3], start=1):
@@ -311,3 +507,4 @@ def genetic_programming(resume_from_checkpoint: bool = True, checkpoint_interval
         best_of_n_fight(overall_winner, random_bot, n=best_of_n_games, label="(final)")
     else:
         print(f"{timestamp()} No random bot available for best-of-N match (final).")
+    tracing.flush("final")
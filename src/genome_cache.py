@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, Iterable, List, Optional
+
+from src.compiler import run_javac
+from src.match_server import gradle_path, resolve_runtime_classpath
+from src.mutatable import Mutatable
+from src.template import template
+from src.util import code_to_string, timestamp
+
+# Paths
+cache_path = os.path.join(gradle_path, "build", "genome-cache")
+index_path = os.path.join(cache_path, "index.json")
+
+DEFAULT_MAX_CACHE_BYTES = 2 * 1024 ** 3  # 2 GiB of sources and class files
+
+
+def genome_source(java_code: List[Mutatable], package: str) -> str:
+    """Render the full RobotPlayer.java of a genome with the given package name."""
+    return template.replace("[$CODE]", code_to_string(java_code)).replace("[$PACKAGE]", package)
+
+
+def genome_hash(java_code: List[Mutatable]) -> str:
+    """
+    Content hash of a genome's rendered source, excluding the package line.
+    Bots with identical code share a hash no matter which generation or name they carry.
+    """
+    lines = template.replace("[$CODE]", code_to_string(java_code)).split("\n")
+    canonical = "\n".join(line.rstrip() for line in lines if not line.startswith("package [$PACKAGE];"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def genome_package(hash: str) -> str:
+    """Java package a genome is compiled into. Packages can't start with a digit, hence the prefix."""
+    return "g" + hash[:24]
+
+
+class GenomeCache:
+    """
+    On-disk cache mapping genome hashes to compiled RobotPlayer classes.
+
+    Every entry is a package directory below the cache root, so the root itself is the class location for all
+    cached genomes. Entries survive restarts and are evicted least-recently-used first once the cache grows
+    beyond max_bytes.
+    """
+
+    def __init__(self, path: str = cache_path, max_bytes: int = DEFAULT_MAX_CACHE_BYTES):
+        self.path = path
+        self.index_path = os.path.join(path, "index.json")
+        self.max_bytes = max_bytes
+        self.index: Dict[str, Dict[str, float]] = {}  # package -> {"size": bytes, "last_used": time}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as file:
+                self.index = json.load(file)
+
+    def entry_path(self, package: str) -> str:
+        return os.path.join(self.path, package)
+
+    def is_compiled(self, package: str) -> bool:
+        return package in self.index and os.path.exists(os.path.join(self.entry_path(package), "RobotPlayer.class"))
+
+    def add(self, java_code: List[Mutatable]) -> str:
+        """
+        Make sure the source of a genome is in the cache and mark it as recently used.
+
+        :return: Package name of the genome
+        """
+        package = genome_package(genome_hash(java_code))
+        if self.is_compiled(package):
+            self.index[package]["last_used"] = time.time()
+            return package
+        os.makedirs(self.entry_path(package), exist_ok=True)
+        with open(os.path.join(self.entry_path(package), "RobotPlayer.java"), "w") as file:
+            file.write(genome_source(java_code, package))
+        return package
+
+    def compile(self, packages: Iterable[str]) -> int:
+        """
+        Compile all given packages that aren't compiled yet with a single javac call.
+        All given packages are marked as recently used and protected from the eviction that follows.
+
+        :return: Number of genomes that were compiled
+        """
+        packages = list(packages)  # Iterated twice
+        missing = sorted({package for package in packages if not self.is_compiled(package)})
+        if missing:
+            print(f"{timestamp()} Compiling {len(missing)} new genomes...")
+            run_javac([os.path.join(self.entry_path(package), "RobotPlayer.java") for package in missing],
+                      self.path, resolve_runtime_classpath())
+        now = time.time()
+        compiled = set(missing)
+        for package in packages:
+            if package in compiled:
+                self.index[package] = {"size": self.entry_size(package), "last_used": now}
+            elif package in self.index:
+                self.index[package]["last_used"] = now
+        self.evict(protected=set(packages))
+        self.save()
+        return len(missing)
+
+    def entry_size(self, package: str) -> int:
+        entry = self.entry_path(package)
+        return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+    def evict(self, protected: Optional[set] = None) -> None:
+        """Delete least recently used entries until the cache fits into max_bytes."""
+        protected = protected or set()
+        total = sum(entry["size"] for entry in self.index.values())
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for package in sorted(self.index, key=lambda package: self.index[package]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if package in protected:
+                continue
+            total -= self.index.pop(package)["size"]
+            shutil.rmtree(self.entry_path(package), ignore_errors=True)
+            evicted += 1
+        print(f"{timestamp()} Evicted {evicted} genomes from the cache")
+
+    def save(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.index, file)
+        os.replace(temporary_path, self.index_path)
+
+
+_cache: Optional[GenomeCache] = None
+
+
+def get_genome_cache() -> GenomeCache:
+    """Return the shared genome cache, loading its index on first use."""
+    global _cache
+    if _cache is None:
+        max_bytes = int(os.environ.get("GENOME_CACHE_MAX_BYTES", DEFAULT_MAX_CACHE_BYTES))
+        _cache = GenomeCache(os.environ.get("GENOME_CACHE_DIR", cache_path), max_bytes=max_bytes)
+    return _cache
@@ -0,0 +1,149 @@
+"""
+Island model: several populations evolve in separate processes and exchange their best genomes.
+
+Every island runs the regular generational loop with its own checkpoints (checkpoints/island-<k>), genome cache,
+surrogate model and a share of the concurrent matches. Every `interval` generations an island publishes its top
+`migrants` genomes to checkpoints/migrants and takes in the newest migrants of the islands it is connected to,
+which replace its worst offspring. Islands never wait for each other: a migrant batch that isn't published yet
+is picked up at the next exchange.
+
+Topologies:
+- ring: island k receives from island k-1
+- all: every island receives from every other island
+- random: every exchange, an island receives from one other island chosen at random
+"""
+import multiprocessing
+import os
+import pickle
+import random
+import re
+import sys
+from typing import List, Optional, Tuple
+
+from src import tracing
+from src.mutatable import Mutatable
+from src.util import timestamp
+
+TOPOLOGIES = ["ring", "all", "random"]
+
+# Paths
+default_checkpoint_dir = "checkpoints"
+
+
+class Island:
+    """One island's side of the migration, see the module docstring."""
+
+    def __init__(self, index: int, count: int, topology: str = "ring", interval: int = 5, migrants: int = 2,
+                 checkpoint_dir: str = default_checkpoint_dir):
+        if topology not in TOPOLOGIES:
+            raise ValueError(f"Unknown island topology {topology}, expected one of {', '.join(TOPOLOGIES)}")
+        self.index = index
+        self.count = count
+        self.topology = topology
+        self.interval = interval
+        self.migrants = migrants
+        self.migrants_path = os.path.join(checkpoint_dir, "migrants")
+        self.received = {}  # Source island -> generation of the last batch taken from it
+        self.rng = random.Random(index)  # Doesn't touch the evolution's random state
+        os.makedirs(self.migrants_path, exist_ok=True)
+
+    def sources(self) -> List[int]:
+        """Islands this island receives migrants from in the current exchange."""
+        others = [k for k in range(self.count) if k != self.index]
+        if not others:
+            return []
+        if self.topology == "ring":
+            return [(self.index - 1) % self.count]
+        if self.topology == "random":
+            return [self.rng.choice(others)]
+        return others
+
+    def emigrate(self, generation: int, scores: List[Tuple[int, List[Mutatable], str]]) -> None:
+        """Publish the top genomes of a ranked generation."""
+        batch = [(name, code) for _, code, name in sorted(scores, key=lambda x: x[0])[:self.migrants]]
+        path = os.path.join(self.migrants_path, f"island-{self.index}-gen-{generation}.pkl")
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(batch, file)
+        os.replace(path + ".tmp", path)
+
+    def immigrate(self) -> List[Tuple[str, List[Mutatable]]]:
+        """
+        Take the newest batch of every source island that wasn't taken before.
+
+        :return: Origins (island-<k>:<name>) and genomes of the migrants
+        """
+        published = {}  # Island -> newest generation
+        for name in os.listdir(self.migrants_path):
+            match = re.fullmatch(r"island-(\d+)-gen-(\d+)\.pkl", name)
+            if match:
+                island, generation = int(match.group(1)), int(match.group(2))
+                published[island] = max(published.get(island, -1), generation)
+        immigrants = []
+        for source in self.sources():
+            generation = published.get(source)
+            if generation is None or generation <= self.received.get(source, -1):
+                continue
+            with open(os.path.join(self.migrants_path, f"island-{source}-gen-{generation}.pkl"), "rb") as file:
+                immigrants.extend((f"island-{source}:{name}", code) for name, code in pickle.load(file))
+            self.received[source] = generation
+            print(f"{timestamp()} Island {self.index}: received migrants of generation {generation} "
+                  f"from island {source}")
+        return immigrants
+
+    def exchange(self, generation: int,
+                 scores: List[Tuple[int, List[Mutatable], str]]) -> List[Tuple[str, List[Mutatable]]]:
+        """Publish this generation's top genomes and return the immigrants, if migration is due."""
+        if self.interval <= 0 or generation % self.interval != 0:
+            return []
+        self.emigrate(generation, scores)
+        return self.immigrate()
+
+
+def run_island(index: int, count: int, topology: str, interval: int, migrants: int, seed: Optional[int],
+               resume: bool, checkpoint_interval: int) -> None:
+    """Entry point of an island process. Output goes to checkpoints/island-<k>/output.log."""
+    from src.genetic_algorithm import genetic_programming
+    checkpoint_dir = os.path.join(default_checkpoint_dir, f"island-{index}")
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    sys.stdout = sys.stderr = open(os.path.join(checkpoint_dir, "output.log"), "a", buffering=1)
+    # Islands don't share the genome cache index, so every island compiles into its own cache
+    from src.genome_cache import cache_path
+    os.environ["GENOME_CACHE_DIR"] = os.path.join(cache_path, f"island-{index}")
+    if tracing.trace_directory() is not None:
+        tracing.configure_tracing(os.path.join(tracing.trace_directory(), f"island-{index}"))
+    random.seed(seed + index if seed is not None else None)
+    island = Island(index, count, topology, interval, migrants)
+    print(f"{timestamp()} Island {index} of {count} starting ({topology} topology, {migrants} migrants "
+          f"every {interval} generations)")
+    try:
+        genetic_programming(resume_from_checkpoint=resume, checkpoint_interval=checkpoint_interval,
+                            checkpoint_dir=checkpoint_dir, island=island)
+    finally:
+        from src.scheduler import shutdown_scheduler
+        from src.match_server import shutdown_pool
+        shutdown_scheduler()
+        shutdown_pool(stop_queue=False)  # Other islands may still use the remote workers
+
+
+def run_islands(count: int, topology: str = "ring", interval: int = 5, migrants: int = 2,
+                seed: Optional[int] = None, resume: bool = True, checkpoint_interval: int = 5) -> None:
+    """
+    Run `count` islands in separate processes and wait for all of them.
+    The processes are forked, so they inherit the configuration of the scheduler, pool, ratings etc.; configure
+    the pool and scheduler with each island's share of the concurrent matches before calling this.
+    """
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=run_island, name=f"island-{index}",
+                                 args=(index, count, topology, interval, migrants, seed, resume, checkpoint_interval))
+                 for index in range(count)]
+    for process in processes:
+        process.start()
+    print(f"{timestamp()} Started {count} islands, logging to {default_checkpoint_dir}/island-*/output.log")
+    failed = []
+    for index, process in enumerate(processes):
+        process.join()
+        if process.exitcode != 0:
+            failed.append(index)
+        print(f"{timestamp()} Island {index} finished with exit code {process.exitcode}")
+    if failed:
+        raise RuntimeError(f"Islands {failed} failed, see their output.log")
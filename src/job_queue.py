@@ -0,0 +1,329 @@
+"""
+Distributed match evaluation through a job queue on a shared filesystem.
+
+The coordinator (the genetic programming driver) publishes every batch of matches as a job; worker processes on
+any node that sees the filesystem claim jobs, play them and report the results. Bots don't need to be shipped:
+they are compiled into the genome cache in the scaffold before their matches are published, and jobs refer to
+them by absolute class location.
+
+Queue layout:
+- jobs/<job>.json: pending jobs
+- leases/<job>--<worker>.json: claimed jobs. The worker touches its lease every few seconds; a lease the
+  coordinator hasn't seen touched for the lease timeout is moved back to jobs/, so the job is played by another
+  worker. The coordinator times leases by its own clock, from when it last saw their mtime change, so clocks of
+  different nodes are never compared.
+- leases/<job>--<worker>.done: jobs whose worker is writing their results. A worker first renames its lease to
+  this, and writes the results only if that rename succeeded, so a lease can't be re-queued and completed at once.
+- results/<job>.json: results of finished jobs, removed by the coordinator once read
+- stop: tells the workers to exit
+
+Every file is written to a temporary name first and then renamed. Claiming a job is a rename too, so two workers
+can't claim the same job.
+
+Start workers from the src directory with:
+    python3 -m src.job_queue QUEUE_DIR [--slots N] [--fake-engine]
+"""
+import argparse
+import glob
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from src.match_result import MatchResult
+from src.match_server import MATCH_TIMEOUT, MAX_MATCHES_PER_WORKER, engine_kind, jvm_worker_factory
+from src.scheduler import DEFAULT_JVM_HEAP_MB, default_concurrency
+from src.util import timestamp
+
+DEFAULT_LEASE_TIMEOUT = 60  # Seconds without a heartbeat after which a worker is considered lost
+POLL_INTERVAL = 0.5  # Seconds between checks for new jobs or results
+
+
+class JobQueue:
+    """A queue of match batches in a directory on a shared filesystem, see the module docstring."""
+
+    def __init__(self, path: str, lease_timeout: float = DEFAULT_LEASE_TIMEOUT):
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.jobs_path = os.path.join(path, "jobs")
+        self.leases_path = os.path.join(path, "leases")
+        self.results_path = os.path.join(path, "results")
+        self.stop_path = os.path.join(path, "stop")
+        for directory in (self.jobs_path, self.leases_path, self.results_path):
+            os.makedirs(directory, exist_ok=True)
+
+    def _write(self, path: str, data: Dict) -> None:
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(data, file)
+        os.replace(temporary_path, path)
+
+    def submit(self, requests: List[Tuple[str, Dict[str, str]]]) -> str:
+        """Publish a batch of (match ID, engine properties) and return its job ID."""
+        job_id = uuid.uuid4().hex
+        self._write(os.path.join(self.jobs_path, job_id + ".json"), {"id": job_id, "requests": requests})
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Tuple[str, List[Tuple[str, Dict[str, str]]], str]]:
+        """
+        Claim the oldest pending job.
+
+        :return: Job ID, requests and lease path, or None if no job is pending
+        """
+        pending = []
+        for name in os.listdir(self.jobs_path):
+            if name.endswith(".json"):
+                try:
+                    pending.append((os.path.getmtime(os.path.join(self.jobs_path, name)), name))
+                except FileNotFoundError:
+                    continue  # Claimed by another worker in the meantime
+        for _, name in sorted(pending):
+            job_id = name[:-len(".json")]
+            job_path = os.path.join(self.jobs_path, name)
+            lease_path = os.path.join(self.leases_path, f"{job_id}--{worker}.json")
+            try:
+                os.rename(job_path, lease_path)
+                with open(lease_path) as file:
+                    return job_id, [tuple(request) for request in json.load(file)["requests"]], lease_path
+            except FileNotFoundError:
+                continue  # Claimed by another worker, or the lease was lost already
+        return None
+
+    def heartbeat(self, lease_path: str) -> bool:
+        """Renew a lease. Returns False if the lease was lost, i.e. the job was re-queued."""
+        try:
+            os.utime(lease_path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, job_id: str, lease_path: str, worker: str, results: List[Optional[MatchResult]],
+                 engine: str = "battlecode") -> bool:
+        """
+        Report the results of a claimed job, played on the given engine (see match_server.engine_kind).
+        Returns False if the lease was lost and the results discarded.
+        """
+        done_path = os.path.splitext(lease_path)[0] + ".done"
+        try:
+            os.rename(lease_path, done_path)  # Fails if the coordinator re-queued the job in the meantime
+        except FileNotFoundError:
+            return False
+        self._write(os.path.join(self.results_path, job_id + ".json"), {
+            "worker": worker,
+            "engine": engine,
+            "results": [result.to_json() if result is not None else None for result in results],
+        })
+        try:
+            os.remove(done_path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def result(self, job_id: str) -> Optional[Tuple[str, str, List[Optional[MatchResult]]]]:
+        """
+        Take the results of a finished job: the worker that played it, the engine it played on and the results, or
+        None if it isn't done.
+        """
+        path = os.path.join(self.results_path, job_id + ".json")
+        try:
+            with open(path) as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        os.remove(path)
+        return data["worker"], data.get("engine", "battlecode"), [MatchResult.from_json(result) if result is not None else None
+                                for result in data["results"]]
+
+    def lease(self, job_id: str) -> Optional[Tuple[str, str, float]]:
+        """
+        Path, worker and mtime of the lease on a job, or None if it isn't claimed. The mtime is set by the worker's
+        clock, so it only tells whether the lease was touched since it was last looked at.
+        A job whose results are being written has a .done lease, which expires like any other if its worker dies
+        before the results are in.
+        """
+        for path in glob.glob(os.path.join(self.leases_path, job_id + "--*")):
+            name, extension = os.path.splitext(os.path.basename(path))
+            if extension not in (".json", ".done"):
+                continue
+            try:
+                return path, name[len(job_id) + 2:], os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+        return None
+
+    def requeue(self, lease_path: str, job_id: str) -> bool:
+        """Move a claimed job back to the pending jobs. Returns False if it finished in the meantime."""
+        try:
+            os.rename(lease_path, os.path.join(self.jobs_path, job_id + ".json"))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def cancel(self, job_id: str) -> None:
+        """Withdraw a job, whether it is pending or claimed."""
+        lease = self.lease(job_id)
+        for path in [os.path.join(self.jobs_path, job_id + ".json")] + ([lease[0]] if lease else []):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stop(self) -> None:
+        """Tell all workers to exit."""
+        open(self.stop_path, "w").close()
+
+    def stopped(self) -> bool:
+        return os.path.exists(self.stop_path)
+
+    def reset(self) -> None:
+        """Allow workers to run again after stop()."""
+        if self.stopped():
+            os.remove(self.stop_path)
+
+
+class QueueMatchWorker:
+    """
+    Stand-in for JvmMatchWorker that hands its batches to remote workers through a job queue.
+    A pool of these limits the number of jobs in flight, like a pool of JVMs limits the local matches.
+    """
+
+    def __init__(self, job_queue: JobQueue):
+        self.queue = job_queue
+        self.matches_played = 0
+
+    def alive(self) -> bool:
+        return True
+
+    def run_batch(self, requests: List[Tuple[str, Dict[str, str]]]) -> List[Optional[MatchResult]]:
+        """
+        Publish a batch and wait for its results.
+        A job whose worker stops renewing its lease is re-queued. Raises RuntimeError if the job isn't finished
+        MATCH_TIMEOUT seconds per match after a worker claimed it, or if it was played on another engine than the
+        driver's (e.g. by a worker started with --fake-engine), so its results can't end up in the wrong stores.
+        """
+        job_id = self.queue.submit(requests)
+        claimed_at: Optional[float] = None
+        heartbeat: Optional[Tuple[str, float]] = None  # Lease path and mtime last seen
+        heartbeat_seen_at = 0.0  # Local time the lease was last seen touched
+        while True:
+            result = self.queue.result(job_id)
+            if result is not None:
+                worker, engine, results = result
+                if engine != engine_kind():
+                    raise RuntimeError(f"Job {job_id} was played on the {engine} engine by worker {worker}, but the "
+                                       f"driver plays on the {engine_kind()} engine")
+                self.matches_played += len(requests)
+                return results
+            lease = self.queue.lease(job_id)
+            if lease is not None:
+                lease_path, worker, mtime = lease
+                now = time.time()
+                claimed_at = claimed_at or now
+                if heartbeat != (lease_path, mtime):
+                    heartbeat, heartbeat_seen_at = (lease_path, mtime), now
+                if now - heartbeat_seen_at > self.queue.lease_timeout and self.queue.requeue(lease_path, job_id):
+                    print(f"{timestamp()} Worker {worker} lost, re-queued job {job_id}")
+                    claimed_at = heartbeat = None
+                elif now - claimed_at > MATCH_TIMEOUT * len(requests):
+                    self.queue.cancel(job_id)
+                    raise RuntimeError(f"Job {job_id} timed out on worker {worker}")
+            time.sleep(POLL_INTERVAL)
+
+    def close(self) -> None:
+        pass
+
+
+def run_worker(queue_path: str, slots: int, fake_engine: bool = False, heap_mb: int = DEFAULT_JVM_HEAP_MB,
+               idle_exit: Optional[float] = None, lease_timeout: float = DEFAULT_LEASE_TIMEOUT) -> None:
+    """
+    Play jobs from a queue until it is stopped, or until no job came for idle_exit seconds.
+    Every slot is a thread with its own match worker, so a node plays up to `slots` jobs at a time.
+    Leases are renewed four times per lease_timeout, which must match the coordinator's.
+    """
+    job_queue = JobQueue(queue_path, lease_timeout)
+    name = f"{socket.gethostname()}-{os.getpid()}"
+    if fake_engine:
+        from src.fake_engine import FakeMatchWorker
+        factory = FakeMatchWorker
+    else:
+        factory = jvm_worker_factory(heap_mb)
+    leases = set()
+    leases_lock = threading.Lock()
+    done = threading.Event()
+
+    def renew_leases() -> None:
+        while not done.wait(job_queue.lease_timeout / 4):
+            with leases_lock:
+                current = list(leases)
+            for lease_path in current:
+                job_queue.heartbeat(lease_path)
+
+    def play(slot: int) -> None:
+        worker_name = f"{name}-{slot}"
+        worker = None
+        idle_since = time.time()
+        while not job_queue.stopped():
+            claimed = job_queue.claim(worker_name)
+            if claimed is None:
+                if idle_exit is not None and time.time() - idle_since > idle_exit:
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+            job_id, requests, lease_path = claimed
+            with leases_lock:
+                leases.add(lease_path)
+            try:
+                if worker is None or not worker.alive() or worker.matches_played >= MAX_MATCHES_PER_WORKER:
+                    if worker is not None:
+                        worker.close()
+                    worker = factory()
+                results = worker.run_batch(requests)
+            except Exception as e:
+                print(f"{timestamp()} Error during job {job_id}: {e}")
+                if worker is not None:
+                    worker.close()
+                worker = None
+                results = [None] * len(requests)
+            finally:
+                with leases_lock:
+                    leases.discard(lease_path)
+            if job_queue.complete(job_id, lease_path, worker_name, results, "fake" if fake_engine else "battlecode"):
+                print(f"{timestamp()} Finished job {job_id} ({len(requests)} matches)")
+            else:
+                print(f"{timestamp()} Lost the lease on job {job_id}, discarded its results")
+            idle_since = time.time()
+        if worker is not None:
+            worker.close()
+
+    print(f"{timestamp()} Worker {name} serving {queue_path} with {slots} slots")
+    threading.Thread(target=renew_leases, daemon=True).start()
+    threads = [threading.Thread(target=play, args=(slot,)) for slot in range(slots)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    print(f"{timestamp()} Worker {name} exiting")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play matches from a job queue on a shared filesystem')
+    parser.add_argument('queue', help='Queue directory, as passed to the driver with --queue-dir')
+    parser.add_argument('--slots', type=int, default=None,
+                        help='Jobs played at a time (default: derived from SLURM_CPUS_PER_TASK and memory)')
+    parser.add_argument('--jvm-heap-mb', type=int, default=DEFAULT_JVM_HEAP_MB,
+                        help=f'Heap budget per match JVM in MB (default: {DEFAULT_JVM_HEAP_MB})')
+    parser.add_argument('--fake-engine', action='store_true',
+                        help='Play matches with the local fake engine instead of Battlecode (for testing)')
+    parser.add_argument('--idle-exit', type=float, default=None,
+                        help='Exit after this many seconds without a job (default: run until the queue is stopped)')
+    args = parser.parse_args()
+    run_worker(args.queue, args.slots or default_concurrency(args.jvm_heap_mb), args.fake_engine, args.jvm_heap_mb,
+               args.idle_exit)
+
+
+if __name__ == '__main__':
+    main()
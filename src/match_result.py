@@ -0,0 +1,65 @@
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+RESULT_MARKER = "@@RESULT"
+
+
+@dataclass
+class GameResult:
+    """Result of one game of a match that may span several maps."""
+    winner: Optional[str]  # "A" or "B"
+    winner_name: Optional[str] = None
+    reason: Optional[str] = None
+    rounds: int = 0
+
+    @staticmethod
+    def from_dict(record: Dict) -> "GameResult":
+        return GameResult(record.get("winner"), record.get("winnerName"), record.get("reason"), record.get("rounds", 0))
+
+
+@dataclass
+class MatchResult:
+    """Compact record of a finished match, as reported by the match worker."""
+    winner: Optional[str]  # "A", "B", or None if the match produced no winner
+    winner_name: Optional[str] = None
+    reason: Optional[str] = None
+    rounds: int = 0
+    error: Optional[str] = None
+    teams: Dict[str, Dict[str, int]] = field(default_factory=dict)  # per-team stats, e.g. robot exceptions
+    games: List[GameResult] = field(default_factory=list)  # one per map; the fields above describe the first
+
+    @staticmethod
+    def from_json(data: str) -> "MatchResult":
+        record = json.loads(data)
+        return MatchResult(
+            winner=record.get("winner"),
+            winner_name=record.get("winnerName"),
+            reason=record.get("reason"),
+            rounds=record.get("rounds", 0),
+            error=record.get("error"),
+            teams=record.get("teams", {}),
+            games=[GameResult.from_dict(game) for game in record.get("games", [])],
+        )
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "winner": self.winner,
+            "winnerName": self.winner_name,
+            "reason": self.reason,
+            "rounds": self.rounds,
+            "error": self.error,
+            "teams": self.teams,
+            "games": [{"winner": game.winner, "winnerName": game.winner_name, "reason": game.reason,
+                       "rounds": game.rounds} for game in self.games],
+        })
+
+
+def parse_result_line(line: str) -> Tuple[str, MatchResult]:
+    """
+    Parse a '@@RESULT <match id> <json>' line of the match worker protocol.
+
+    :return: Match ID and result
+    """
+    _, match_id, data = line.rstrip("\n").split(" ", 2)
+    return match_id, MatchResult.from_json(data)
@@ -0,0 +1,380 @@
+import itertools
+import os
+import platform
+import queue
+import subprocess
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src import tracing
+from src.match_result import RESULT_MARKER, MatchResult, parse_result_line
+from src.scheduler import DEFAULT_JVM_HEAP_MB, completed, default_concurrency
+from src.util import timestamp
+
+# Paths
+gradle_path = os.path.abspath("../battlecode24-scaffold/")
+gradle_properties_path = os.path.join(gradle_path, "gradle.properties")
+worker_source_path = os.path.join(gradle_path, "worker", "MatchWorker.java")
+worker_classes_path = os.path.join(gradle_path, "build", "worker")
+runtime_classpath_path = os.path.join(gradle_path, "build", "runtime-classpath.txt")
+default_class_location = os.path.join(gradle_path, "build", "classes")
+
+MATCH_TIMEOUT = 3600  # Seconds, same limit as the gradle runner
+MAX_MATCHES_PER_WORKER = 200  # Recycle worker JVMs so loaded bot classes don't pile up
+
+
+def java_executable(name: str = "java") -> str:
+    """Return the path to a JDK tool, preferring JAVA_HOME over the PATH."""
+    if platform.system() == "Windows":
+        name += ".exe"
+    java_home = os.environ.get("JAVA_HOME")
+    if java_home:
+        return os.path.join(java_home, "bin", name)
+    return name
+
+
+def read_gradle_properties() -> Dict[str, str]:
+    """Read the scaffold's gradle.properties so pooled matches use the same settings as gradle runs."""
+    properties = {}
+    if not os.path.exists(gradle_properties_path):
+        return properties
+    with open(gradle_properties_path) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            properties[key.strip()] = value.strip()
+    return properties
+
+
+def match_properties(team_a: str, team_b: str, overrides: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Build the engine system properties for one match.
+    Mirrors the jvmArgs of the runWithoutBuild task in build.gradle.
+
+    :param team_a: Name of the bot playing as team A
+    :param team_b: Name of the bot playing as team B
+    :param overrides: Gradle-style project properties (e.g. maps, classLocationA) overriding gradle.properties
+    :return: Mapping from -D property name to value
+    """
+    project = read_gradle_properties()
+    project.update(overrides or {})
+    maps = project.get("maps", "DefaultSmall")
+    replay = project.get("replay", f"matches/{team_a}-vs-{team_b}-on-{maps}.bc24")
+    properties = {
+        "bc.server.wait-for-client": project.get("waitForClient", "false"),
+        "bc.server.mode": "headless",
+        "bc.server.map-path": "maps",
+        "bc.server.robot-player-to-system-out": project.get("outputVerbose", "true"),
+        "bc.server.debug": "false",
+        "bc.engine.debug-methods": project.get("debug", "false"),
+        "bc.engine.show-indicators": project.get("showIndicators", "true"),
+        "bc.game.team-a": team_a,
+        "bc.game.team-b": team_b,
+        "bc.game.team-a.url": project.get("classLocationA", default_class_location),
+        "bc.game.team-b.url": project.get("classLocationB", default_class_location),
+        "bc.game.team-a.package": project.get("packageNameA", team_a),
+        "bc.game.team-b.package": project.get("packageNameB", team_b),
+        "bc.game.maps": maps,
+        "bc.server.validate-maps": project.get("validateMaps", "true"),
+        "bc.server.alternate-order": project.get("alternateOrder", "false"),
+        "bc.server.save-file": replay,
+        # Replicate index of a pairing. The engine ignores it; it keeps repeated games apart in the result store
+        # and seeds the fake engine.
+        "matchworker.seed": project.get("seed", "0"),
+    }
+    if "roundCap" in project:
+        # Games are adjudicated at this round, see adjudication.py. Only the asyncio engine can truncate games.
+        properties["matchworker.round-cap"] = project["roundCap"]
+    return properties
+
+
+def resolve_runtime_classpath() -> str:
+    """
+    Return the engine runtime classpath, asking gradle to resolve it only if it isn't cached yet.
+    """
+    if not os.path.exists(runtime_classpath_path):
+        from src.battlecode_runner import execute_gradle_task
+        execute_gradle_task("writeRuntimeClasspath")
+        if not os.path.exists(runtime_classpath_path):
+            raise RuntimeError("Could not resolve the Battlecode runtime classpath")
+    with open(runtime_classpath_path) as file:
+        return file.read().strip()
+
+
+def compile_match_worker(classpath: str) -> None:
+    """Compile MatchWorker.java against the engine classpath if the class file is missing or stale."""
+    class_file = os.path.join(worker_classes_path, "MatchWorker.class")
+    if os.path.exists(class_file) and os.path.getmtime(class_file) >= os.path.getmtime(worker_source_path):
+        return
+    os.makedirs(worker_classes_path, exist_ok=True)
+    print(f"{timestamp()} Compiling match worker...")
+    result = subprocess.run(
+        [java_executable("javac"), "-cp", classpath, "-d", worker_classes_path, worker_source_path],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError("Could not compile the match worker", result.stderr)
+
+
+class JvmMatchWorker:
+    """
+    A long-lived JVM running battlecode.server.Main for one match at a time, or a batch of matches back to back.
+    Requests and results are exchanged over the process' stdin/stdout (see MatchWorker.java).
+    """
+
+    def __init__(self, classpath: str, heap_mb: int = DEFAULT_JVM_HEAP_MB):
+        self.process = subprocess.Popen(
+            [java_executable("java"), f"-Xmx{heap_mb}m", "-cp", classpath + os.pathsep + worker_classes_path,
+             "MatchWorker"],
+            cwd=gradle_path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+        )
+        self.matches_played = 0
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run_match(self, match_id: str, properties: Dict[str, str]) -> MatchResult:
+        """
+        Play one match and return its result.
+        Raises RuntimeError if the worker dies or times out.
+        """
+        return self.run_batch([(match_id, properties)])[0]
+
+    def run_batch(self, requests: List[Tuple[str, Dict[str, str]]]) -> List[MatchResult]:
+        """
+        Play several matches back to back in this JVM and return their results in order.
+        All requests are written at once, so the worker goes straight from one match to the next.
+        Raises RuntimeError if the worker dies or times out.
+        """
+        lines = ["\t".join([match_id] + [f"{key}={value}" for key, value in properties.items()])
+                 for match_id, properties in requests]
+        timer = threading.Timer(MATCH_TIMEOUT * len(requests), self.process.kill)
+        timer.start()
+        try:
+            self.process.stdin.write("".join(line + "\n" for line in lines))
+            self.process.stdin.flush()
+            results = []
+            start = tracing.now()
+            for line in self.process.stdout:
+                if not line.startswith(RESULT_MARKER):
+                    continue
+                match_id = requests[len(results)][0]
+                finished_id, result = parse_result_line(line)
+                if finished_id != match_id:
+                    raise RuntimeError(f"Match worker answered match {finished_id} instead of {match_id}")
+                properties = requests[len(results)][1]
+                tracing.complete("match", "engine", start, bot1=properties.get("bc.game.team-a"),
+                                 bot2=properties.get("bc.game.team-b"), maps=properties.get("bc.game.maps"),
+                                 rounds=result.rounds, first_in_jvm=self.matches_played == 0)
+                start = tracing.now()
+                self.matches_played += 1
+                results.append(result)
+                if len(results) == len(requests):
+                    return results
+            raise RuntimeError(f"Match worker exited during match {requests[len(results)][0]}")
+        finally:
+            timer.cancel()
+
+    def close(self) -> None:
+        if self.alive():
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class MatchServerPool:
+    """
+    A fixed-size pool of match workers.
+    run_match blocks until a worker is free, so it can be called from any number of threads.
+    submit_batch returns a future instead, which asynchronous workers complete without holding the calling thread.
+    """
+
+    def __init__(self, size: int, worker_factory: Callable[[], object], robot_output_dir: Optional[str] = None):
+        self.size = size
+        self.worker_factory = worker_factory
+        self.robot_output_dir = robot_output_dir
+        self.idle_workers: "queue.Queue" = queue.Queue()
+        self.match_ids = itertools.count()
+        for _ in range(size):
+            self.idle_workers.put(None)  # Workers are started lazily on first use
+
+    def run_match(self, team_a: str, team_b: str,
+                  overrides: Optional[Dict[str, str]] = None) -> Optional[MatchResult]:
+        """
+        Run a match between team A and team B on the next free worker.
+
+        :return: Result of the match, or None if the worker failed
+        """
+        return self.run_batch([(team_a, team_b, overrides)])[0]
+
+    def run_batch(self, matches: List[Tuple[str, str, Optional[Dict[str, str]]]]) -> List[Optional[MatchResult]]:
+        """
+        Run several matches back to back on the next free worker, so its JVM start-up and JIT warm-up are
+        shared by all of them.
+
+        :param matches: (team A, team B, overrides) of every match
+        :return: Results of the matches in order; all None if the worker failed
+        """
+        return self.submit_batch(matches).result()
+
+    def submit_batch(self, matches: List[Tuple[str, str, Optional[Dict[str, str]]]]) -> Future:
+        """
+        Start a batch like run_batch and return a future for its results.
+        Workers that play batches asynchronously (see AsyncMatchWorker.submit_batch) go back to the pool as soon as
+        the batch is started, so the calling thread doesn't wait for the matches. Other workers play the batch in
+        the calling thread, and the future is done when this returns.
+        """
+        requests = []
+        for team_a, team_b, overrides in matches:
+            match_id = str(next(self.match_ids))
+            properties = match_properties(team_a, team_b, overrides)
+            if self.robot_output_dir:
+                os.makedirs(self.robot_output_dir, exist_ok=True)
+                properties["matchworker.robot-output"] = os.path.join(
+                    self.robot_output_dir, f"{team_a}-vs-{team_b}-{match_id}.log")
+            requests.append((match_id, properties))
+        with tracing.span("wait for worker", "pool"):
+            worker = self.idle_workers.get()
+        try:
+            if worker is None or not worker.alive() or worker.matches_played >= MAX_MATCHES_PER_WORKER:
+                if worker is not None:
+                    worker.close()
+                with tracing.span("start worker", "pool"):
+                    worker = self.worker_factory()
+            if hasattr(worker, "submit_batch"):
+                return worker.submit_batch(requests)
+            with tracing.span("batch", "pool", matches=len(matches)):
+                return completed(worker.run_batch(requests))
+        except Exception as e:
+            teams = ", ".join(f"{team_a} vs {team_b}" for team_a, team_b, _ in matches)
+            print(f"{timestamp()} Error during match {teams}: {e}")
+            if worker is not None:
+                worker.close()
+            worker = None
+            return completed([None] * len(matches))
+        finally:
+            self.idle_workers.put(worker)
+
+    def close(self) -> None:
+        for _ in range(self.size):
+            worker = self.idle_workers.get()
+            if worker is not None:
+                worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def jvm_worker_factory(heap_mb: int = DEFAULT_JVM_HEAP_MB) -> Callable[[], JvmMatchWorker]:
+    """Resolve the classpath and compile the worker once, then start JVM workers on demand."""
+    classpath = resolve_runtime_classpath()
+    compile_match_worker(classpath)
+    return lambda: JvmMatchWorker(classpath, heap_mb)
+
+
+_pool: Optional[MatchServerPool] = None
+_pool_lock = threading.Lock()
+_pool_size: Optional[int] = None
+_use_fake_engine = False
+_robot_output_dir: Optional[str] = None
+_heap_mb = DEFAULT_JVM_HEAP_MB
+_queue_dir: Optional[str] = None
+_async_engine = False
+_stall_timeout: Optional[float] = None
+
+
+def configure_pool(size: Optional[int] = None, fake_engine: bool = False,
+                   robot_output_dir: Optional[str] = None, heap_mb: int = DEFAULT_JVM_HEAP_MB,
+                   queue_dir: Optional[str] = None, async_engine: bool = False,
+                   stall_timeout: Optional[float] = None) -> None:
+    """
+    Configure the shared match-server pool. Takes effect the next time get_pool() creates the pool.
+
+    :param size: Number of worker JVMs (default: as many as the CPU and memory budget allows)
+    :param fake_engine: Use the local fake engine instead of Battlecode, e.g. for tests
+    :param robot_output_dir: Directory for one robot output log per match (default: robot output is discarded)
+    :param heap_mb: Maximum heap of every worker JVM in MB
+    :param queue_dir: Play matches on remote workers through a job queue in this directory (see job_queue.py);
+        size is then the number of jobs in flight
+    :param async_engine: Play every match in a JVM of its own on the asyncio engine (see async_engine.py) instead
+        of persistent worker JVMs; size is then the number of JVMs running at once
+    :param stall_timeout: Seconds without a new round before the asyncio engine kills a match
+    """
+    global _pool_size, _use_fake_engine, _robot_output_dir, _heap_mb, _queue_dir, _async_engine, _stall_timeout
+    shutdown_pool(stop_queue=False)
+    _pool_size = size
+    _use_fake_engine = fake_engine
+    _robot_output_dir = robot_output_dir
+    _heap_mb = heap_mb
+    _queue_dir = queue_dir
+    _async_engine = async_engine
+    _stall_timeout = stall_timeout
+
+
+def engine_kind() -> str:
+    """Engine the configured pool plays on: "fake" for the fake engine, "battlecode" otherwise."""
+    return "fake" if _use_fake_engine else "battlecode"
+
+
+def get_async_engine():
+    """
+    Return the shared asyncio engine (see async_engine.py) with the pool's settings: --pool-size JVMs at once, their
+    heap and the stall timeout. The pool plays on it if configured with async_engine, and it plays truncated games
+    outside the pool (see battlecode_runner.run_battlecode).
+    """
+    from src.async_engine import DEFAULT_STALL_TIMEOUT, get_engine
+    return get_engine(_pool_size or default_concurrency(_heap_mb), _heap_mb, _stall_timeout or DEFAULT_STALL_TIMEOUT)
+
+
+def get_pool() -> MatchServerPool:
+    """Return the shared match-server pool, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            size = _pool_size or default_concurrency(_heap_mb)
+            if _queue_dir is not None:
+                from src.job_queue import JobQueue, QueueMatchWorker
+                job_queue = JobQueue(_queue_dir)
+                job_queue.reset()
+                factory = lambda: QueueMatchWorker(job_queue)
+                print(f"{timestamp()} Publishing matches to job queue {_queue_dir}")
+            elif _async_engine:
+                from src.async_engine import AsyncMatchWorker
+                engine = get_async_engine()
+                factory = lambda: AsyncMatchWorker(engine)
+            elif _use_fake_engine:
+                from src.fake_engine import FakeMatchWorker
+                factory = FakeMatchWorker
+            else:
+                factory = jvm_worker_factory(_heap_mb)
+            print(f"{timestamp()} Starting match-server pool with {size} workers")
+            _pool = MatchServerPool(size, factory, _robot_output_dir)
+        return _pool
+
+
+def shutdown_pool(stop_queue: bool = True) -> None:
+    """Stop all workers of the shared pool, and the remote workers of the job queue unless stop_queue is False."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        from src.async_engine import shutdown_engine
+        shutdown_engine()  # Started by the pool or by run_battlecode, see get_async_engine
+        if _queue_dir is not None and stop_queue:
+            from src.job_queue import JobQueue
+            JobQueue(_queue_dir).stop()
@@ -1,55 +1,194 @@
+import hashlib
 import random
 import re
-from typing import Dict
+from array import array
+from functools import lru_cache
+from typing import Dict, List, Tuple
 
 from src.mutatable_strings import *
 
+PLACEHOLDER_PATTERN = re.compile(r'\[\$(\w+)\]')
+
+
+@lru_cache(maxsize=None)
+def compile_template(value: str) -> Tuple[str, ...]:
+    """
+    Split a template into its segments, alternating literal text and placeholder names:
+    "if ([$BOOL1]) [$ACTION1]" becomes ("if (", "BOOL1", ") ", "ACTION1", "").
+    Templates come from the fixed lists in mutatable_strings, so every one is parsed only once.
+    """
+    return tuple(PLACEHOLDER_PATTERN.split(value))
+
+
+def placeholder_options(key: str) -> Tuple[str, list]:
+    """Return the type and the options of a placeholder like INT1, using the 'mapping' list."""
+    for placeholder, mutatable_type, options in mapping:
+        if key.startswith(placeholder):
+            return mutatable_type, options
+    raise RuntimeError(f"Unknown placeholder type: {key}")
+
+
+def _intern_tables() -> Tuple[List[str], Dict[str, int], List, Dict, List[Tuple[str, ...]], List[Tuple]]:
+    """
+    Give every type and template value of the 'mapping' list a small integer ID.
+    For every template, also collect its segments and, per distinct placeholder in order of first appearance,
+    the IDs of the templates that can fill it. Those lists are as long as the options in mapping, so rng.choice
+    draws the same from them as from the options.
+    """
+    types, type_ids, values, value_ids = [], {}, [], {}
+    for _, mutatable_type, options in mapping:
+        if mutatable_type not in type_ids:
+            type_ids[mutatable_type] = len(types)
+            types.append(mutatable_type)
+        for value in options:
+            if value not in value_ids:
+                value_ids[value] = len(values)
+                values.append(value)
+    segments, children = [], []
+    for value in values:
+        segments.append(compile_template(str(value)))
+        keys = dict.fromkeys(segments[-1][1::2])
+        children.append(tuple([value_ids[option] for option in placeholder_options(key)[1]] for key in keys))
+    return types, type_ids, values, value_ids, segments, children
+
+
+type_names, type_ids, template_values, template_ids, template_segments, template_children = _intern_tables()
+TYPECODE = "B" if max(len(template_values), len(type_names)) <= 0xFF else "H"
+# Identifies the tables, so checkpoints written with different mutatable_strings are detected
+TABLE_FINGERPRINT = hashlib.sha256(repr((type_names, template_values)).encode()).hexdigest()[:16]
+
+
+def _build(template_id: int, nodes: array, rng) -> None:
+    """Append a template and random fillings of its placeholders, depth first."""
+    nodes.append(template_id)
+    for options in template_children[template_id]:
+        _build(rng.choice(options), nodes, rng)
+
+
+def _skip(nodes: array, position: int) -> int:
+    """Return the position after the subtree starting at position."""
+    end = position + 1
+    for _ in template_children[nodes[position]]:
+        end = _skip(nodes, end)
+    return end
+
+
+def _mutate(nodes: array, position: int, result: array, rng) -> int:
+    """Append a mutated copy of the subtree at position to result and return the position after it."""
+    template_id = nodes[position]
+    result.append(template_id)
+    position += 1
+    for options in template_children[template_id]:
+        if rng.random() < 0.2:  # 20% chance to replace the sub-mutable
+            _build(rng.choice(options), result, rng)
+            position = _skip(nodes, position)
+        else:
+            position = _mutate(nodes, position, result, rng)  # Recursively mutate existing sub-mutatables
+    return position
+
+
+def _render(nodes: array, position: int) -> Tuple[str, int]:
+    """Render the subtree at position and return its code and the position after it."""
+    template = template_segments[nodes[position]]
+    keys = template_children[nodes[position]]
+    position += 1
+    if not keys:
+        return template[0], position
+    rendered = {}
+    parts = list(template)
+    for i in range(1, len(template), 2):
+        if template[i] not in rendered:
+            rendered[template[i]], position = _render(nodes, position)
+        parts[i] = rendered[template[i]]
+    return "".join(parts), position
+
+
+def _from_nodes(nodes: array) -> "Mutatable":
+    mutatable = Mutatable.__new__(Mutatable)
+    mutatable.nodes = nodes
+    mutatable._text = None
+    return mutatable
+
+
+def _restore(nodes: bytes) -> "Mutatable":
+    """Unpickle a Mutatable from its node IDs."""
+    mutatable = _from_nodes(array(TYPECODE))
+    mutatable.nodes.frombytes(nodes)
+    return mutatable
+
 
 class Mutatable:
-    def __init__(self, type: str, value: str):
-        self.type = type
-        self.value = value
-        self.sub_mutatables: Dict[str, Mutatable] = {}
-        self.detect_required_sub_mutatables()
+    """
+    One line of a genome: a template from mutatable_strings with its placeholders filled in recursively.
 
-    def detect_required_sub_mutatables(self) -> None:
-        """
-        Detect placeholders like [$INTx], [$ACTIONx], etc., in the value
-        and map them dynamically using the 'mapping' list.
-        """
-        matches = re.findall(r'\[\$(\w+)\]', self.value)
+    The tree is stored as a flat array of IDs into the interned tables above: the type of the line, then the
+    template of every node in depth-first order. The number of children of a node follows from its template.
+    The array is replaced, never changed in place, so copies of a line can share it.
+    """
 
-        for match in matches:
-            if match not in self.sub_mutatables:  # Ensure no duplicate processing
-                self.set_sub_mutatable(match)
+    __slots__ = ("nodes", "_text")
 
-    def mutate(self):
+    def __init__(self, type: str, value: str, rng=random):
+        if type not in type_ids:
+            raise RuntimeError(f"Unknown mutatable type: {type}")
+        if value not in template_ids:
+            raise RuntimeError(f"Unknown template: {value}")
+        self.nodes = array(TYPECODE, [type_ids[type]])
+        _build(template_ids[value], self.nodes, rng)
+        self._text = None  # Rendered code, until a mutation invalidates it
+
+    @property
+    def type(self) -> str:
+        return type_names[self.nodes[0]]
+
+    @property
+    def value(self) -> str:
+        return template_values[self.nodes[1]]
+
+    @property
+    def sub_mutatables(self) -> Dict[str, "Mutatable"]:
+        """Decoded copies of the direct children by placeholder name, for inspection. Not kept in sync."""
+        result = {}
+        position = 2
+        for key in dict.fromkeys(template_segments[self.nodes[1]][1::2]):
+            end = _skip(self.nodes, position)
+            type_id = type_ids[placeholder_options(key)[0]]
+            result[key] = _from_nodes(array(TYPECODE, [type_id]) + self.nodes[position:end])
+            position = end
+        return result
+
+    def mutate(self, rng=random):
         """
         Mutate the sub-mutatables by randomly replacing or mutating them.
+
+        :param rng: Source of randomness, the global random module by default
         """
-        for key, sub_mutatable in list(self.sub_mutatables.items()):
-            if random.random() < 0.2:  # 20% chance to replace the sub-mutable
-                self.set_sub_mutatable(key)
-            else:
-                sub_mutatable.mutate()  # Recursively mutate existing sub-mutatables
-
-    def set_sub_mutatable(self, key: str):
-        for placeholder, mutatable_type, options in mapping:
-            if key.startswith(placeholder):
-                self.sub_mutatables[key] = Mutatable(mutatable_type, random.choice(options))
-                break
-        else:
-            raise RuntimeError(f"Unknown placeholder type: {key}")
+        nodes = self.nodes[:1]
+        _mutate(self.nodes, 1, nodes, rng)
+        self.nodes = nodes
+        self._text = None
 
     def __str__(self):
-        result = self.value
-        placeholders = re.findall(r'\[\$(\w+)\]', self.value)
+        if self._text is None:
+            self._text = _render(self.nodes, 1)[0]
+        return self._text
+
+    def __reduce__(self):
+        # Only the node IDs are pickled; the rendered code is not part of the genome
+        return _restore, (self.nodes.tobytes(),)
 
-        # Replace all placeholders using the sub-mutatables map
-        for placeholder in placeholders:
-            if placeholder in self.sub_mutatables:
-                result = result.replace(f"[${placeholder}]", str(self.sub_mutatables[placeholder]), 1)
-            else:
-                raise RuntimeError(f"Missing sub-mutable for placeholder: {placeholder}")
+    def __deepcopy__(self, memo):
+        # The node array is never changed in place, so a copy can share it
+        copy = _from_nodes(self.nodes)
+        copy._text = self._text
+        return copy
 
-        return result
\ No newline at end of file
+    def __setstate__(self, state):
+        # Checkpoints written before genomes were stored as node arrays pickled every node with its own
+        # type, value and sub_mutatables. Convert those on load.
+        value = state["value"]
+        nodes = array(TYPECODE, [type_ids[state["type"]], template_ids[value]])
+        for key in dict.fromkeys(compile_template(str(value))[1::2]):
+            nodes.extend(state["sub_mutatables"][key].nodes[1:])
+        self.nodes = nodes
+        self._text = None
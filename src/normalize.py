@@ -0,0 +1,135 @@
+"""
+Static normalization of genomes: the code a bot is compiled from, with everything removed that can't change
+what the bot does.
+
+- Conditions whose value follows from the ints and bools tables are folded: a comparison of an expression with
+  itself, or of ints whose ranges don't overlap (e.g. rc.getMapWidth() > GameConstants.SETUP_ROUNDS is never
+  true, as maps are at most 60 tiles wide). A line behind a false condition is dropped, a true condition is
+  removed from its line. Actions made of several statements keep their false conditions, as those only guard
+  the first statement.
+- The operands of == and != are put in a fixed order.
+- A line that repeats the line before it is dropped if it performs a single guarded action (if (rc.canX(..))
+  rc.x(..);): if the first one acted, the action is on cooldown; if not, nothing changed in between.
+  tryPickupFlag() is unguarded and throws if a flag is already held, so its repetitions are kept.
+
+Conditions have no side effects and don't throw, so the normalized genome behaves the same, except that it
+uses fewer bytecodes. Genomes are only normalized for compilation and evaluation; the population keeps the
+original code, so dead lines can come back to life through mutation.
+"""
+import math
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from src.mutatable import Mutatable, _from_nodes, _skip, template_ids, template_segments, template_values
+from src.mutatable_strings import actions
+
+# Ranges of the ints, from the Battlecode 2024 specification
+INT_RANGES = {
+    "rc.getMapHeight()": (30, 60),
+    "rc.getMapWidth()": (30, 60),
+    "rc.getRoundNum()": (1, 2000),
+    "GameConstants.SETUP_ROUNDS": (200, 200),
+    "rc.getCrumbs()": (0, math.inf),
+    "rc.getHealth()": (1, 1000),  # Robots only run while they are alive
+}
+# Bools with a fixed value; rc.hasFlag() depends on the game
+BOOL_VALUES: Dict[str, bool] = {}
+
+ACTION_KINDS = ["move", "attack", "heal", "build", "dig", "fill", "Flag"]
+
+
+def _template_tables() -> Tuple[Dict[int, Tuple[int, ...]], Dict[int, Optional[str]]]:
+    """
+    Kinds of every action template (a template can call several methods), and the comparison operator of every
+    if template (None for bool conditions).
+    """
+    action_kinds, conditions = {}, {}
+    for template_id, value in enumerate(template_values):
+        segments = template_segments[template_id]
+        if value in actions:
+            action_kinds[template_id] = tuple(k for k, kind in enumerate(ACTION_KINDS) if kind in str(value))
+        elif segments[0] == "if (":
+            conditions[template_id] = segments[2].strip() if segments[1].startswith("INT") else None
+    return action_kinds, conditions
+
+
+action_kinds, conditions = _template_tables()
+_ranges = {template_ids[value]: bounds for value, bounds in INT_RANGES.items() if value in template_ids}
+_bool_values = {template_ids[value]: known for value, known in BOOL_VALUES.items() if value in template_ids}
+# Actions that are a single statement. The others (e.g. a move followed by an attack) are only guarded by the
+# conditions before them up to their first semicolon, so a false condition doesn't make them unreachable.
+_single_statement = {template_id for template_id in action_kinds if str(template_values[template_id]).count(";") == 1}
+# Actions that can be dropped when repeated: one method call, guarded by its rc.canX check
+_idempotent = {template_id for template_id, kinds in action_kinds.items()
+               if len(kinds) == 1 and "rc.can" in str(template_values[template_id])}
+
+
+def condition_value(nodes, position: int) -> Optional[bool]:
+    """Value of the condition of the if at position, if it doesn't depend on the game. Otherwise None."""
+    operator = conditions[nodes[position]]
+    if operator is None:
+        return _bool_values.get(nodes[position + 1])
+    left, right = position + 1, _skip(nodes, position + 1)
+    if nodes[left:right] == nodes[right:_skip(nodes, right)]:
+        return operator == "=="
+    low1, high1 = _ranges.get(nodes[left], (-math.inf, math.inf))  # Ints are single templates
+    low2, high2 = _ranges.get(nodes[right], (-math.inf, math.inf))
+    if operator == ">":
+        return True if low1 > high2 else False if high1 <= low2 else None
+    if high1 < low2 or high2 < low1:  # Can't be equal
+        return operator == "!="
+    if low1 == high1 == low2 == high2:
+        return operator == "=="
+    return None
+
+
+def normalize_line(line: Mutatable) -> Optional[Mutatable]:
+    """The line with constant conditions folded and operands ordered, or None if it can never act."""
+    nodes = line.nodes
+    result = nodes[:1]
+    position = 1
+    single_statement = _final_action(nodes) in _single_statement
+    while nodes[position] in conditions:
+        value = condition_value(nodes, position)
+        body = _body(nodes, position)
+        if value is False and single_statement:
+            return None
+        if value is False:  # Only the first statement of the action is unreachable, keep the condition
+            value = None
+        if value is None:
+            operands = nodes[position + 1:body]
+            if conditions[nodes[position]] in ("==", "!="):
+                middle = _skip(nodes, position + 1) - position - 1
+                operands = min(operands, operands[middle:] + operands[:middle])
+            result.append(nodes[position])
+            result.extend(operands)
+        position = body
+    result.extend(nodes[position:])
+    return line if result == nodes else _from_nodes(result)
+
+
+def normalize(code: List[Mutatable]) -> List[Mutatable]:
+    """Canonical form of a genome, see the module docstring. Lines that don't change are shared."""
+    normalized = []
+    for line in code:
+        line = normalize_line(line)
+        if line is None:
+            continue
+        if normalized and line.nodes == normalized[-1].nodes and _final_action(line.nodes) in _idempotent:
+            continue
+        normalized.append(line)
+    return normalized
+
+
+def _body(nodes: array, position: int) -> int:
+    """Position of the body of the if at position: comparisons have two operands, bool conditions one."""
+    body = _skip(nodes, position + 1)
+    return _skip(nodes, body) if conditions[nodes[position]] is not None else body
+
+
+def _final_action(nodes: array) -> int:
+    """Template of the action a line performs, after its conditions."""
+    position = 1
+    while nodes[position] in conditions:
+        position = _body(nodes, position)
+    return nodes[position]
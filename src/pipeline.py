@@ -0,0 +1,136 @@
+import random
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.battlecode_runner import make_bot, build_bots
+from src.bot_names import get_names
+from src.genetic_algorithm import plan_offspring, breed_offspring
+from src.mutatable import Mutatable
+from src.scheduler import get_scheduler
+from src.tournament import start_pairing
+from src.util import timestamp
+
+
+class PipelinedGeneration:
+    """
+    One generation in flight: its members (filled in as they are bred), which of them are compiled,
+    and the results of its one-game tournament as they arrive.
+    """
+
+    def __init__(self, number: int, size: int):
+        self.number = number
+        self.members: List[Optional[Tuple[str, List[Mutatable]]]] = [None] * size
+        self.compiled = [False] * size
+        self.submitted = set()  # Indices of pairs whose match was submitted
+        self.results: Dict[int, Tuple[str, str]] = {}  # Pair index -> (winner, loser)
+        self.plan: List[Tuple[str, Tuple[int, ...], int]] = []
+        self.offspring_names: List[str] = []
+        self.random_state: Optional[tuple] = None  # State of the random module before the next generation's plan
+        self.parents: Dict[str, Tuple[str, ...]] = {}  # Member name -> names of its parents
+
+    def number_of_pairs(self) -> int:
+        return len(self.members) // 2
+
+    def complete(self) -> bool:
+        return len(self.results) == self.number_of_pairs()
+
+    def code_of(self, name: str) -> List[Mutatable]:
+        return next(code for member_name, code in self.members if member_name == name)
+
+    def scores(self) -> List[Tuple[int, List[Mutatable], str]]:
+        """Rank winners (in pair order) ahead of losers, like run_one_game_tournament."""
+        results = [self.results[i] for i in range(self.number_of_pairs())]
+        rankings = [winner for winner, _ in results] + [loser for _, loser in results]
+        return [(rank, self.code_of(name), name) for rank, name in enumerate(rankings, start=1)]
+
+
+def run_pipelined_generations(population: List[Tuple[str, List[Mutatable]]], start_generation: int, generations: int,
+                              population_size: int, finish_generation: Callable, compile_batch_size: int = 8):
+    """
+    Evolve from start_generation up to and including generations, overlapping consecutive generations.
+
+    Each generation's breeding plan (operations, parent ranks, seeds and names) is drawn up front. As soon as
+    a pair's result is final, its winner is carried over and every offspring whose parents are now known is
+    bred. Offspring are compiled in batches, and a pair of the next generation is submitted as soon as both
+    of its members are compiled, while the stragglers of the current generation are still playing.
+    Selection is the same as in the sequential loop: the winner of pair i is the parent with index i.
+
+    :param finish_generation: Called with (scores, population, generation, random_state, parents) once a
+                              generation's results are complete
+    :param compile_batch_size: Number of bred offspring that triggers a compile while all workers are busy
+    :return: Scores of the last generation
+    """
+    scheduler = get_scheduler()
+    running = {}  # future -> (generation, pair index)
+
+    def submit_ready_pairs(generation: PipelinedGeneration) -> None:
+        for i in range(generation.number_of_pairs()):
+            if i not in generation.submitted and generation.compiled[2 * i] and generation.compiled[2 * i + 1]:
+                generation.submitted.add(i)
+                bot1, bot2 = generation.members[2 * i][0], generation.members[2 * i + 1][0]
+                running[scheduler.submit(start_pairing, bot1, bot2)] = (generation, i)
+
+    def compile_members(generation: PipelinedGeneration, indices: List[int]) -> None:
+        for i in indices:
+            make_bot(*generation.members[i])
+        build_bots([generation.members[i][0] for i in indices])
+        for i in indices:
+            generation.compiled[i] = True
+
+    current = PipelinedGeneration(start_generation, len(population))
+    current.members = list(population)
+    compile_members(current, list(range(len(population))))
+    submit_ready_pairs(current)
+
+    while True:
+        last = current.number == generations
+        current.random_state = random.getstate()  # Checkpointed, so a resumed run draws the same plan
+        upcoming = None
+        if not last:
+            upcoming = PipelinedGeneration(current.number + 1, population_size)
+            number_of_parents = int(population_size / 2)
+            upcoming.plan = plan_offspring(population_size - number_of_parents, number_of_parents)
+            upcoming.offspring_names = [f"gen{upcoming.number}.{name}" for name in get_names(len(upcoming.plan))]
+        pending = []  # Members of the upcoming generation that are bred but not compiled
+
+        while True:
+            if upcoming is not None:
+                number_of_parents = len(upcoming.members) - len(upcoming.plan)
+                # Carry over winners
+                for i, (winner, _) in current.results.items():
+                    if i < number_of_parents and upcoming.members[i] is None:
+                        name = winner.replace("gen" + str(current.number), "gen" + str(upcoming.number))
+                        upcoming.members[i] = (name, current.code_of(winner))
+                        upcoming.parents[name] = (winner,)
+                        pending.append(i)
+                # Breed every offspring whose parents are known
+                for k, (operation, parents, seed) in enumerate(upcoming.plan):
+                    index = number_of_parents + k
+                    if upcoming.members[index] is None and all(p in current.results for p in parents):
+                        parent_names = tuple(current.results[p][0] for p in parents)
+                        parent_codes = [current.code_of(name) for name in parent_names]
+                        upcoming.members[index] = (upcoming.offspring_names[k],
+                                                   breed_offspring(operation, parent_codes, seed))
+                        upcoming.parents[upcoming.offspring_names[k]] = parent_names
+                        pending.append(index)
+                # Compile once the batch is large enough, a worker would otherwise idle, or nothing else is left
+                if pending and (len(pending) >= compile_batch_size or len(running) < scheduler.concurrency
+                                or current.complete()):
+                    compile_members(upcoming, pending)
+                    pending = []
+                    submit_ready_pairs(upcoming)
+
+            if current.complete():
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                generation, i = running.pop(future)
+                generation.results[i] = future.result()
+
+        ahead = len(upcoming.results) if upcoming is not None else 0
+        print(f"{timestamp()} Generation {current.number} complete, {ahead} matches of the next one already finished")
+        scores = current.scores()
+        finish_generation(scores, current.members, current.number, current.random_state, current.parents)
+        if last:
+            return scores
+        current = upcoming
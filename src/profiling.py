@@ -0,0 +1,64 @@
+"""
+Bytecode profiles of bots, collected from the matches they play.
+
+Generated bots count the bytecodes of every turn and print their totals every 50 turns (see template.py). The match
+worker adds up the latest totals of all robots of a team and reports them with the result, in the "teams" of a
+MatchResult. Here the profiles of a bot's matches are summed, so every evaluated bot gets a profile next to its rank:
+- turns, bytecodes: turns profiled and the bytecodes they used
+- maxBytecodes: most bytecodes a single turn used
+- overBudget: turns that ran out of bytecodes and were continued in the next round
+- exceptions: exceptions caught by the catch blocks of the template's run loop
+
+Results reused from the result store come without their match, so they don't add to a profile.
+"""
+import threading
+from typing import Dict, Iterable, Optional
+
+from src.match_result import MatchResult
+
+PROFILE_FIELDS = ("turns", "bytecodes", "maxBytecodes", "overBudget", "exceptions")
+
+_profiles: Dict[str, Dict[str, int]] = {}  # Bot name -> profile of its matches so far
+_lock = threading.Lock()
+
+
+def record_match(team_a: str, team_b: str, result: Optional[MatchResult]) -> None:
+    """Add the per-team profiles of a played match to the profiles of both bots."""
+    if result is None:
+        return
+    with _lock:
+        for name, side in ((team_a, "A"), (team_b, "B")):
+            stats = result.teams.get(side, {})
+            if "turns" not in stats:  # Bots compiled before profiling existed, or an engine without profiles
+                continue
+            profile = _profiles.setdefault(name, dict({"matches": 0}, **dict.fromkeys(PROFILE_FIELDS, 0)))
+            profile["matches"] += 1
+            for key in PROFILE_FIELDS:
+                if key == "maxBytecodes":
+                    profile[key] = max(profile[key], stats.get(key, 0))
+                else:
+                    profile[key] += stats.get(key, 0)
+
+
+def take_profiles(names: Iterable[str]) -> Dict[str, Dict[str, int]]:
+    """Remove and return the profiles of the given bots; bots without a profiled match are left out."""
+    with _lock:
+        return {name: _profiles.pop(name) for name in names if name in _profiles}
+
+
+def bytecodes_per_turn(profile: Dict[str, int]) -> float:
+    return profile["bytecodes"] / profile["turns"] if profile["turns"] else 0.0
+
+
+def profile_report(profiles: Dict[str, Dict[str, int]], slowest: int = 3) -> str:
+    """Summary of a generation's profiles and its slowest bots."""
+    if not profiles:
+        return "no profiled matches"
+    turns = sum(profile["turns"] for profile in profiles.values())
+    bytecodes = sum(profile["bytecodes"] for profile in profiles.values())
+    over_budget = [name for name, profile in profiles.items() if profile["overBudget"]]
+    ranked = sorted(profiles, key=lambda name: bytecodes_per_turn(profiles[name]), reverse=True)[:slowest]
+    return (f"{bytecodes / turns if turns else 0:.0f} bytecodes per turn, {len(over_budget)} of {len(profiles)} "
+            f"bots over budget; slowest: " + ", ".join(
+                f"{name} ({bytecodes_per_turn(profiles[name]):.0f}/turn, {profiles[name]['overBudget']} turns over "
+                f"budget, {profiles[name]['exceptions']} exceptions)" for name in ranked))
@@ -0,0 +1,163 @@
+import math
+import os
+import sqlite3
+import threading
+from typing import NamedTuple, Optional, Tuple
+
+from src.result_store import store_version
+from src.util import timestamp
+
+# Paths
+default_ratings_path = os.path.join("results", "ratings.db")
+
+# TrueSkill parameters: prior skill, prior uncertainty, performance noise of a single game and the uncertainty
+# added before every game, so ratings can follow bots whose strength depends on the opponents they meet
+MU = 25.0
+SIGMA = MU / 3
+BETA = MU / 6
+TAU = MU / 300
+
+
+class Rating(NamedTuple):
+    mu: float  # Estimated skill
+    sigma: float  # Uncertainty of the estimate
+    games: int
+
+
+def _pdf(x: float) -> float:
+    return math.exp(-x * x / 2) / math.sqrt(2 * math.pi)
+
+
+def _cdf(x: float) -> float:
+    return (1 + math.erf(x / math.sqrt(2))) / 2
+
+
+def match_quality(a: Rating, b: Rating) -> float:
+    """TrueSkill match quality: the probability of a draw, relative to two equally rated bots without uncertainty."""
+    c2 = 2 * BETA ** 2 + a.sigma ** 2 + b.sigma ** 2
+    return math.sqrt(2 * BETA ** 2 / c2) * math.exp(-(a.mu - b.mu) ** 2 / (2 * c2))
+
+
+def information(a: Rating, b: Rating) -> float:
+    """
+    How much a game between two bots is expected to teach: close games between uncertain bots teach the most,
+    games against a far stronger or weaker opponent, or between well-known bots, the least.
+    """
+    return match_quality(a, b) * (a.sigma ** 2 + b.sigma ** 2)
+
+
+def win_probability(a: Rating, b: Rating) -> float:
+    """Probability that a beats b."""
+    return _cdf((a.mu - b.mu) / math.sqrt(2 * BETA ** 2 + a.sigma ** 2 + b.sigma ** 2))
+
+
+def rate_game(winner: Rating, loser: Rating) -> Tuple[Rating, Rating]:
+    """TrueSkill update of two ratings after a game without a draw."""
+    winner_variance, loser_variance = winner.sigma ** 2 + TAU ** 2, loser.sigma ** 2 + TAU ** 2
+    c = math.sqrt(2 * BETA ** 2 + winner_variance + loser_variance)
+    t = (winner.mu - loser.mu) / c
+    v = _pdf(t) / max(_cdf(t), 1e-12)
+    w = v * (v + t)
+    return (Rating(winner.mu + winner_variance / c * v,
+                   math.sqrt(winner_variance * max(1 - winner_variance / c ** 2 * w, 1e-6)), winner.games + 1),
+            Rating(loser.mu - loser_variance / c * v,
+                   math.sqrt(loser_variance * max(1 - loser_variance / c ** 2 * w, 1e-6)), loser.games + 1))
+
+
+class RatingStore:
+    """
+    Persistent TrueSkill ratings keyed by (genome hash, engine version), and the pairings they were learned from.
+
+    Like the result store, bots are identified by the hash of their normalized code, so an elite keeps its rating
+    from generation to generation and equivalent bots share one.
+    """
+
+    def __init__(self, path: str = default_ratings_path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.version = store_version()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS ratings ("
+            "genome TEXT, version TEXT, mu REAL, sigma REAL, games INTEGER, PRIMARY KEY (genome, version))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS games (winner TEXT, loser TEXT, version TEXT)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS games_pair ON games (winner, loser, version)")
+        self.connection.commit()
+
+    def get(self, genome: str) -> Rating:
+        """Return the rating of a genome, or the prior if it never played."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT mu, sigma, games FROM ratings WHERE genome=? AND version=?", (genome, self.version)
+            ).fetchone()
+        return Rating(*row) if row else Rating(MU, SIGMA, 0)
+
+    def played(self, genome_a: str, genome_b: str) -> bool:
+        """Whether the two genomes met before."""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT 1 FROM games WHERE ((winner=? AND loser=?) OR (winner=? AND loser=?)) AND version=? LIMIT 1",
+                (genome_a, genome_b, genome_b, genome_a, self.version),
+            ).fetchone() is not None
+
+    def record(self, winner: str, loser: str) -> Tuple[Rating, Rating]:
+        """Update both ratings with the result of a game and return the new ratings."""
+        winner_rating, loser_rating = rate_game(self.get(winner), self.get(loser))
+        with self.lock:
+            for genome, rating in ((winner, winner_rating), (loser, loser_rating)):
+                self.connection.execute("INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?, ?)",
+                                        (genome, self.version) + tuple(rating))
+            self.connection.execute("INSERT INTO games VALUES (?, ?, ?)", (winner, loser, self.version))
+            self.connection.commit()
+        return winner_rating, loser_rating
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+_store: Optional[RatingStore] = None
+_store_lock = threading.Lock()
+_store_path = default_ratings_path
+_games_per_generation: Optional[int] = None
+_enabled = True
+
+
+def configure_ratings(path: str = default_ratings_path, games_per_generation: Optional[int] = None,
+                      enabled: bool = True) -> None:
+    """
+    Configure rating tournaments. Takes effect the next time get_rating_store() opens the store.
+
+    :param path: SQLite database file
+    :param games_per_generation: Game budget of a generation's rating tournament (default: the population size)
+    :param enabled: If False, get_rating_store() returns None and generations are ranked by one-game tournaments
+    """
+    global _store, _store_path, _games_per_generation, _enabled
+    if _store is not None:
+        _store.close()
+        _store = None
+    _store_path = path
+    _games_per_generation = games_per_generation
+    _enabled = enabled
+
+
+def games_per_generation(population_size: int) -> int:
+    return _games_per_generation if _games_per_generation is not None else population_size
+
+
+def get_rating_store() -> Optional[RatingStore]:
+    """Return the shared rating store, or None if rating tournaments are disabled."""
+    global _store
+    if not _enabled:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = RatingStore(_store_path)
+            print(f"{timestamp()} Opened rating store {_store_path}")
+        return _store
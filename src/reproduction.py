@@ -0,0 +1,252 @@
+"""
+Batched reproduction: breeds a whole generation's offspring in one pass over the flat node arrays of the parents.
+
+The decisions the line-by-line operators in genetic_algorithm make one random.random() call at a time are drawn
+as NumPy arrays instead, with the same probabilities:
+- every offspring is a mutation of one parent or a uniform crossover of two (50% each)
+- mutation deletes a line (10%), adds a random line after it (10%), mutates it (20%) or keeps it
+- a mutated line replaces every placeholder filling with a new random one with 20% probability, unless a
+  filling above it is replaced already
+- crossover takes each line from either parent and each extra line of the longer parent with 50% probability
+
+New fillings and new lines are generated level by level for all of them at once and spliced into the mutated
+lines in one step, so Python objects are only created for the new lines and the offspring lists.
+
+NumPy is optional. Without it, available() is False and the genetic algorithm uses the line-by-line operators.
+"""
+from array import array
+from itertools import chain
+from operator import attrgetter
+from typing import List, NamedTuple, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from src import mutatable
+from src.mutatable import Mutatable, TYPECODE, _from_nodes
+from src.mutatable_strings import actions, ifs
+
+ITEMSIZE = array(TYPECODE).itemsize
+
+
+class SlotTables(NamedTuple):
+    """The template tables of mutatable as arrays, with the distinct option lists numbered as "slots"."""
+    slot_options: "np.ndarray"  # Template IDs of every slot, padded
+    slot_sizes: "np.ndarray"  # Number of options of every slot
+    template_slot: "np.ndarray"  # Slot every template is drawn from
+    child_slots: "np.ndarray"  # Slots of every template's placeholders, padded with -1
+    arity: "np.ndarray"  # Number of placeholders of every template
+    root_slots: "np.ndarray"  # Slots of new lines: actions and ifs
+
+
+def _slot_tables() -> SlotTables:
+    slot_ids = {}
+    for options in [options for template_options in mutatable.template_children for options in template_options]:
+        slot_ids.setdefault(tuple(options), len(slot_ids))
+    for options in (actions, ifs):
+        slot_ids.setdefault(tuple(mutatable.template_ids[value] for value in options), len(slot_ids))
+    number_of_templates = len(mutatable.template_values)
+    slot_options = np.zeros((len(slot_ids), max(len(options) for options in slot_ids)), dtype=np.int64)
+    slot_sizes = np.zeros(len(slot_ids), dtype=np.int64)
+    template_slot = np.full(number_of_templates, -1, dtype=np.int64)
+    for options, slot in slot_ids.items():
+        slot_options[slot, :len(options)] = options
+        slot_sizes[slot] = len(options)
+        for template_id in options:
+            if template_slot[template_id] not in (-1, slot):
+                raise RuntimeError(f"Template {mutatable.template_values[template_id]!r} fills several placeholder "
+                                   "types; batched mutation can't tell which one to refill")
+            template_slot[template_id] = slot
+    arity = np.array([len(children) for children in mutatable.template_children], dtype=np.int64)
+    child_slots = np.full((number_of_templates, max(1, arity.max())), -1, dtype=np.int64)
+    for template_id, children in enumerate(mutatable.template_children):
+        for k, options in enumerate(children):
+            child_slots[template_id, k] = slot_ids[tuple(options)]
+    root_slots = np.array([slot_ids[tuple(mutatable.template_ids[value] for value in options)]
+                           for options in (actions, ifs)], dtype=np.int64)
+    return SlotTables(slot_options, slot_sizes, template_slot, child_slots, arity, root_slots)
+
+
+_tables = None
+
+
+def available() -> bool:
+    """Whether batched reproduction can be used, i.e. NumPy is installed."""
+    return np is not None
+
+
+def _get_tables() -> SlotTables:
+    global _tables
+    if _tables is None:
+        _tables = _slot_tables()
+    return _tables
+
+
+def _fill(slots, rng) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Random subtrees for a sequence of slots, depth-first encoded and concatenated in slot order.
+    The nodes of all subtrees are drawn level by level; their positions follow from the subtree sizes.
+
+    :return: The template IDs of the subtrees and the size of every subtree
+    """
+    tables = _get_tables()
+    levels = []  # Per level: the chosen templates, which of their placeholders exist, where their children start
+    while slots.size:
+        choice = (rng.random(slots.size) * tables.slot_sizes.take(slots)).astype(np.int64)
+        chosen = tables.slot_options.take(slots * tables.slot_options.shape[1] + choice)
+        children = tables.child_slots.take(chosen, axis=0)
+        has_child = children >= 0
+        counts = tables.arity.take(chosen)
+        levels.append((chosen, has_child, counts, np.cumsum(counts) - counts))
+        slots = children[has_child]  # Row by row, so the children of every node are in order
+    if not levels:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # Subtree sizes bottom-up, as prefix sums so the sizes of a node's children are one difference
+    size_sums = [None] * len(levels)
+    sizes = np.ones(levels[-1][0].size, dtype=np.int64)
+    for level in range(len(levels) - 1, -1, -1):
+        if level < len(levels) - 1:
+            _, _, counts, child_starts = levels[level]
+            below = size_sums[level + 1]
+            sizes = 1 + below[child_starts + counts] - below[child_starts]
+        size_sums[level] = np.concatenate(([0], np.cumsum(sizes)))
+    # Positions top-down: a child follows its parent and the subtrees of its earlier siblings
+    result = np.empty(size_sums[0][-1], dtype=np.int64)
+    positions = size_sums[0][:-1]
+    for level, (chosen, _, counts, child_starts) in enumerate(levels):
+        result[positions] = chosen
+        if level + 1 < len(levels):
+            below = size_sums[level + 1]
+            first = positions + 1 - below[child_starts]
+            positions = np.repeat(first, counts) + below[:-1]
+    return result, np.diff(size_sums[0])
+
+
+def _splice(symbols, is_slot, rng) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Replace every slot in a symbol sequence (where is_slot, holding the slot number) with a random subtree.
+
+    :return: The new sequence and the position every symbol moved to
+    """
+    slots = np.flatnonzero(is_slot)
+    fills, sizes = _fill(symbols[slots], rng)
+    counts = np.ones(symbols.size, dtype=np.int64)
+    counts[slots] = sizes
+    positions = np.cumsum(counts) - counts
+    result = np.empty(counts.sum(), dtype=np.int64)
+    result[positions[~is_slot]] = symbols[~is_slot]
+    result[np.repeat(positions[slots] - (np.cumsum(sizes) - sizes), sizes) + np.arange(fills.size)] = fills
+    return result, positions
+
+
+def _new_lines(mutated: List[array], number: int, rng) -> List[Mutatable]:
+    """
+    Mutated copies of lines given by their nodes (see Mutatable.mutate), followed by `number` random lines (see
+    genetic_algorithm.generate_random_line).
+    """
+    tables = _get_tables()
+    lengths = np.fromiter(map(len, mutated), dtype=np.int64, count=len(mutated))
+    nodes = np.frombuffer(b"".join(mutated), dtype=TYPECODE).astype(np.int64)
+    starts = np.cumsum(lengths) - lengths  # Every line starts with its type
+    is_type = np.zeros(nodes.size, dtype=bool)
+    is_type[starts] = True
+    # Placeholders still open before every node: a subtree ends where this drops below its value at its root.
+    # Type nodes have 0, and so does the end of the sequence.
+    delta = np.where(is_type, 0, tables.arity[nodes] - 1)
+    running = np.cumsum(delta) - delta
+    open_slots = np.append(running - np.repeat(running[starts], lengths) + 1, 0)
+    open_slots[:-1][is_type] = 0
+    marked = rng.random(nodes.size) < 0.2  # 20% chance to replace the sub-mutable
+    marked[starts] = marked[starts + 1] = False
+    # End of the subtree of every marked node, found with a search over the nodes sorted by open placeholders
+    order = np.argsort(open_slots.astype(np.int16), kind="stable")
+    keys = open_slots[order] * open_slots.size + order
+    roots = np.flatnonzero(marked)
+    reach = np.zeros(nodes.size, dtype=np.int64)
+    reach[roots] = order[np.searchsorted(keys, (open_slots[roots] - 1) * open_slots.size + roots + 1)]
+    # Nodes below a replaced node are dropped; marked nodes that aren't dropped become slots to refill
+    reach = np.maximum.accumulate(reach)
+    kept = np.ones(nodes.size, dtype=bool)
+    kept[1:] = np.arange(1, nodes.size) >= reach[:-1]
+    symbols = np.where(marked, tables.template_slot[nodes], nodes)[kept]
+
+    new_roots = tables.root_slots[rng.integers(0, tables.root_slots.size, number)]
+    symbols = np.concatenate((symbols, np.column_stack(
+        (np.full(number, mutatable.type_ids["action"]), new_roots)).ravel()))
+    is_slot = np.concatenate((marked[kept], np.tile([False, True], number)))
+    is_type = np.concatenate((is_type[kept], np.tile([True, False], number)))
+    result, positions = _splice(symbols, is_slot, rng)
+    data = result.astype(TYPECODE).tobytes()
+    bounds = [start * ITEMSIZE for start in positions[is_type].tolist()] + [len(data)]
+    return [_from_nodes(array(TYPECODE, data[a:b])) for a, b in zip(bounds, bounds[1:])]
+
+
+def breed(parents: List[List[Mutatable]], number: int,
+          seed: int) -> Tuple[List[List[Mutatable]], List[Tuple[int, ...]]]:
+    """
+    Breed `number` offspring from the parents in one pass.
+    Lines that are kept or crossed over are shared with the parents; the parents are not changed.
+
+    :param seed: Seed of the NumPy generator for all decisions of this generation
+    :return: The offspring and the indices of the parents of every offspring
+    """
+    rng = np.random.default_rng(seed)
+    lengths = np.array([len(code) for code in parents], dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+
+    is_mutation = rng.random(number) < 0.5
+    first = rng.integers(0, len(parents), number)
+    second = rng.integers(0, len(parents), number)
+
+    # Every offspring becomes a run of items: (kind, line index), where kind 0 is an existing line, 1 a mutated
+    # copy of a line and 2 a new random line
+    children, kinds, sources = [], [], []
+
+    crossed = np.flatnonzero(~is_mutation)
+    length1, length2 = lengths[first[crossed]], lengths[second[crossed]]
+    shorter, longer = np.minimum(length1, length2), np.maximum(length1, length2)
+    child = np.repeat(crossed, longer)
+    position = np.arange(child.size) - np.repeat(np.cumsum(longer) - longer, longer)
+    take_first = rng.random(child.size) < 0.5
+    offset1, offset2 = np.repeat(offsets[first[crossed]], longer), np.repeat(offsets[second[crossed]], longer)
+    longer_offset = np.where(np.repeat(length1 > length2, longer), offset1, offset2)
+    source = np.where(position < np.repeat(shorter, longer), np.where(take_first, offset1, offset2), longer_offset)
+    keep = (position < np.repeat(shorter, longer)) | (rng.random(child.size) < 0.5)
+    children.append(child[keep])
+    kinds.append(np.zeros(keep.sum(), dtype=np.int64))
+    sources.append(source[keep] + position[keep])
+
+    mutated = np.flatnonzero(is_mutation)
+    parent_lengths = lengths[first[mutated]]
+    child = np.repeat(mutated, parent_lengths)
+    parent = np.repeat(first[mutated], parent_lengths)
+    position = np.arange(child.size) - np.repeat(np.cumsum(parent_lengths) - parent_lengths, parent_lengths)
+    fate = rng.random(child.size)
+    counts = np.where(fate < 0.1, 0, np.where(fate < 0.2, 2, 1))  # Deleted, followed by a new line, kept
+    line = np.repeat(np.arange(child.size), counts)
+    second_item = np.arange(line.size) - np.repeat(np.cumsum(counts) - counts, counts) == 1
+    kind = np.where(second_item, 2, np.where((fate[line] >= 0.2) & (fate[line] < 0.4), 1, 0))
+    children.append(child[line])
+    kinds.append(kind)
+    sources.append(offsets[parent[line]] + position[line])
+    lines = list(chain.from_iterable(parents))
+    changed_lines = list(map(attrgetter("nodes"), map(lines.__getitem__, sources[-1][kind == 1].tolist())))
+
+    children, kinds, sources = np.concatenate(children), np.concatenate(kinds), np.concatenate(sources)
+    changed = np.flatnonzero(kinds == 1)
+    new_lines = _new_lines(changed_lines, int((kinds == 2).sum()), rng)
+    # Lines are looked up in the parents' lines followed by the new ones: the mutated lines, then the random ones
+    references = sources
+    references[changed] = lengths.sum() + np.arange(changed.size)
+    references[kinds == 2] = lengths.sum() + changed.size + np.arange(int((kinds == 2).sum()))
+
+    # Items of every offspring come from one of the two groups, so a stable sort keeps their order
+    order = np.argsort(children, kind="stable")
+    items = list(map((lines + new_lines).__getitem__, references[order].tolist()))
+    bounds = np.searchsorted(children[order], np.arange(number + 1)).tolist()
+    offspring = [items[a:b] for a, b in zip(bounds, bounds[1:])]
+    lineage = [(a,) if mutation else (a, b) for mutation, a, b in zip(is_mutation.tolist(), first.tolist(),
+                                                                     second.tolist())]
+    return offspring, lineage
@@ -0,0 +1,144 @@
+import os
+import random
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+from src.adjudication import round_cap
+from src.match_server import engine_kind, gradle_path
+from src.util import timestamp
+
+# Paths
+default_store_path = os.path.join("results", "match_results.db")
+version_path = os.path.join(gradle_path, "version.txt")
+
+# (genome A, genome B, map, seed, engine version)
+ResultKey = Tuple[str, str, str, int, str]
+
+
+def engine_version() -> str:
+    """Battlecode engine version the scaffold is configured for."""
+    if not os.path.exists(version_path):
+        return "unknown"
+    with open(version_path) as file:
+        return file.read().strip()
+
+
+def store_version() -> str:
+    """
+    Version results and ratings are stored under: the engine version, plus the engine kind if matches are played
+    on the fake engine, plus the round cap if games are truncated.
+    """
+    version = engine_version()
+    if engine_kind() != "battlecode":
+        version += f"+{engine_kind()}"  # Coin flips must never be reused as results of real games
+    if round_cap() is not None:
+        version += f"+cap{round_cap()}"  # Adjudicated results aren't results of full games
+    return version
+
+
+class ResultStore:
+    """
+    Persistent store of match results keyed by (genome hash A, genome hash B, map, seed, engine version).
+
+    Bots are identified by the hash of their code rather than their name, so an elite that meets the same
+    opponent again in a later generation doesn't need a new game. Several results can be stored per key:
+    with resample > 0, a cached pairing is replayed with that probability and the new result is added, so
+    stochastic bots are represented by a sample of outcomes instead of their first one.
+    """
+
+    def __init__(self, path: str = default_store_path, resample: float = 0.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.resample = resample
+        self.version = store_version()
+        self.hits = 0
+        self.misses = 0
+        self.rng = random.Random()  # Own RNG so the evolution's random state isn't touched
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "genome_a TEXT, genome_b TEXT, map TEXT, seed INTEGER, version TEXT, result INTEGER)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_key ON results (genome_a, genome_b, map, seed, version)"
+        )
+        self.connection.commit()
+
+    def key(self, genome_a: str, genome_b: str, map_name: str, seed: int = 0) -> ResultKey:
+        return genome_a, genome_b, map_name, seed, self.version
+
+    def samples(self, key: ResultKey) -> List[int]:
+        """Return all stored results for a key."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT result FROM results WHERE genome_a=? AND genome_b=? AND map=? AND seed=? AND version=?",
+                key,
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def lookup(self, key: ResultKey) -> Optional[int]:
+        """
+        Return a stored result for the key, or None if the match has to be played.
+        Counts as a hit or a miss.
+        """
+        samples = self.samples(key)
+        with self.lock:
+            if not samples or self.rng.random() < self.resample:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self.rng.choice(samples)
+
+    def record(self, key: ResultKey, result: int) -> None:
+        with self.lock:
+            self.connection.execute("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)", key + (result,))
+            self.connection.commit()
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.1f}% of matches served from the result store)"
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+_store: Optional[ResultStore] = None
+_store_lock = threading.Lock()
+_store_path = default_store_path
+_resample = 0.0
+_enabled = True
+
+
+def configure_result_store(path: str = default_store_path, resample: float = 0.0, enabled: bool = True) -> None:
+    """
+    Configure the shared result store. Takes effect the next time get_result_store() opens the store.
+
+    :param path: SQLite database file
+    :param resample: Probability of replaying a cached pairing, for stochastic bots
+    :param enabled: If False, get_result_store() returns None and every match is played
+    """
+    global _store, _store_path, _resample, _enabled
+    if _store is not None:
+        _store.close()
+        _store = None
+    _store_path = path
+    _resample = resample
+    _enabled = enabled
+
+
+def get_result_store() -> Optional[ResultStore]:
+    """Return the shared result store, or None if memoization is disabled."""
+    global _store
+    if not _enabled:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore(_store_path, _resample)
+            print(f"{timestamp()} Opened match result store {_store_path}")
+        return _store
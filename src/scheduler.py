@@ -0,0 +1,233 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Iterable, List, Optional
+
+from src import tracing
+from src.util import timestamp, TransientMatchError
+
+DEFAULT_JVM_HEAP_MB = 2048  # Heap budget per match JVM
+DEFAULT_RETRIES = 2
+
+
+def available_cpus() -> int:
+    """CPUs allocated to this job: SLURM_CPUS_PER_TASK on the cluster, the machine's CPU count otherwise."""
+    if "SLURM_CPUS_PER_TASK" in os.environ:
+        return int(os.environ["SLURM_CPUS_PER_TASK"])
+    return os.cpu_count() or 1
+
+
+def available_memory_mb() -> Optional[int]:
+    """Memory allocated to this job in MB, from SLURM or the machine's physical memory."""
+    if "SLURM_MEM_PER_NODE" in os.environ:
+        return int(os.environ["SLURM_MEM_PER_NODE"])
+    if "SLURM_MEM_PER_CPU" in os.environ:
+        return int(os.environ["SLURM_MEM_PER_CPU"]) * available_cpus()
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_concurrency(heap_mb: int = DEFAULT_JVM_HEAP_MB) -> int:
+    """
+    Number of matches that can run at the same time without oversubscribing CPUs or memory.
+    One CPU and heap_mb of memory (plus a quarter for JVM overhead) are budgeted per match.
+    """
+    concurrency = available_cpus()
+    memory = available_memory_mb()
+    if memory is not None:
+        concurrency = min(concurrency, memory // (heap_mb + heap_mb // 4))
+    return max(1, concurrency)
+
+
+class MatchScheduler:
+    """
+    Central scheduler all tournament code submits matches to.
+
+    A fixed number of threads take jobs from a priority queue (lower priority values run first), so the
+    number of concurrent matches never exceeds the budget. submit() blocks once max_queued jobs are
+    waiting or running, which gives callers backpressure. Jobs failing with a TransientMatchError are
+    requeued up to `retries` times.
+
+    A job may also return a future instead of its result (see tournament.start_pairing). Its thread then
+    moves on to the next job right away, and the job counts as running until the future is done, so
+    such jobs are bounded by max_queued and by whatever runs their matches, not by the threads.
+    """
+
+    def __init__(self, concurrency: int, retries: int = DEFAULT_RETRIES, max_queued: Optional[int] = None):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.jobs: "queue.PriorityQueue" = queue.PriorityQueue()
+        self.sequence = itertools.count()  # Keeps jobs of equal priority in submission order
+        self.capacity = threading.BoundedSemaphore(max_queued or 4 * concurrency)
+        self.busy_seconds = 0.0  # Time the threads spent running jobs, see idle_fraction()
+        self.started = time.perf_counter()
+        self.busy_lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(concurrency)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, fn: Callable, *args, priority: int = 0) -> Future:
+        """Queue fn(*args) and return a future for its result. Blocks while the queue is full."""
+        self.capacity.acquire()
+        future = Future()
+        self.jobs.put((priority, next(self.sequence), tracing.queued(fn), args, future, 0))
+        return future
+
+    def map(self, fn: Callable, items: Iterable, priority: int = 0) -> List:
+        """Run fn(item) for all items and return the results in order. Raises the first failure."""
+        futures = [self.submit(fn, item, priority=priority) for item in items]
+        return [future.result() for future in futures]
+
+    def _work(self) -> None:
+        while True:
+            priority, sequence, fn, args, future, attempt = self.jobs.get()
+            if fn is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                self.capacity.release()
+                continue
+            start = time.perf_counter()
+            outcome = Future()
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                outcome.set_exception(e)
+            else:
+                if isinstance(result, Future):
+                    # An asynchronous job: the thread moves on, and the job finishes when its future does
+                    outcome = result
+                else:
+                    outcome.set_result(result)
+            finally:
+                with self.busy_lock:
+                    self.busy_seconds += time.perf_counter() - start
+            job = (priority, sequence, fn, args, future, attempt)
+            outcome.add_done_callback(lambda done, job=job: self._finish(job, done))
+
+    def _finish(self, job: tuple, outcome: Future) -> None:
+        """Pass the outcome of a job on to its future, or requeue the job if it failed transiently."""
+        priority, sequence, fn, args, future, attempt = job
+        exception = outcome.exception()
+        if isinstance(exception, TransientMatchError) and attempt < self.retries:
+            print(f"{timestamp()} Retrying failed match ({exception}), attempt {attempt + 2}")
+            # Retries jump the queue so a flaky match doesn't hold up its tournament round
+            self.jobs.put((priority - 1, sequence, fn, args, _RetryFuture(future), attempt + 1))
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(outcome.result())
+        self.capacity.release()
+
+    def idle_fraction(self) -> float:
+        """Fraction of the threads' time since the scheduler started that no job was running."""
+        with self.busy_lock:
+            busy = self.busy_seconds
+        available = self.concurrency * (time.perf_counter() - self.started)
+        return max(0.0, 1 - busy / available) if available else 0.0
+
+    def shutdown(self) -> None:
+        for _ in self.threads:
+            self.jobs.put((float("inf"), next(self.sequence), None, (), None, 0))
+        for thread in self.threads:
+            thread.join()
+
+
+class _RetryFuture:
+    """Wraps a future that is already running so a retried job doesn't try to start it a second time."""
+
+    def __init__(self, future: Future):
+        self.future = future
+
+    def set_running_or_notify_cancel(self) -> bool:
+        return True
+
+    def set_result(self, result) -> None:
+        self.future.set_result(result)
+
+    def set_exception(self, exception) -> None:
+        self.future.set_exception(exception)
+
+
+def completed(result) -> Future:
+    """Return a future that is already done with the given result."""
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def then(future: Future, fn: Callable) -> Future:
+    """
+    Return a future for fn(result of future) without waiting for it. fn runs in the thread that completes the
+    future, or right away if it is done. If fn returns a future, the returned future takes on its outcome.
+    Exceptions are passed on.
+    """
+    chained = Future()
+
+    def settle(done: Future) -> None:
+        if done.exception() is not None:
+            chained.set_exception(done.exception())
+        else:
+            chained.set_result(done.result())
+
+    def resolve(done: Future) -> None:
+        try:
+            result = fn(done.result())
+        except BaseException as e:
+            chained.set_exception(e)
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(settle)
+        else:
+            chained.set_result(result)
+
+    future.add_done_callback(resolve)
+    return chained
+
+
+_scheduler: Optional[MatchScheduler] = None
+_scheduler_lock = threading.Lock()
+_concurrency: Optional[int] = None
+_heap_mb = DEFAULT_JVM_HEAP_MB
+_retries = DEFAULT_RETRIES
+
+
+def configure_scheduler(concurrency: Optional[int] = None, heap_mb: int = DEFAULT_JVM_HEAP_MB,
+                        retries: int = DEFAULT_RETRIES) -> None:
+    """
+    Configure the shared match scheduler. Takes effect the next time get_scheduler() creates it.
+
+    :param concurrency: Maximum number of concurrent matches (default: derived from the CPU and memory budget)
+    :param heap_mb: Heap budget per match JVM in MB
+    :param retries: How often a match failing with a transient error is retried
+    """
+    global _concurrency, _heap_mb, _retries
+    shutdown_scheduler()
+    _concurrency = concurrency
+    _heap_mb = heap_mb
+    _retries = retries
+
+
+def get_scheduler() -> MatchScheduler:
+    """Return the shared match scheduler, starting it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            concurrency = _concurrency or default_concurrency(_heap_mb)
+            print(f"{timestamp()} Starting match scheduler with {concurrency} concurrent matches")
+            _scheduler = MatchScheduler(concurrency, _retries)
+        return _scheduler
+
+
+def shutdown_scheduler() -> None:
+    """Stop the threads of the shared scheduler."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.shutdown()
+            _scheduler = None
@@ -0,0 +1,192 @@
+"""
+Surrogate fitness: a cheap estimate of a genome's strength from the structure of its Mutatable trees, used to
+screen offspring before they cost a Battlecode game.
+
+A genome is described by a few counts (see FEATURES): its lines, the actions that can actually run, lines that
+can't run because of a constant condition (e.g. GameConstants.SETUP_ROUNDS != GameConstants.SETUP_ROUNDS, see
+normalize.condition_value), and the kinds of reachable actions. A logistic model on the difference of two
+genomes' features predicts which one wins a match; it is trained on every tournament match.
+"""
+import math
+import random
+from typing import List, Optional, Tuple
+
+from src.genome_cache import genome_hash
+from src.mutatable import Mutatable, _skip, type_ids
+from src.normalize import ACTION_KINDS, _body, action_kinds, condition_value
+from src.util import timestamp
+
+FEATURES = ["lines", "reachable actions", "dead lines", "constant conditions", "max depth"] + \
+           [f"{kind.lower()} actions" for kind in ACTION_KINDS]
+
+
+def _analyze(nodes, position: int, reachable: bool, depth: int, counts: List[float]) -> Tuple[int, bool]:
+    """Count the features of the subtree at position. Returns the position after it and whether it can act."""
+    template_id = nodes[position]
+    if template_id in action_kinds:
+        if reachable:
+            counts[1] += 1
+            for kind in action_kinds[template_id]:
+                counts[5 + kind] += 1
+        return _skip(nodes, position), reachable
+    value = condition_value(nodes, position)
+    if value is not None:
+        counts[3] += 1
+    counts[4] = max(counts[4], depth + 1)
+    return _analyze(nodes, _body(nodes, position), reachable and value is not False, depth + 1, counts)
+
+
+def genome_features(code: List[Mutatable]) -> List[float]:
+    """Features of a genome, in the order of FEATURES."""
+    counts = [0.0] * len(FEATURES)
+    counts[0] = len(code)
+    for line in code:
+        if line.nodes[0] != type_ids["action"]:
+            continue
+        _, acts = _analyze(line.nodes, 1, True, 0, counts)
+        if not acts:
+            counts[2] += 1
+    return counts
+
+
+def is_viable(features: List[float]) -> bool:
+    """Whether a genome can move at all. Bots that can't move can't capture flags and lose by default."""
+    return features[FEATURES.index("move actions")] > 0
+
+
+class Surrogate:
+    """
+    Logistic model of match outcomes on genome features, and the statistics of screening with it.
+
+    The model scores a genome as the dot product of its scaled features with the weights; the probability that
+    a genome beats another is the logistic function of their score difference. It is refit by stochastic gradient
+    descent on the latest `history` matches after every tournament.
+    """
+
+    def __init__(self, oversample: float = 2.0, audit: float = 0.1, history: int = 5000, min_matches: int = 40):
+        self.oversample = oversample
+        self.audit = audit
+        self.history = history
+        self.min_matches = min_matches
+        self.examples: List[List[float]] = []  # Feature differences winner - loser
+        self.weights = [0.0] * len(FEATURES)
+        self.scales = [1.0] * len(FEATURES)
+        self.rng = random.Random(0)  # Own RNG so the evolution's random state isn't touched by fitting
+        # Screening statistics
+        self.candidates = 0
+        self.rejected = 0
+        self.not_viable = 0
+        self.kept: set = set()  # Hashes of offspring the model chose
+        self.audited: set = set()  # Hashes of rejected offspring that were evaluated anyway
+        self.correct = 0
+        self.predicted = 0
+        self.wins = {"kept": [0, 0], "audited": [0, 0]}  # Wins and matches
+
+    def trained(self) -> bool:
+        return len(self.examples) >= self.min_matches
+
+    def score(self, features: List[float]) -> float:
+        return sum(w * f / s for w, f, s in zip(self.weights, features, self.scales))
+
+    def fit(self, epochs: int = 5, learning_rate: float = 0.1, l2: float = 1e-3) -> None:
+        examples = self.examples[-self.history:]
+        self.scales = [max(1.0, sum(abs(x[i]) for x in examples) / len(examples)) for i in range(len(FEATURES))]
+        scaled = [[f / s for f, s in zip(x, self.scales)] for x in examples]
+        weights = self.weights
+        for _ in range(epochs):
+            self.rng.shuffle(scaled)
+            for x in scaled:
+                margin = sum(w * f for w, f in zip(weights, x))
+                # Gradient of log(1 + exp(-margin)): the winner's score should exceed the loser's
+                gradient = -1 / (1 + math.exp(min(50.0, margin)))
+                weights = [w - learning_rate * (gradient * f + l2 * w) for w, f in zip(weights, x)]
+        self.weights = weights
+
+    def observe(self, matches: List[Tuple[List[Mutatable], List[Mutatable]]]) -> None:
+        """
+        Learn from the matches of a tournament, given as (winner code, loser code).
+        Before the model is refit, its predictions for these matches are counted towards its accuracy.
+        """
+        for winner, loser in matches:
+            winner_features, loser_features = genome_features(winner), genome_features(loser)
+            if self.trained():
+                self.predicted += 1
+                self.correct += self.score(winner_features) > self.score(loser_features)
+            for code, won in ((winner, 1), (loser, 0)):
+                hash = genome_hash(code)
+                group = "kept" if hash in self.kept else "audited" if hash in self.audited else None
+                if group is not None:  # Only their first match counts, not later ones as elites
+                    self.wins[group][0] += won
+                    self.wins[group][1] += 1
+                    self.kept.discard(hash)
+                    self.audited.discard(hash)
+            self.examples.append([w - l for w, l in zip(winner_features, loser_features)])
+        del self.examples[:-self.history]
+        if self.examples:
+            self.fit()
+
+    def screen(self, candidates: List[List[Mutatable]], number: int) -> List[int]:
+        """
+        Pick `number` of the candidates to evaluate: viable ones before those that can't move, and among those
+        the best by the model once it is trained. A fraction `audit` of the picks are random rejected
+        candidates, so the cost of screening can be measured.
+
+        :return: Indices of the picked candidates
+        """
+        features = [genome_features(code) for code in candidates]
+        viable = [is_viable(f) for f in features]
+        trained = self.trained()
+        order = sorted(range(len(candidates)),
+                       key=lambda i: (not viable[i], -self.score(features[i]) if trained else 0))
+        audited = int(number * self.audit) if trained else 0
+        picked, rejected = order[:number - audited], order[number - audited:]
+        audit_picks = random.sample([i for i in rejected if viable[i]] or rejected, min(audited, len(rejected)))
+        picked += audit_picks
+        self.candidates += len(candidates)
+        self.rejected += len(candidates) - len(picked)
+        self.not_viable += sum(not viable[i] for i in rejected if i not in audit_picks)
+        self.kept.update(genome_hash(candidates[i]) for i in picked[:number - audited])
+        self.audited.update(genome_hash(candidates[i]) for i in audit_picks)
+        return picked
+
+    def report(self) -> str:
+        accuracy = f"{100 * self.correct / self.predicted:.1f}% of {self.predicted} matches predicted" \
+            if self.predicted else "no predictions yet"
+        (kept_wins, kept_games), (audit_wins, audit_games) = self.wins["kept"], self.wins["audited"]
+        kept = f"{100 * kept_wins / kept_games:.1f}%" if kept_games else "-"
+        audited = f"{100 * audit_wins / audit_games:.1f}%" if audit_games else "-"
+        return (f"{self.rejected} of {self.candidates} offspring screened out ({self.not_viable} can't move), "
+                f"{self.rejected // 2} matches saved; {accuracy}; "
+                f"win rate of kept offspring {kept}, of audited rejects {audited}")
+
+
+_surrogate: Optional[Surrogate] = None
+_oversample = 2.0
+_audit = 0.1
+_enabled = True
+
+
+def configure_surrogate(oversample: float = 2.0, audit: float = 0.1, enabled: bool = True) -> None:
+    """
+    Configure offspring screening. Takes effect the next time get_surrogate() creates the model.
+
+    :param oversample: Candidates bred per offspring slot
+    :param audit: Fraction of the slots given to random rejected candidates, to measure the cost of screening
+    :param enabled: If False, get_surrogate() returns None and every offspring is evaluated
+    """
+    global _surrogate, _oversample, _audit, _enabled
+    _surrogate = None
+    _oversample = oversample
+    _audit = audit
+    _enabled = enabled
+
+
+def get_surrogate() -> Optional[Surrogate]:
+    """Return the shared surrogate model, or None if screening is disabled."""
+    global _surrogate
+    if not _enabled:
+        return None
+    if _surrogate is None:
+        _surrogate = Surrogate(_oversample, _audit)
+        print(f"{timestamp()} Screening offspring with a surrogate model ({_oversample:g} candidates per slot)")
+    return _surrogate
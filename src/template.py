@@ -53,6 +53,9 @@ public strictfp class RobotPlayer {
             // loop. If we ever leave this loop and return from run(), the robot dies! At the end of the
             // loop, we call Clock.yield(), signifying that we've done everything we want to do.
 
+            // A turn that runs out of bytecodes is continued in the next round, so remember where it started.
+            int turnStart = rc.getRoundNum();
+
             // Try/catch blocks stop unhandled exceptions, which cause your robot to explode.
             try {
                 // Make sure you spawn your robot in before you attempt to take any actions!
@@ -88,16 +91,20 @@ public strictfp class RobotPlayer {
                 // Oh no! It looks like we did something illegal in the Battlecode world. You should
                 // handle GameActionExceptions judiciously, in case unexpected events occur in the game
                 // world. Remember, uncaught exceptions cause your robot to explode!
+                profileExceptions++;
                 System.out.println("GameActionException");
                 e.printStackTrace();
 
             } catch (Exception e) {
                 // Oh no! It looks like our code tried to do something bad. This isn't a
                 // GameActionException, so it's more likely to be a bug in our code.
+                profileExceptions++;
                 System.out.println("Exception");
                 e.printStackTrace();
 
             } finally {
+                reportState(rc);
+                profileTurn(rc, turnStart);
                 // Signify we've done everything we want to do, thereby ending our turn.
                 // This will make our code wait until the next turn, and then perform this loop again.
                 Clock.yield();
@@ -108,6 +115,48 @@ public strictfp class RobotPlayer {
         // Your code should never reach here (unless it's intentional)! Self-destruction imminent...
     }
     
+    /** Bytecode profile of this robot, reported to the match worker every PROFILE_INTERVAL turns. */
+    static final int PROFILE_INTERVAL = 50;
+    static int profileTurns = 0;
+    static long profileBytecodes = 0;
+    static int profileMaxBytecodes = 0;
+    static int profileOverBudget = 0;
+    static int profileExceptions = 0;  // Exceptions caught by run(), counted where they are caught
+
+    /** Count the bytecodes of a turn that started in round turnStart and print the totals periodically. */
+    static void profileTurn(RobotController rc, int turnStart) {
+        int limit = Clock.getBytecodeNum() + Clock.getBytecodesLeft();
+        int overflow = rc.getRoundNum() - turnStart;  // Rounds the turn spilled into after exhausting its budget
+        int used = overflow * limit + Clock.getBytecodeNum();
+        profileTurns++;
+        profileBytecodes += used;
+        profileMaxBytecodes = Math.max(profileMaxBytecodes, used);
+        if (overflow > 0) profileOverBudget++;
+        if (profileTurns % PROFILE_INTERVAL == 0) {
+            System.out.println("@@PROFILE " + profileTurns + " " + profileBytecodes + " " + profileMaxBytecodes
+                    + " " + profileOverBudget + " " + profileExceptions);
+        }
+    }
+
+    /** Game state of this robot, reported every STATE_INTERVAL rounds to adjudicate truncated games. */
+    static final int STATE_INTERVAL = 50;
+    static int flagsCaptured = 0;
+    static boolean heldFlag = false;
+
+    /** Count captured flags and print the robot's state periodically. */
+    static void reportState(RobotController rc) {
+        boolean spawned = rc.isSpawned();
+        boolean hasFlag = spawned && rc.hasFlag();
+        // A flag that is gone while standing in an ally spawn zone was captured
+        if (heldFlag && !hasFlag && spawned
+                && Arrays.asList(rc.getAllySpawnLocations()).contains(rc.getLocation())) flagsCaptured++;
+        heldFlag = hasFlag;
+        if (rc.getRoundNum() % STATE_INTERVAL == 0) {
+            System.out.println("@@STATE " + flagsCaptured + " " + (hasFlag ? 1 : 0) + " " + (spawned ? 1 : 0) + " "
+                    + (spawned ? rc.getHealth() : 0) + " " + rc.getCrumbs());
+        }
+    }
+
     public static void tryPickupFlag(RobotController rc) throws GameActionException{
         FlagInfo[] flags = rc.senseNearbyFlags(2, rc.getTeam().opponent());
         for (FlagInfo flag : flags) {
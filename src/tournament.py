@@ -1,19 +1,62 @@
+import math
+import threading
 from collections import deque
-from typing import List, Tuple
-from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 
-from src.battlecode_runner import run_battlecode
-from src.util import timestamp
+from src.battlecode_runner import bot_genome, class_locations, start_battlecode_batch
+from src import tracing
+from src.match_result import MatchResult
+from src.match_server import get_pool, read_gradle_properties
+from src.profiling import record_match
+from src.ratings import get_rating_store, information
+from src.result_store import get_result_store
+from src.scheduler import completed, get_scheduler, then
+from src.util import timestamp, analyze_result, analyze_games
 
-def run_battle(bot1: str, bot2: str) -> Tuple[str, str]:
+def run_battle(bot1: str, bot2: str, map_name: Optional[str] = None, seed: int = 0) -> Tuple[str, str]:
     """
     Run a single battle between two bots.
     Returns the winner and loser.
+
+    :param map_name: Map to play on (default: the first map of the 'maps' gradle property)
+    :param seed: Replicate index, to play the same pairing on the same map more than once
     """
-    print(f"{timestamp()} Running battle: {bot1} vs {bot2}")
-    result = run_battlecode(bot1, bot2)
+    return start_battle(bot1, bot2, map_name, seed).result()
+
+
+def start_battle(bot1: str, bot2: str, map_name: Optional[str] = None, seed: int = 0) -> Future:
+    """Start a battle like run_battle and return a future for the winner and loser, see start_pairing."""
+    if map_name is None:
+        map_name = default_maps()[0]
+    store = get_result_store()
+    if store is not None:
+        key = store.key(bot_genome(bot1), bot_genome(bot2), map_name, seed)
+        result = store.lookup(key)
+    else:
+        key, result = None, None
+
+    if result is not None:
+        print(f"{timestamp()} Reusing stored result: {bot1} vs {bot2} on {map_name}")
+        return completed(battle_winner(bot1, bot2, result))
+
+    print(f"{timestamp()} Running battle: {bot1} vs {bot2} on {map_name}")
+    overrides = class_locations(bot1, bot2)
+    overrides.update({"maps": map_name, "seed": str(seed)})
+    start = tracing.now()
 
-    # Determine winner based on battle results
+    def finish(match_results: List[Optional[MatchResult]]) -> Tuple[str, str]:
+        tracing.complete("battle", "match", start, bot1=bot1, bot2=bot2, map=map_name, seed=seed)
+        record_match(bot1, bot2, match_results[0])
+        result = analyze_result(match_results[0])
+        if store is not None:
+            store.record(key, result)
+        return battle_winner(bot1, bot2, result)
+    return then(get_pool().submit_batch([(bot1, bot2, overrides)]), finish)
+
+
+def battle_winner(bot1: str, bot2: str, result: int) -> Tuple[str, str]:
+    """Winner and loser of a battle in which bot 1 was team A, from its result."""
     if result == 1:
         print(f"{timestamp()} Battle finished: {bot1} won vs {bot2}")
         return bot1, bot2
@@ -21,85 +64,236 @@ def run_battle(bot1: str, bot2: str) -> Tuple[str, str]:
         print(f"{timestamp()} Battle finished: {bot2} won vs {bot1}")
         return bot2, bot1
 
-def run_double_elimination_tournament(names: List[str]) -> List[str]:
+
+def default_maps() -> List[str]:
+    """Maps of the 'maps' gradle property, which may be a comma-separated list."""
+    maps = read_gradle_properties().get("maps", "DefaultSmall")
+    return [map_name.strip() for map_name in maps.split(",") if map_name.strip()]
+
+
+# Evaluation settings of run_pairing, see configure_evaluation
+_evaluation_maps: Optional[List[str]] = None
+_evaluation_seeds: List[int] = [0]
+_alpha = 0.05
+_series_lock = threading.Lock()
+_series_games_played = 0
+_series_games_scheduled = 0
+_equivalent_pairings = 0
+_swiss_rounds: Optional[int] = None
+
+WAVE_GAMES = 4  # Most games of a series played between two checks of the stopping rule
+
+
+def configure_evaluation(maps: Optional[List[str]] = None, seeds: int = 1, alpha: float = 0.05) -> None:
     """
-    Run a double-elimination tournament in parallel and return the final rankings.
+    Configure how tournaments decide a pairing.
+
+    :param maps: Maps every pairing is played on (default: the 'maps' gradle property)
+    :param seeds: Number of games per map
+    :param alpha: Significance level at which a series is stopped early
     """
-    # Initialize brackets
-    winners_bracket = deque(names)
-    losers_bracket = deque()
-    eliminated = []
+    global _evaluation_maps, _evaluation_seeds, _alpha
+    _evaluation_maps = maps
+    _evaluation_seeds = list(range(seeds))
+    _alpha = alpha
 
-    with ThreadPoolExecutor() as executor:
-        # While there is more than one bot remaining
-        while len(winners_bracket) + len(losers_bracket) > 1:
-            print(f"Current Winners Bracket: {list(winners_bracket)}")
-            print(f"Current Losers Bracket: {list(losers_bracket)}")
 
-            # Break if no actual matches remain to prevent infinite loops
-            if len(winners_bracket) <= 1 and len(losers_bracket) <= 1:
-                break
+def configure_swiss(rounds: Optional[int] = None) -> None:
+    """
+    Rank generations by a Swiss-system tournament (see run_swiss_tournament).
 
-            # Winners' bracket matches
-            winner_pairs = []
-            bye_bot = None
+    :param rounds: Number of rounds, 0 for ceil(log2(population size)), None to rank by other tournaments
+    """
+    global _swiss_rounds
+    _swiss_rounds = rounds
 
-            # Pair bots for the current round
-            while len(winners_bracket) > 1:
-                bot1 = winners_bracket.popleft()
-                bot2 = winners_bracket.popleft()
-                winner_pairs.append((bot1, bot2))
 
-            # Handle odd number of bots: the last bot gets a bye
-            if len(winners_bracket) == 1:
-                bye_bot = winners_bracket.popleft()
+def swiss_rounds() -> Optional[int]:
+    """Configured number of Swiss rounds, 0 for the default, or None if generations aren't ranked that way."""
+    return _swiss_rounds
 
-            # Run the matches
-            winner_results = list(executor.map(lambda pair: run_battle(*pair), winner_pairs))
 
-            # Add match results to the next round
-            for winner, loser in winner_results:
-                winners_bracket.append(winner)
-                losers_bracket.append(loser)
+def binomial_p_value(wins: int, games: int) -> float:
+    """Two-sided p-value of winning `wins` of `games` games if both bots were equally strong."""
+    extreme = max(wins, games - wins)
+    tail = sum(math.comb(games, k) for k in range(extreme, games + 1)) / 2 ** games
+    return min(1.0, 2 * tail)
+
 
-            # If a bot got a bye, it advances to the next round
-            if bye_bot:
-                print(f"{timestamp()} {bye_bot} advances due to a bye.")
-                winners_bracket.append(bye_bot)
+def start_wave(bot1: str, bot2: str, games: List[Tuple[int, str]], seed: int) -> Future:
+    """
+    Start games of a series in one batch and return a future for their winners in order.
+    Bot 1 is team A in games with an even index and team B otherwise. Games in the result store are not played
+    again; the rest go to a single worker JVM as one server run per side.
 
-            # Losers' bracket matches
-            loser_pairs = []
-            next_round_losers = deque()
+    :param games: (index within the series, map) of every game
+    :param seed: Replicate index of the games
+    """
+    store = get_result_store()
+    sides = [(bot1, bot2) if i % 2 == 0 else (bot2, bot1) for i, _ in games]
+    keys = [store.key(bot_genome(a), bot_genome(b), map_name, seed) if store is not None else None
+            for (a, b), (_, map_name) in zip(sides, games)]
+    results = [store.lookup(key) if store is not None else None for key in keys]
 
-            while len(losers_bracket) > 1:
-                bot1 = losers_bracket.popleft()
-                bot2 = losers_bracket.popleft()
-                loser_pairs.append((bot1, bot2))
+    def winners(_=None) -> List[str]:
+        return [a if result == 1 else b for (a, b), result in zip(sides, results)]
 
-            loser_results = list(executor.map(lambda pair: run_battle(*pair), loser_pairs))
+    missing = {}  # side -> indices of the games it still has to play
+    for j, side in enumerate(sides):
+        if results[j] is None:
+            missing.setdefault(side, []).append(j)
+    if not missing:
+        print(f"{timestamp()} Reusing stored results: {bot1} vs {bot2}")
+        return completed(winners())
+    print(f"{timestamp()} Running {sum(len(j) for j in missing.values())} battles: {bot1} vs {bot2}")
+    maps = [[games[j][1] for j in indices] for indices in missing.values()]
+    start = tracing.now()
 
-            for winner, loser in loser_results:
-                next_round_losers.append(winner)
-                eliminated.append(loser)
+    def finish(match_results: List[Optional[MatchResult]]) -> List[str]:
+        tracing.complete("wave", "match", start, bot1=bot1, bot2=bot2,
+                         games=sum(len(j) for j in missing.values()), seed=seed)
+        for (team_a, team_b), indices, match_result in zip(missing, missing.values(), match_results):
+            record_match(team_a, team_b, match_result)
+            for j, result in zip(indices, analyze_games(match_result, len(indices))):
+                results[j] = result
+                if store is not None:
+                    store.record(keys[j], result)
+        return winners()
+    return then(start_battlecode_batch(list(missing), maps, seed), finish)
+
+
+def run_series(bot1: str, bot2: str, maps: List[str], seeds: List[int], alpha: float = 0.05) -> Tuple[str, str]:
+    """
+    Play a pairing over all combinations of maps and seeds with sequential early stopping.
+    The bots swap sides every game. Games are played in waves of up to WAVE_GAMES maps of one seed, each wave in
+    a single worker JVM. After every wave, the series stops as soon as one bot has won the majority of all
+    scheduled games, or the win count is significant at level alpha.
+    Returns the winner and loser; ties go to the winner of the first game.
+    """
+    return start_series(bot1, bot2, maps, seeds, alpha).result()
+
+
+def start_series(bot1: str, bot2: str, maps: List[str], seeds: List[int], alpha: float = 0.05) -> Future:
+    """Start a series like run_series and return a future for the winner and loser, see start_pairing."""
+    games = [(map_name, seed) for seed in seeds for map_name in maps]
+    # Waves never mix seeds, and are small enough that a single seed over many maps can still stop early
+    waves = [(start, min(start + WAVE_GAMES, seed_start + len(maps)))
+             for seed_start in range(0, len(games), len(maps))
+             for start in range(seed_start, seed_start + len(maps), WAVE_GAMES)]
+    winners = []
+
+    def play(wave: int) -> Future:
+        start, end = waves[wave]
+        return then(start_wave(bot1, bot2, [(i, games[i][0]) for i in range(start, end)], games[start][1]),
+                    lambda wave_winners: count(wave, wave_winners))
+
+    def count(wave: int, wave_winners: List[str]):
+        global _series_games_played, _series_games_scheduled
+        winners.extend(wave_winners)
+        wins1 = winners.count(bot1)
+        wins2 = len(winners) - wins1
+        played = len(winners)
+        decided = max(wins1, wins2) > len(games) / 2 or (played < len(games)
+                                                          and binomial_p_value(wins1, played) < alpha)
+        if wave + 1 < len(waves) and not decided:
+            return play(wave + 1)
+        with _series_lock:
+            _series_games_played += played
+            _series_games_scheduled += len(games)
+        if wins1 > wins2 or (wins1 == wins2 and winners[0] == bot1):
+            return bot1, bot2
+        return bot2, bot1
+    return play(0)
+
+
+def run_pairing(bot1: str, bot2: str) -> Tuple[str, str]:
+    """
+    Decide a pairing as configured by configure_evaluation: a single game or an early-stopping series.
+    Bots with the same normalized code are equally strong, so their pairing goes to bot 1 without a game.
+    """
+    return start_pairing(bot1, bot2).result()
+
+
+def start_pairing(bot1: str, bot2: str) -> Future:
+    """
+    Start deciding a pairing like run_pairing and return a future for the winner and loser.
+    This is what tournaments submit to the scheduler: with the asyncio engine, the scheduler thread only looks up
+    stored results and starts the matches, and the rest of the pairing (recording results, the next wave of a
+    series) runs when the matches finish. Other engines play the matches in the calling thread, and the future is
+    done when this returns.
+    """
+    global _equivalent_pairings
+    if bot_genome(bot1) == bot_genome(bot2):
+        with _series_lock:
+            _equivalent_pairings += 1
+        print(f"{timestamp()} Skipping battle between equivalent bots: {bot1} vs {bot2}")
+        return completed((bot1, bot2))
+    maps = _evaluation_maps or default_maps()
+    if len(maps) == 1 and len(_evaluation_seeds) == 1:
+        return start_battle(bot1, bot2, maps[0], _evaluation_seeds[0])
+    return start_series(bot1, bot2, maps, _evaluation_seeds, _alpha)
 
-            # If one bot remains in losers, keep it for next round
-            if losers_bracket:
-                next_round_losers.append(losers_bracket.popleft())
 
-            losers_bracket = next_round_losers
+def series_report() -> str:
+    """Games played by series so far, and how many early stopping saved."""
+    with _series_lock:
+        played, scheduled = _series_games_played, _series_games_scheduled
+    saved = 100 * (scheduled - played) / scheduled if scheduled else 0
+    return f"{played} of {scheduled} games played ({saved:.1f}% saved by early stopping)"
 
-    # Final match between last winner and last loser
+
+def equivalent_pairings() -> int:
+    """Number of pairings decided without a game because both bots had the same normalized code."""
+    with _series_lock:
+        return _equivalent_pairings
+
+
+def run_double_elimination_tournament(names: List[str]) -> List[str]:
+    """
+    Run a double-elimination tournament in parallel and return the final rankings.
+    Brackets advance as soon as results come in instead of waiting for whole rounds: whenever two bots are
+    waiting in the same bracket, their match is submitted to the scheduler.
+    """
+    scheduler = get_scheduler()
+
+    # Initialize brackets
+    winners_bracket = deque(names)
+    losers_bracket = deque()
+    eliminated = []
+    running = {}  # future -> bracket the match belongs to
+
+    def pair_up(bracket: deque, label: str) -> None:
+        while len(bracket) > 1:
+            bot1 = bracket.popleft()
+            bot2 = bracket.popleft()
+            running[scheduler.submit(start_pairing, bot1, bot2)] = label
+
+    pair_up(winners_bracket, "winners")
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            winner, loser = future.result()
+            if running.pop(future) == "winners":
+                winners_bracket.append(winner)
+                losers_bracket.append(loser)
+            else:
+                losers_bracket.append(winner)
+                eliminated.append(loser)
+        pair_up(winners_bracket, "winners")
+        pair_up(losers_bracket, "losers")
+        print(f"Current Winners Bracket: {list(winners_bracket)}")
+        print(f"Current Losers Bracket: {list(losers_bracket)}")
+
+    # Final match between last winner and last loser, ahead of anything else in the scheduler's queue
     if len(winners_bracket) == 1 and len(losers_bracket) == 1:
         final_winner = winners_bracket.popleft()
         last_loser = losers_bracket.popleft()
 
-        final_result = run_battle(final_winner, last_loser)
-        winner, loser = final_result
+        winner, loser = scheduler.submit(start_pairing, final_winner, last_loser, priority=-1).result()
 
         if winner == last_loser:  # Loser bracket's finalist wins the first match
             print(f"{timestamp()} Running a second match for the double-elimination final.")
-            final_result = run_battle(final_winner, last_loser)  # Second match
-            winner, loser = final_result
+            winner, loser = scheduler.submit(start_pairing, final_winner, last_loser, priority=-1).result()
 
         final_winner = winner
         eliminated.append(loser)
@@ -121,11 +315,125 @@ def run_one_game_tournament(names: List[str]) -> List[str]:
     losers = []
     pairs = [(names[i], names[i+1]) for i in range(0, len(names), 2)]
 
-    with ThreadPoolExecutor() as executor:
-        results = list(executor.map(lambda pair: run_battle(*pair), pairs))
+    results = get_scheduler().map(lambda pair: start_pairing(*pair), pairs)
 
     for winner, loser in results:
         winners.append(winner)
         losers.append(loser)
 
     return winners + losers
+
+
+def one_game_matches(rankings: List[str]) -> List[Tuple[str, str]]:
+    """(winner, loser) of every game of a one-game tournament, from its rankings."""
+    half = len(rankings) // 2
+    return list(zip(rankings[:half], rankings[half:]))
+
+
+def run_rating_tournament(names: List[str], games: int, cut: Optional[int] = None,
+                          z: float = 1.0) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """
+    Rank bots by their ratings in the rating store (see ratings.py), playing only the games that tell the most
+    about which bots are selected.
+
+    Ratings persist across generations, so elites start from the estimate of all their earlier games and only new
+    bots start from the prior. Games are played in rounds. In every round, each bot whose side of the selection
+    cut is still undecided (the cut is within z standard deviations of its skill) is paired with the opponent
+    that makes the most informative game, preferring opponents it hasn't met. With the result store on, bots are
+    never paired with an opponent they met before, since the stored result would be counted again. Rounds continue
+    until every bot's side of the cut is decided, the game budget is spent or no bot can be paired.
+
+    :param games: Game budget
+    :param cut: Number of bots that are selected (default: half of them)
+    :return: The names ordered by rating, best first, and (winner, loser) of every game
+    """
+    store = get_rating_store()
+    scheduler = get_scheduler()
+    cut = len(names) // 2 if cut is None else cut
+    genomes = {name: bot_genome(name) for name in names}
+    matches = []
+    # A rematch would be served from the result store, and the same stored outcome isn't new evidence
+    rematches = get_result_store() is None
+
+    def rate() -> Tuple[dict, List[str], List[str]]:
+        """Current ratings, the names ordered by rating and the bots whose side of the cut is undecided."""
+        ratings = {name: store.get(genomes[name]) for name in names}
+        ranked = sorted(names, key=lambda name: -ratings[name].mu)
+        if not 0 < cut < len(names):
+            return ratings, ranked, []
+        boundary = (ratings[ranked[cut - 1]].mu + ratings[ranked[cut]].mu) / 2
+        return ratings, ranked, [name for name in ranked if abs(ratings[name].mu - boundary) < z * ratings[name].sigma]
+
+    ratings, ranked, undecided = rate()
+    while undecided and len(matches) < games:
+        pairs = []
+        paired = set()
+        for name in sorted(undecided, key=lambda name: -ratings[name].sigma):
+            if name in paired or len(matches) + len(pairs) >= games:
+                continue
+            opponents = [other for other in names if other not in paired and genomes[other] != genomes[name]
+                         and (rematches or not store.played(genomes[name], genomes[other]))]
+            if not opponents:
+                continue
+            opponent = max(opponents, key=lambda other: (not store.played(genomes[name], genomes[other]),
+                                                         information(ratings[name], ratings[other])))
+            pairs.append((name, opponent))
+            paired.update((name, opponent))
+        if not pairs:
+            break
+        for winner, loser in scheduler.map(lambda pair: start_pairing(*pair), pairs):
+            store.record(genomes[winner], genomes[loser])
+            matches.append((winner, loser))
+        ratings, ranked, undecided = rate()
+    print(f"{timestamp()} Rating tournament: {len(matches)} of {games} games played, "
+          f"{len(undecided)} of {len(names)} bots undecided at the cut")
+    return ranked, matches
+
+
+def run_swiss_tournament(names: List[str], rounds: int = 0) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """
+    Rank bots by a Swiss-system tournament: every round pairs bots with equal or similar scores, and all games of a
+    round are submitted to the scheduler at once. Going down the standings, every bot is paired with the next bot
+    it hasn't met yet, if there is one. With an odd number of bots, the lowest ranked bot without a bye so far
+    gets a bye, which counts as a win.
+    Ties in the final ranking are broken by Buchholz (the sum of the opponents' scores), then by
+    Sonneborn-Berger (the sum of the scores of the beaten opponents), then by the order of names.
+
+    :param rounds: Number of rounds (default: ceil(log2(len(names))), enough to separate all bots)
+    :return: The names ordered by rank, best first, and (winner, loser) of every game
+    """
+    rounds = rounds or max(1, math.ceil(math.log2(max(2, len(names)))))
+    scheduler = get_scheduler()
+    points = {name: 0 for name in names}
+    opponents = {name: [] for name in names}
+    beaten = {name: [] for name in names}
+    had_bye = set()
+    matches = []
+
+    def standings() -> List[str]:
+        def tiebreaks(name: str) -> Tuple[int, int, int]:
+            return (points[name], sum(points[opponent] for opponent in opponents[name]),
+                    sum(points[opponent] for opponent in beaten[name]))
+        return sorted(names, key=tiebreaks, reverse=True)  # sorted is stable, so the order of names breaks ties
+
+    for round_number in range(1, rounds + 1):
+        unpaired = standings()
+        if len(unpaired) % 2 == 1:
+            bye = next((name for name in reversed(unpaired) if name not in had_bye), unpaired[-1])
+            unpaired.remove(bye)
+            had_bye.add(bye)
+            points[bye] += 1
+        pairs = []
+        while unpaired:
+            bot1 = unpaired.pop(0)
+            bot2 = next((name for name in unpaired if name not in opponents[bot1]), unpaired[0])
+            unpaired.remove(bot2)
+            pairs.append((bot1, bot2))
+        for winner, loser in scheduler.map(lambda pair: start_pairing(*pair), pairs):
+            points[winner] += 1
+            opponents[winner].append(loser)
+            opponents[loser].append(winner)
+            beaten[winner].append(loser)
+            matches.append((winner, loser))
+        print(f"{timestamp()} Swiss round {round_number} of {rounds}: {len(pairs)} games")
+    return standings(), matches
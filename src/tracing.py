@@ -0,0 +1,108 @@
+"""
+Tracing of the stages of a run, exported as Chrome trace JSON (chrome://tracing, https://ui.perfetto.dev).
+
+Stages are recorded as spans: breeding, writing and compiling bots, tournaments, waiting in the scheduler queue
+and for a free worker, starting worker JVMs and every match, tagged with the bots that play it. Spans are kept in
+memory and written to one file per generation (trace-gen-N.json) by flush(), and the final tournament to
+trace-final.json.
+
+Tracing is off unless configure_tracing() is given a directory. When it is off, span() returns a shared no-op
+context manager and nothing is recorded.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from src.util import timestamp
+
+_directory: Optional[str] = None
+_events: List[Dict] = []
+_threads: Dict[int, str] = {}  # Thread ID -> name, for the trace viewer's thread labels
+_lock = threading.Lock()
+_disabled = contextlib.nullcontext()
+
+
+def configure_tracing(directory: Optional[str] = None) -> None:
+    """Record spans and write them to this directory, or stop tracing if it is None."""
+    global _directory
+    with _lock:
+        _directory = directory
+        _events.clear()
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+
+
+def trace_directory() -> Optional[str]:
+    """Directory traces are written to, or None if tracing is off."""
+    return _directory
+
+
+def now() -> float:
+    """Clock that spans are measured with, for spans recorded with complete()."""
+    return time.perf_counter()
+
+
+def complete(name: str, category: str, start: float, end: Optional[float] = None, **args) -> None:
+    """Record a span that started at `start` (a now() value) and ended at `end` (default: now)."""
+    if _directory is None:
+        return
+    end = now() if end is None else end
+    thread = threading.current_thread()
+    event = {"name": name, "cat": category, "ph": "X", "ts": start * 1e6, "dur": (end - start) * 1e6,
+             "pid": os.getpid(), "tid": thread.ident, "args": args}
+    with _lock:
+        _events.append(event)
+        _threads[thread.ident] = thread.name
+
+
+class _Span:
+    def __init__(self, name: str, category: str, args: Dict):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = now()
+        return self
+
+    def __exit__(self, *exc_info):
+        complete(self.name, self.category, self.start, **self.args)
+
+
+def span(name: str, category: str = "stage", **args):
+    """Context manager recording the time spent in its block as a span with the given args."""
+    if _directory is None:
+        return _disabled
+    return _Span(name, category, args)
+
+
+def queued(fn: Callable) -> Callable:
+    """Wrap a scheduler job so the time between submitting and starting it is recorded as a span."""
+    if _directory is None:
+        return fn
+    submitted = now()
+
+    def job(*args):
+        complete("queued", "scheduler", submitted)
+        return fn(*args)
+    return job
+
+
+def flush(label: str) -> Optional[str]:
+    """Write the spans recorded so far to trace-<label>.json (e.g. trace-gen-3.json) and forget them."""
+    if _directory is None:
+        return None
+    with _lock:
+        events, threads = list(_events), dict(_threads)
+        _events.clear()
+    pid = os.getpid()
+    metadata = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                for tid, name in threads.items()]
+    path = os.path.join(_directory, f"trace-{label}.json")
+    with open(path, "w") as file:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, file)
+    print(f"{timestamp()} Wrote {len(events)} spans to {path}")
+    return path
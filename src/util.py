@@ -1,9 +1,14 @@
 import time
-from typing import List
+from typing import List, Optional
 
+from src.match_result import MatchResult
 from src.mutatable import Mutatable
 
 
+class TransientMatchError(RuntimeError):
+    """A match failed for reasons unrelated to the bots (e.g. a crashed worker) and can be retried."""
+
+
 def code_to_string(code: List[Mutatable]) -> str:
     """Convert a list of Mutatable objects into a string representation."""
     return "\n".join(str(mutatable) for mutatable in code)
@@ -24,6 +29,27 @@ def analyze_output(output: str) -> int:
     else:
         return 0
 
+def analyze_result(result: Optional[MatchResult]) -> int:
+    """
+    Determine if team A won a match reported by the match worker.
+    Fitness is 1 if 'A' wins, otherwise 0.
+    """
+    if result is None:
+        raise TransientMatchError("Match failed")
+    if result.error:
+        raise RuntimeError("Player not loaded", result.error)
+    return 1 if result.winner == "A" else 0
+
+def analyze_games(result: Optional[MatchResult], number_of_games: int) -> List[int]:
+    """
+    Determine if team A won each game of a multi-map match reported by the match worker.
+    Fitness is 1 for every game 'A' wins, otherwise 0.
+    """
+    analyze_result(result)
+    if len(result.games) != number_of_games:
+        raise TransientMatchError(f"Match reported {len(result.games)} of {number_of_games} games")
+    return [1 if game.winner == "A" else 0 for game in result.games]
+
 def timestamp() -> str:
     """Return the current time as a formatted string."""
     return time.strftime("[%Y-%m-%d %H:%M:%S]")
@@ -0,0 +1,114 @@
+import asyncio
+
+from src.adjudication import configure_truncation
+from src.async_engine import AsyncEngine, AsyncMatchWorker, MatchOutputParser
+from src.match_result import MatchResult
+from src.match_server import MatchServerPool, configure_pool, get_async_engine
+from src.scheduler import MatchScheduler
+
+
+class SleepingEngine(AsyncEngine):
+    """Engine whose matches sleep on the loop instead of running a server JVM; team A always wins."""
+
+    def __init__(self, concurrency: int):
+        super().__init__("", concurrency)
+        self.running = 0
+        self.peak = 0
+
+    async def run_match(self, match_id, properties):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.concurrency)
+        async with self.slots:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            await asyncio.sleep(0.05)
+            self.running -= 1
+        return MatchResult("A", properties["bc.game.team-a"])
+
+
+def robot_lines(round: int, health_a: int, health_b: int):
+    """Output of one round in which both teams report their state."""
+    lines = [f"[A: #1@{round}] hello", f"[B: #2@{round}] hello"]
+    if round % 50 == 0:
+        lines += [f"[A: #1@{round}] @@STATE 0 0 1 {health_a} 100", f"[B: #2@{round}] @@STATE 0 0 1 {health_b} 100"]
+    return lines
+
+
+def play(parser: MatchOutputParser, lines) -> list:
+    """Feed lines until the parser stops the server run; return whether each fed line was progress."""
+    progress = []
+    for line in lines:
+        if parser.finished or parser.truncated:
+            break
+        progress.append(parser.feed(line))
+    return progress
+
+
+def test_multi_map_adjudication():
+    configure_truncation(round_cap=100, audit=0)
+    try:
+        parser = MatchOutputParser(["Map1", "Map2"], {"A": "alpha", "B": "beta"}, round_cap=100)
+
+        # First server run: A is ahead at the cap, so the game ends as soon as round 101 starts
+        play(parser, [line for round in range(1, 200) for line in robot_lines(round, 500, 300)])
+        assert parser.truncated
+        assert [(game.winner, game.rounds) for game in parser.games] == [("A", 100)]
+        assert parser.remaining_maps == ["Map2"]
+        assert not parser.finished
+
+        # The next server run plays the remaining map from round 1; every new round is progress
+        parser.truncated = False
+        progress = play(parser, [line for round in range(1, 200) for line in robot_lines(round, 200, 400)])
+        assert parser.truncated and parser.finished
+        assert [(game.winner, game.rounds) for game in parser.games] == [("A", 100), ("B", 100)]
+        assert progress[0] and progress[2]
+        assert parser.result().winner_name == "alpha"
+    finally:
+        configure_truncation()
+
+
+def test_unreported_games_are_played_to_the_end():
+    configure_truncation(round_cap=100, audit=0)
+    try:
+        parser = MatchOutputParser(["Map1"], {"A": "alpha", "B": "examplefuncsplayer"}, round_cap=100)
+        lines = [line for round in range(1, 200) for line in robot_lines(round, 500, 300) if "B: #2" not in line
+                 or "@@STATE" not in line]
+        play(parser, lines + ["[server] alpha (A) wins (round 199)", "[server] Reason: tiebreakers"])
+        assert parser.finished and not parser.truncated
+        assert [(game.winner, game.rounds, game.reason) for game in parser.games] == [("A", 199, "tiebreakers")]
+    finally:
+        configure_truncation()
+
+
+def test_async_batches_are_bounded_by_the_engine_not_by_scheduler_threads():
+    engine = SleepingEngine(concurrency=4)
+    pool = MatchServerPool(1, lambda: AsyncMatchWorker(engine))
+    scheduler = MatchScheduler(concurrency=1)
+    try:
+        results = scheduler.map(lambda i: pool.submit_batch([(f"a{i}", f"b{i}", None)]), range(12))
+    finally:
+        scheduler.shutdown()
+        engine.close()
+    assert [batch[0].winner_name for batch in results] == [f"a{i}" for i in range(12)]
+    assert engine.peak == 4
+
+
+def test_exceptions_are_counted_from_profiles():
+    parser = MatchOutputParser(["Map1"], {"A": "alpha", "B": "beta"})
+    for line in ["[A: #1@1] GameActionException", "[A: #1@1] java.lang.IllegalStateException: GameActionException",
+                 "[A: #1@50] @@PROFILE 50 1000 40 0 2", "[B: #2@50] @@PROFILE 50 1000 40 0",
+                 "[A: #3@60] @@PROFILE 50 2000 60 1 1", "[A: #1@100] @@PROFILE 100 2000 40 0 3"]:
+        parser.feed(line)
+    teams = parser.result().teams
+    assert teams["A"]["exceptions"] == 4 and teams["A"]["outputLines"] == 2
+    assert teams["B"]["exceptions"] == 0 and teams["B"]["robots"] == 1
+
+
+def test_truncated_games_use_the_pool_settings(monkeypatch):
+    monkeypatch.setattr("src.async_engine.resolve_runtime_classpath", lambda: "classpath")
+    configure_pool(size=3, heap_mb=1024, stall_timeout=30.0)
+    try:
+        engine = get_async_engine()
+        assert (engine.concurrency, engine.heap_mb, engine.stall_timeout) == (3, 1024, 30.0)
+    finally:
+        configure_pool()
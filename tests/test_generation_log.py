@@ -0,0 +1,77 @@
+import os
+import random
+
+from src.genetic_algorithm import generate_random_code
+from src.generation_log import GenerationLog, read_index
+
+
+def population(size: int, seed: int):
+    rng = random.Random(seed)
+    return [(f"bot{seed}_{i}", generate_random_code(5, rng)) for i in range(size)]
+
+
+def log_generations(directory: str, count: int) -> GenerationLog:
+    log = GenerationLog(directory)
+    for generation in range(count):
+        members = population(4, generation)
+        log.append(generation, members, [(rank, code, name) for rank, (name, code) in enumerate(members)])
+    return log
+
+
+def test_generations_round_trip(tmp_path):
+    directory = str(tmp_path)
+    log_generations(directory, 2)
+    elites = population(4, 1)[:2]
+    GenerationLog(directory).append(2, elites + population(2, 2))
+    log = GenerationLog(directory)
+    assert log.generations() == [0, 1, 2]
+    loaded = log.load(2)
+    assert [name for name, _ in loaded.population] == [name for name, _ in elites + population(2, 2)]
+    assert [str(line) for line in loaded.population[0][1]] == [str(line) for line in elites[0][1]]
+    assert loaded.scores is None
+    assert log.load(1).scores[0] == (0, "bot1_0")
+    assert len(log.genome_offsets) == 10  # The elites' genomes were logged once
+
+
+def test_torn_record_is_dropped_on_the_next_append(tmp_path):
+    directory = str(tmp_path)
+    log = log_generations(directory, 2)
+    complete = log.generation_offsets[1]
+    with open(log.path, "r+b") as file:
+        file.truncate(log.end - 10)  # A crash while generation 1 was written
+
+    log = GenerationLog(directory)
+    assert log.generations() == [0] and log.end == complete
+    log.append(2, population(4, 2))
+    log = GenerationLog(directory)
+    assert log.generations() == [0, 2]
+    assert [name for name, _ in log.load(2).population] == [name for name, _ in population(4, 2)]
+    assert read_index(directory)[2]["end"] == os.path.getsize(log.path)
+
+
+def test_corrupt_last_record_is_dropped(tmp_path):
+    directory = str(tmp_path)
+    log = log_generations(directory, 2)
+    with open(log.path, "r+b") as file:
+        file.seek(log.end - 4)
+        file.write(b"\xff\xff\xff\xff")  # Same length, but the checksum doesn't match
+    assert GenerationLog(directory).generations() == [0]
+
+
+def test_partial_header_is_ignored(tmp_path):
+    directory = str(tmp_path)
+    log = log_generations(directory, 1)
+    with open(log.path, "ab") as file:
+        file.write(b"GL\x02")
+    assert GenerationLog(directory).end == log.end
+
+
+def test_index_is_rebuilt_after_a_crash(tmp_path):
+    directory = str(tmp_path)
+    log = log_generations(directory, 3)
+    with open(log.path, "r+b") as file:
+        file.truncate(log.end - 1)
+    index = read_index(directory)
+    assert sorted(index) == [0, 1]
+    assert index[1]["best"] == "bot1_0"
+    assert index[1]["offset"] == GenerationLog(directory).generation_offsets[1]
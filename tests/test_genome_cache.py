@@ -0,0 +1,66 @@
+import os
+import random
+
+import pytest
+
+from src import genome_cache
+from src.genetic_algorithm import generate_random_code
+from src.genome_cache import GenomeCache
+
+CLASS_BYTES = 1000
+
+
+@pytest.fixture
+def javac(monkeypatch):
+    """Stand-in for javac that writes a class file of CLASS_BYTES next to every source; returns the compiled ones."""
+    compiled = []
+
+    def run_javac(sources, output_path, classpath):
+        for source in sources:
+            with open(os.path.join(os.path.dirname(source), "RobotPlayer.class"), "wb") as file:
+                file.write(b"\0" * CLASS_BYTES)
+            compiled.append(os.path.basename(os.path.dirname(source)))
+    monkeypatch.setattr(genome_cache, "run_javac", run_javac)
+    monkeypatch.setattr(genome_cache, "resolve_runtime_classpath", lambda: "classpath")
+    return compiled
+
+
+def genomes(number: int):
+    rng = random.Random(0)
+    return [generate_random_code(5, rng) for _ in range(number)]
+
+
+def test_cached_genomes_are_not_recompiled(tmp_path, javac):
+    cache = GenomeCache(str(tmp_path))
+    packages = [cache.add(code) for code in genomes(3)]
+    assert cache.compile(packages) == 3
+    assert cache.add(genomes(1)[0]) == packages[0]
+    assert cache.compile(packages) == 0
+    # The index survives a restart
+    assert GenomeCache(str(tmp_path)).is_compiled(packages[2])
+    assert len(javac) == 3
+
+
+def test_least_recently_used_genomes_are_evicted(tmp_path, javac, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(genome_cache.time, "time", lambda: next(clock))
+    cache = GenomeCache(str(tmp_path))
+    codes = genomes(5)
+    packages = [cache.add(code) for code in codes]
+    for package in packages[:4]:
+        cache.compile([package])
+    entry_bytes = cache.index[packages[0]]["size"]
+    cache.max_bytes = 4 * entry_bytes
+    cache.add(codes[0])  # Used again, so packages[1] is now the least recently used entry
+    cache.compile([packages[4]])
+    assert not cache.is_compiled(packages[1]) and not os.path.exists(cache.entry_path(packages[1]))
+    assert all(cache.is_compiled(package) for package in packages if package != packages[1])
+
+
+def test_packages_of_a_generation_are_never_evicted(tmp_path, javac):
+    cache = GenomeCache(str(tmp_path), max_bytes=0)
+    packages = [cache.add(code) for code in genomes(3)]
+    cache.compile(packages)
+    assert all(cache.is_compiled(package) for package in packages)
+    cache.compile(packages[:1])
+    assert [cache.is_compiled(package) for package in packages] == [True, False, False]
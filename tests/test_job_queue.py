@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.fake_engine import FakeMatchWorker
+from src.job_queue import JobQueue, QueueMatchWorker
+from src.match_server import configure_pool, match_properties
+
+LEASE_TIMEOUT = 2.0
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_worker(path: str, latency: float = 0.0) -> subprocess.Popen:
+    """Start a job-queue worker process on the fake engine, with one slot."""
+    code = ("from src.fake_engine import configure_fake_engine\n"
+            "from src.job_queue import run_worker\n"
+            f"configure_fake_engine(latency={latency})\n"
+            f"run_worker({path!r}, 1, fake_engine=True, lease_timeout={LEASE_TIMEOUT})\n")
+    environment = dict(os.environ, PYTHONPATH=REPOSITORY)
+    return subprocess.Popen([sys.executable, "-c", code], cwd=REPOSITORY, env=environment,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_for(condition, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.1)
+
+
+def test_job_of_a_killed_worker_is_played_by_another(tmp_path, capsys):
+    path = str(tmp_path)
+    queue = JobQueue(path, LEASE_TIMEOUT)
+    requests = [(str(i), match_properties(f"a{i}", f"b{i}", {"maps": "Map1,Map2"})) for i in range(3)]
+    configure_pool(fake_engine=True)
+    slow = start_worker(path, latency=600)
+    fast = None
+    try:
+        with ThreadPoolExecutor(1) as executor:
+            future = executor.submit(QueueMatchWorker(queue).run_batch, requests)
+            wait_for(lambda: os.listdir(queue.leases_path))
+            slow.kill()
+            slow.wait()
+            fast = start_worker(path)
+            results = future.result(timeout=60)
+    finally:
+        queue.stop()
+        slow.kill()
+        if fast is not None:
+            fast.wait(timeout=30)
+        configure_pool()
+    assert results == FakeMatchWorker().run_batch(requests)
+    assert "lost, re-queued job" in capsys.readouterr().out
+    assert not os.listdir(queue.leases_path) and not os.listdir(queue.results_path)
+
+
+def test_requeued_job_cannot_be_completed(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    job_id = queue.submit([("0", match_properties("a", "b"))])
+    _, requests, lease_path = queue.claim("worker")
+    assert queue.requeue(lease_path, job_id)
+    assert not queue.complete(job_id, lease_path, "worker", [None])
+    assert queue.result(job_id) is None
+    assert os.listdir(queue.jobs_path) == [job_id + ".json"]
+
+
+def test_results_of_another_engine_are_rejected(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    requests = [("0", match_properties("a", "b"))]
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(QueueMatchWorker(queue).run_batch, requests)
+        wait_for(lambda: os.listdir(queue.jobs_path))
+        job_id, _, lease_path = queue.claim("worker")
+        queue.complete(job_id, lease_path, "worker", FakeMatchWorker().run_batch(requests), "fake")
+        try:
+            future.result(timeout=10)
+        except RuntimeError as e:
+            assert "fake engine" in str(e)
+        else:
+            raise AssertionError("results of the fake engine were accepted")
@@ -0,0 +1,56 @@
+from src.fake_engine import FakeMatchWorker
+from src.match_server import MAX_MATCHES_PER_WORKER, MatchServerPool, match_properties
+
+
+class CrashingWorker(FakeMatchWorker):
+    """Fake worker that dies on its first batch."""
+
+    def run_batch(self, requests):
+        self.crashed = True
+        raise RuntimeError("Worker exited")
+
+    def alive(self):
+        return not getattr(self, "crashed", False)
+
+
+def recording_factory(started: list):
+    """Factory of fake workers that remembers every worker it started."""
+    def factory():
+        started.append(FakeMatchWorker())
+        return started[-1]
+    return factory
+
+
+def test_batches_are_played_in_order_on_one_worker():
+    started = []
+    pool = MatchServerPool(1, recording_factory(started))
+    results = pool.run_batch([("a", "b", {"maps": "Map1,Map2"}), ("b", "a", None)])
+    assert [len(result.games) for result in results] == [2, 1]
+    assert results[0].winner_name in ("a", "b") and results[1].winner_name in ("a", "b")
+    pool.run_match("a", "b")
+    assert len(started) == 1 and started[0].matches_played == 3
+
+
+def test_failed_worker_is_replaced():
+    factories = [CrashingWorker, FakeMatchWorker]
+    pool = MatchServerPool(1, lambda: factories.pop(0)())
+    assert pool.run_batch([("a", "b", None), ("c", "d", None)]) == [None, None]
+    assert pool.run_match("a", "b") is not None
+    assert not factories
+
+
+def test_workers_are_recycled():
+    started = []
+    pool = MatchServerPool(1, recording_factory(started))
+    pool.run_batch([("a", "b", None)] * MAX_MATCHES_PER_WORKER)
+    pool.run_match("a", "b")
+    assert len(started) == 2
+
+
+def test_overrides_replace_gradle_properties():
+    properties = match_properties("a", "b", {"maps": "Map1,Map2", "classLocationA": "/cache", "seed": "3"})
+    assert properties["bc.game.maps"] == "Map1,Map2"
+    assert properties["bc.game.team-a.url"] == "/cache"
+    assert properties["bc.game.team-b.package"] == "b"
+    assert properties["matchworker.seed"] == "3"
+    assert "matchworker.round-cap" not in properties
@@ -0,0 +1,72 @@
+from array import array
+
+from src.mutatable import TYPECODE, _from_nodes, template_ids, type_ids
+from src.normalize import normalize, normalize_line
+
+DIG = "if (rc.canDig([$LOC_RAD_TWO1])) rc.dig([$LOC_RAD_TWO1]);"
+TRANSLATE = "rc.getLocation().translate([$INTTWO1], [$INTTWO2])"
+MOVE_AND_ATTACK = next(value for value in template_ids if str(value).startswith("if (rc.canMove"))
+
+
+def line(*templates):
+    """A line from the templates of its nodes in depth-first order."""
+    return _from_nodes(array(TYPECODE, [type_ids["action"]] + [template_ids[value] for value in templates]))
+
+
+def guarded(operator: str, left: str, right: str, *action):
+    return line(f"if ([$INT1] {operator} [$INT2]) [$ACTION1]", left, right, *action)
+
+
+dig = (DIG, TRANSLATE, "rc.getRoundNum()", "rc.getHealth()")
+
+
+def test_false_conditions_drop_the_line():
+    assert normalize_line(guarded(">", "rc.getMapWidth()", "GameConstants.SETUP_ROUNDS", *dig)) is None
+    assert normalize_line(guarded("!=", "rc.getCrumbs()", "rc.getCrumbs()", *dig)) is None
+    assert normalize_line(guarded("==", "rc.getMapHeight()", "GameConstants.SETUP_ROUNDS", *dig)) is None
+
+
+def test_true_conditions_are_removed():
+    plain = str(line(*dig))
+    assert str(normalize_line(guarded(">", "GameConstants.SETUP_ROUNDS", "rc.getMapWidth()", *dig))) == plain
+    assert str(normalize_line(guarded("==", "rc.getCrumbs()", "rc.getCrumbs()", *dig))) == plain
+    assert str(normalize_line(guarded("==", "GameConstants.SETUP_ROUNDS", "GameConstants.SETUP_ROUNDS",
+                                      *dig))) == plain
+
+
+def test_conditions_that_depend_on_the_game_are_kept():
+    for operator, left, right in [(">", "rc.getRoundNum()", "GameConstants.SETUP_ROUNDS"),
+                                  ("==", "rc.getMapWidth()", "rc.getHealth()")]:
+        original = guarded(operator, left, right, *dig)
+        assert normalize_line(original) is original  # Already canonical, so the line is shared
+    line_with_bool = line("if ([$BOOL1]) [$ACTION1]", "rc.hasFlag()", *dig)
+    assert normalize_line(line_with_bool) is line_with_bool
+
+
+def test_nested_conditions_fold_one_by_one():
+    nested = line("if ([$INT1] > [$INT2]) [$IF1]", "rc.getRoundNum()", "rc.getHealth()",
+                  "if ([$INT1] != [$INT2]) [$ACTION1]", "rc.getMapWidth()", "GameConstants.SETUP_ROUNDS", *dig)
+    assert str(normalize_line(nested)) == str(guarded(">", "rc.getRoundNum()", "rc.getHealth()", *dig))
+
+
+def test_operands_of_equality_are_ordered():
+    a = normalize_line(guarded("==", "rc.getHealth()", "rc.getMapWidth()", *dig))
+    b = normalize_line(guarded("==", "rc.getMapWidth()", "rc.getHealth()", *dig))
+    assert a.nodes == b.nodes
+    c = normalize_line(guarded(">", "rc.getHealth()", "rc.getMapWidth()", *dig))
+    d = normalize_line(guarded(">", "rc.getMapWidth()", "rc.getHealth()", *dig))
+    assert c.nodes != d.nodes  # > isn't symmetric
+
+
+def test_actions_of_several_statements_keep_false_conditions():
+    action = (MOVE_AND_ATTACK, "directions[0]", "rc.getLocation().translate([$INTFOUR1], [$INTFOUR2])",
+              "rc.getRoundNum()", "rc.getHealth()")
+    original = guarded(">", "rc.getMapWidth()", "GameConstants.SETUP_ROUNDS", *action)
+    assert normalize_line(original) is original
+
+
+def test_repeated_guarded_actions_are_dropped():
+    code = [line(*dig), line(*dig), line("tryPickupFlag(rc);"), line("tryPickupFlag(rc);"), line(*dig)]
+    normalized = normalize(code)
+    assert [str(code_line) for code_line in normalized] == [str(code[0]), str(code[2]), str(code[3]), str(code[4])]
+    assert normalized[0] is code[0]
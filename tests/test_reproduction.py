@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+from src import reproduction
+from src.genetic_algorithm import generate_random_code, make_offspring
+from src.mutatable import _skip
+from src.util import code_to_string
+
+pytestmark = pytest.mark.skipif(not reproduction.available(), reason="NumPy is not installed")
+
+
+def test_batched_breeding_is_reproducible_and_keeps_parents():
+    random.seed(0)
+    top_individuals = [(rank, generate_random_code(random.randint(0, 60)), str(rank)) for rank in range(100)]
+    parents = [code_to_string(code) for _, code, _ in top_individuals]
+    state = random.getstate()
+    offspring, lineage = make_offspring(top_individuals, 300)
+    random.setstate(state)
+    again, again_lineage = make_offspring(top_individuals, 300)
+
+    assert [code_to_string(code) for code in offspring] == [code_to_string(code) for code in again]
+    assert lineage == again_lineage and len(offspring) == 300
+    assert [code_to_string(code) for _, code, _ in top_individuals] == parents
+    for code in offspring:
+        for line in code:
+            assert _skip(line.nodes, 1) == len(line.nodes)  # Every line is one complete tree
+
+
+def test_batched_breeding_draws_like_the_operators():
+    random.seed(1)
+    parents = [generate_random_code(50) for _ in range(200)]
+    offspring, lineage = reproduction.breed(parents, 4000, 2)
+    parent_lines = {id(line) for code in parents for line in code}
+    mutations = [code for code, indices in zip(offspring, lineage) if len(indices) == 1]
+    new_lines = sum(id(line) not in parent_lines for code in offspring for line in code)
+
+    assert 0.45 < len(mutations) / len(offspring) < 0.55
+    assert all(len(code) == 50 for code, indices in zip(offspring, lineage) if len(indices) == 2)
+    # Mutation changes 20% of the lines and adds 10%, so about 15% of all lines are new
+    assert 0.13 < new_lines / sum(len(code) for code in offspring) < 0.17
@@ -0,0 +1,125 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from src.scheduler import MatchScheduler, completed, then
+from src.util import TransientMatchError
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def flaky(failures: int):
+    """Job that fails transiently `failures` times, then returns how many attempts it took."""
+    attempts = []
+
+    def job(value):
+        attempts.append(value)
+        if len(attempts) <= failures:
+            raise TransientMatchError("Worker crashed")
+        return len(attempts)
+    return job
+
+
+def test_transient_failures_are_retried():
+    scheduler = MatchScheduler(1, retries=2)
+    try:
+        assert scheduler.submit(flaky(2), "x").result(timeout=5) == 3
+        with pytest.raises(TransientMatchError):
+            scheduler.submit(flaky(3), "x").result(timeout=5)
+    finally:
+        scheduler.shutdown()
+
+
+def test_other_failures_are_not_retried():
+    attempts = []
+
+    def job():
+        attempts.append(1)
+        raise ValueError("Player not loaded")
+    scheduler = MatchScheduler(1, retries=2)
+    try:
+        with pytest.raises(ValueError):
+            scheduler.submit(job).result(timeout=5)
+    finally:
+        scheduler.shutdown()
+    assert len(attempts) == 1
+
+
+def test_retries_jump_the_queue():
+    order = []
+    release = threading.Event()
+
+    def blocker():
+        release.wait(5)
+
+    def job(name):
+        order.append(name)
+        if name == "flaky" and order.count("flaky") == 1:
+            raise TransientMatchError("Worker crashed")
+    scheduler = MatchScheduler(1)
+    try:
+        scheduler.submit(blocker)
+        futures = [scheduler.submit(job, name) for name in ("flaky", "a", "b")]
+        release.set()
+        for future in futures:
+            future.result(timeout=5)
+    finally:
+        scheduler.shutdown()
+    assert order == ["flaky", "flaky", "a", "b"]
+
+
+def test_submit_blocks_while_the_queue_is_full():
+    release = threading.Event()
+    scheduler = MatchScheduler(1, max_queued=2)
+    submitted = []
+
+    def submit_three():
+        for i in range(3):
+            scheduler.submit(release.wait, 5)
+            submitted.append(i)
+    thread = threading.Thread(target=submit_three)
+    try:
+        thread.start()
+        time.sleep(0.2)
+        assert submitted == [0, 1]  # The third job waits for capacity
+        release.set()
+        thread.join(5)
+        assert submitted == [0, 1, 2]
+    finally:
+        release.set()
+        scheduler.shutdown()
+
+
+def test_asynchronous_jobs_free_their_thread_but_hold_capacity():
+    started = {}  # Job -> futures of its attempts
+
+    def job(i):
+        started.setdefault(i, []).append(Future())
+        return started[i][-1]
+    scheduler = MatchScheduler(1, max_queued=3)
+    try:
+        futures = [scheduler.submit(job, i) for i in range(3)]
+        wait_for(lambda: len(started) == 3)  # All three are in flight on a single thread
+        assert not scheduler.capacity.acquire(timeout=0.2)
+        started[1][0].set_exception(TransientMatchError("Worker crashed"))
+        wait_for(lambda: len(started[1]) == 2)
+        for i, result in enumerate(["first", "second", "third"]):
+            started[i][-1].set_result(result)
+        assert [future.result(timeout=5) for future in futures] == ["first", "second", "third"]
+        assert scheduler.capacity.acquire(timeout=1)
+    finally:
+        scheduler.shutdown()
+
+
+def test_then_chains_results_and_futures():
+    assert then(completed(2), lambda x: x * 3).result() == 6
+    assert then(completed(2), lambda x: completed(x + 1)).result() == 3
+    with pytest.raises(ZeroDivisionError):
+        then(completed(0), lambda x: 1 / x).result()
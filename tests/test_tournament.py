@@ -0,0 +1,99 @@
+import math
+
+import pytest
+
+from src import battlecode_runner
+from src.fake_engine import configure_fake_engine, games_played, hidden_skill
+from src.match_server import configure_pool, shutdown_pool
+from src.result_store import configure_result_store
+from src.scheduler import shutdown_scheduler
+from src.tournament import binomial_p_value, run_series, run_swiss_tournament
+
+
+@pytest.fixture
+def fake_engine():
+    """Fake engine in which the bot of the stronger genome (almost) always wins, without a result store."""
+    configure_result_store(enabled=False)
+    configure_pool(size=1, fake_engine=True)
+    configure_fake_engine(winners="skill", skill_spread=100)
+    packages = {f"bot{i}": f"genome{i}" for i in range(9)}
+    battlecode_runner.bot_packages.update(packages)
+    yield sorted(packages, key=lambda name: -hidden_skill(packages[name]))  # Strongest first
+    shutdown_pool()
+    for name in packages:
+        del battlecode_runner.bot_packages[name]
+    configure_fake_engine()
+    configure_pool()
+    configure_result_store()
+
+
+def test_binomial_p_value():
+    assert binomial_p_value(5, 10) == 1.0
+    assert binomial_p_value(0, 4) == pytest.approx(0.125)
+    assert binomial_p_value(8, 8) == pytest.approx(2 / 256)
+    assert binomial_p_value(9, 10) == pytest.approx(2 * (math.comb(10, 9) + 1) / 1024)
+    assert binomial_p_value(2, 10) == binomial_p_value(8, 10)
+
+
+def test_series_stops_once_significant(fake_engine):
+    strong, weak = fake_engine[0], fake_engine[-1]
+    maps = [f"Map{i}" for i in range(8)]
+    # 4-0 after the first wave isn't significant at 0.05, 8-0 after the second is
+    assert run_series(weak, strong, maps, [0, 1], alpha=0.05) == (strong, weak)
+    assert games_played() == 8
+
+
+def test_series_stops_once_decided(fake_engine):
+    strong, weak = fake_engine[0], fake_engine[-1]
+    maps = [f"Map{i}" for i in range(8)]
+    # Without the significance test, the series goes on until the strong bot has won the majority of 16 games
+    assert run_series(strong, weak, maps, [0, 1], alpha=0.0) == (strong, weak)
+    assert games_played() == 12
+
+
+def test_waves_never_mix_seeds(fake_engine):
+    strong, weak = fake_engine[0], fake_engine[-1]
+    # One map, three seeds: every seed is a wave of its own, and 2-0 is already the majority of three games
+    assert run_series(strong, weak, ["Map0"], [0, 1, 2], alpha=0.0) == (strong, weak)
+    assert games_played() == 2
+
+
+def swiss_rounds_played(names, matches, games_per_round):
+    """Split the games of a Swiss tournament into rounds; return the games and the bye of every round."""
+    rounds = []
+    for start in range(0, len(matches), games_per_round):
+        games = matches[start:start + games_per_round]
+        players = {name for game in games for name in game}
+        assert len(players) == 2 * len(games)  # Nobody plays twice in a round
+        rounds.append((games, set(names) - players))
+    return rounds
+
+
+def test_swiss_with_an_odd_number_of_bots(fake_engine):
+    names = fake_engine[:7]
+    try:
+        ranking, matches = run_swiss_tournament(names, rounds=3)
+    finally:
+        shutdown_scheduler()
+    rounds = swiss_rounds_played(names, matches, 3)
+    assert len(rounds) == 3
+    byes = [bye for _, round_byes in rounds for bye in round_byes]
+    assert len(byes) == 3 and len(set(byes)) == 3  # One bye per round, never twice to the same bot
+    assert byes[0] == names[-1]  # Everyone has 0 points in the first round, so the last name gets the bye
+    pairs = [frozenset(game) for game in matches]
+    assert len(set(pairs)) == len(pairs)  # Seven bots have enough opponents to avoid rematches over three rounds
+    points = {name: byes.count(name) + sum(winner == name for winner, _ in matches) for name in names}
+    assert sorted(ranking) == sorted(names)
+    assert [points[name] for name in ranking] == sorted(points.values(), reverse=True)
+    assert points[names[0]] == points[ranking[0]] == 3  # The strongest bot wins all its games
+
+
+def test_swiss_with_an_even_number_of_bots_has_no_byes(fake_engine):
+    names = fake_engine[:4]
+    try:
+        ranking, matches = run_swiss_tournament(names)
+    finally:
+        shutdown_scheduler()
+    rounds = swiss_rounds_played(names, matches, 2)
+    assert len(rounds) == 2 and all(not bye for _, bye in rounds)
+    assert ranking[0] == names[0] and ranking[-1] == names[-1]